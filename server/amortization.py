@@ -0,0 +1,119 @@
+import calendar
+import datetime
+from bisect import bisect_right
+from collections import namedtuple
+from itertools import accumulate
+
+# loans carry no term yet, the web client assumed 12 monthly installments
+DEFAULT_TERM_MONTHS = 12
+
+# amounts are rounded to cents, a loan counts as paid off within a cent
+CENT = 0.01
+
+Installment = namedtuple(
+    "Installment",
+    ["number", "due_date", "amount", "principal", "interest", "balance"],
+)
+
+LoanBalance = namedtuple(
+    "LoanBalance",
+    [
+        "total_due",
+        "amount_paid",
+        "outstanding_balance",
+        "next_payment_due",
+        "progress_percentage",
+    ],
+)
+
+
+def add_months(date, months):
+    """date moved by whole months, the day is clamped to the month end"""
+    month_index = date.year * 12 + date.month - 1 + months
+    year, month = divmod(month_index, 12)
+    day = min(date.day, calendar.monthrange(year, month + 1)[1])
+    return datetime.date(year, month + 1, day)
+
+
+def loan_term(loan):
+    """number of monthly installments of a loan"""
+    return loan.get("term_months") or DEFAULT_TERM_MONTHS
+
+
+def amortization_schedule(principal, interest_rate, term_months, due_date):
+    """monthly installments paying a loan off by its due date
+
+    interest_rate is the yearly rate in percent, interest accrues
+    monthly on the remaining balance and every installment is the same
+    annuity amount. Amounts are rounded to cents, the last installment
+    takes the rounding difference so the balance ends at zero. The last
+    installment is due on due_date, the others a month apart before it.
+    """
+    rate = interest_rate / 100 / 12
+    if rate:
+        amount = principal * rate / (1 - (1 + rate) ** -term_months)
+    else:
+        amount = principal / term_months
+    amount = round(amount, 2)
+
+    installments = []
+    balance = principal
+    for number in range(1, term_months + 1):
+        interest = round(balance * rate, 2)
+        repaid = amount - interest
+        if number == term_months:
+            repaid = balance
+        balance = round(balance - repaid, 2)
+        installments.append(
+            Installment(
+                number=number,
+                due_date=add_months(due_date, number - term_months),
+                amount=round(repaid + interest, 2),
+                principal=round(repaid, 2),
+                interest=interest,
+                balance=balance,
+            )
+        )
+    return tuple(installments)
+
+
+class LoanSchedule:
+    """a loan's amortization schedule and its running totals
+
+    built once per loan, the balance for any amount paid is then found
+    by bisecting the cumulative installment amounts
+    """
+
+    def __init__(self, loan):
+        self.installments = amortization_schedule(
+            loan["principal"],
+            loan["interest_rate"],
+            loan_term(loan),
+            loan["due_date"],
+        )
+        self._cumulative = list(
+            accumulate(installment.amount for installment in self.installments)
+        )
+        self.total_due = round(self._cumulative[-1], 2)
+
+    def balance(self, amount_paid):
+        """LoanBalance once amount_paid has been paid towards the loan"""
+        # installments are covered in order, the first one not fully
+        # covered is the next one due
+        covered = bisect_right(self._cumulative, amount_paid + CENT / 2)
+        next_payment_due = None
+        if covered < len(self.installments):
+            next_payment_due = self.installments[covered].due_date
+
+        progress = 100.0
+        if self.total_due > 0:
+            progress = min(100.0, amount_paid / self.total_due * 100)
+        return LoanBalance(
+            total_due=self.total_due,
+            amount_paid=round(amount_paid, 2),
+            outstanding_balance=max(
+                0.0, round(self.total_due - amount_paid, 2)
+            ),
+            next_payment_due=next_payment_due,
+            progress_percentage=round(progress, 2),
+        )
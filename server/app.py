@@ -1,34 +1,149 @@
-from flask import Blueprint, Flask
-from flask_cors import CORS
-from flask_graphql import GraphQLView
+import os
 
+from flask import Blueprint, Flask, Response
+from flask_cors import CORS
 
+import state
+from encoding import FastJSONProvider
+from events import default_max_subscribers
+from graphql_api.backend import CachedDocumentBackend
+from graphql_api.cost import (
+    DEFAULT_MAX_QUERY_COST,
+    DEFAULT_MAX_QUERY_DEPTH,
+    store_list_sizes,
+)
+from graphql_api.response_cache import ResponseCache
 from graphql_api.schema import schema
-from rest_api.payments import add_payment
+from graphql_api.view import LoanGraphQLView
+from metrics import REGISTRY
+from profiling import profiled
+from rest_api.export import export_loans
+from rest_api.feed import payment_events
+from rest_api.idempotency import IdempotencyCache, idempotent
+from rest_api.payments import add_payment, add_payments_batch
+from rest_api.timing import record_request_time, start_request_timer
 
 
 app = Flask(__name__)
+# jsonify through orjson when it is installed, see encoding.py
+app.json = FastJSONProvider(app)
 CORS(app, resources={r"/*": {"origins": ["http://localhost:5173"]}})
 
+# share of graphql requests whose resolvers are timed for /metrics
+app.config["METRICS_SAMPLE_RATE"] = float(
+    os.environ.get("METRICS_SAMPLE_RATE", "1.0")
+)
+
+# PROFILING_TOKEN enables profiling requests that send it in the
+# X-Profile-Token header, reports that can't go in the response are
+# written to PROFILE_DIR, see profiling.py
+app.config["PROFILING_TOKEN"] = os.environ.get("PROFILING_TOKEN")
+app.config["PROFILE_DIR"] = os.environ.get("PROFILE_DIR")
+
+# seconds between keepalive comments on idle payment event streams, and
+# streams open at once per worker, each one holds a worker thread, or a
+# greenlet when served by serve.py
+app.config["EVENT_STREAM_HEARTBEAT"] = float(
+    os.environ.get("EVENT_STREAM_HEARTBEAT", "15")
+)
+app.config["EVENT_STREAM_MAX_SUBSCRIBERS"] = int(
+    os.environ.get("EVENT_STREAM_MAX_SUBSCRIBERS", default_max_subscribers())
+)
+
+
+# parsed and validated documents shared by every request, queries over
+# the depth or cost limit are rejected before any resolver runs, plain
+# lists are costed by the size of the portfolio and the cost limit is
+# never below listing it all once, what the web client's GetLoans does
+graphql_backend = CachedDocumentBackend(
+    max_depth=int(
+        os.environ.get("GRAPHQL_MAX_DEPTH", DEFAULT_MAX_QUERY_DEPTH)
+    ),
+    max_cost=int(os.environ.get("GRAPHQL_MAX_COST", DEFAULT_MAX_QUERY_COST)),
+    list_sizes=store_list_sizes,
+)
+
+# encoded read query responses, keyed on the store data version
+graphql_response_cache = ResponseCache()
+
+# created payment responses by Idempotency-Key, so client retries don't
+# add the same payment twice
+payment_idempotency_cache = IdempotencyCache()
 
 app.add_url_rule(
     "/graphql/v1",
-    view_func=GraphQLView.as_view("graphql_v1", schema=schema, graphiql=True),
+    view_func=LoanGraphQLView.as_view(
+        "graphql_v1",
+        schema=schema,
+        graphiql=os.environ.get("GRAPHIQL", "1") == "1",
+        backend=graphql_backend,
+        response_cache=graphql_response_cache,
+    ),
 )
 
 
+@app.teardown_appcontext
+def release_store_connection(exception=None):
+    """hand the request thread's database connection back to the pool"""
+    release = getattr(state.store, "release_connection", None)
+    if release is not None:
+        release()
+
+
+@app.after_request
+def release_store_connection_after_stream(response):
+    # streamed bodies like the export read the store after the teardown
+    if response.is_streamed:
+        response.call_on_close(release_store_connection)
+    return response
+
+
 @app.route("/")
 def home():
     return "Welcome to the Loan Application API"
 
 
+@app.route("/metrics")
+def metrics():
+    """latency histograms in the prometheus text format"""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
 # rest api versioning
 api_v1 = Blueprint("api_v1", __name__, url_prefix="/api/v1")
 
 # add payments api
-api_v1.add_url_rule("/payments", methods=["POST"], view_func=add_payment)
+api_v1.add_url_rule(
+    "/payments",
+    methods=["POST"],
+    view_func=idempotent(payment_idempotency_cache)(add_payment),
+)
+api_v1.add_url_rule(
+    "/payments/batch", methods=["POST"], view_func=add_payments_batch
+)
+
+# added payments pushed to dashboards as server-sent events
+api_v1.add_url_rule(
+    "/payments/events", methods=["GET"], view_func=payment_events
+)
+
+# streamed loan book export
+api_v1.add_url_rule("/export", methods=["GET"], view_func=export_loans)
+
+# request timings of the rest api for /metrics
+api_v1.before_request(start_request_timer)
+api_v1.after_request(record_request_time)
 
 app.register_blueprint(api_v1)
 
+# opt in profiling of single graphql and rest api requests, the event
+# stream never ends and would hold the profile for as long as it is open
+UNPROFILED_ENDPOINTS = {f"{api_v1.name}.{payment_events.__name__}"}
+for endpoint, view in list(app.view_functions.items()):
+    if endpoint in UNPROFILED_ENDPOINTS:
+        continue
+    if endpoint == "graphql_v1" or endpoint.startswith(f"{api_v1.name}."):
+        app.view_functions[endpoint] = profiled(view)
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", debug=True)
@@ -0,0 +1,83 @@
+import datetime
+import random
+
+import state
+from storage.sqlite import SQLiteStore
+
+# due dates are spread over this year, payments land around them
+DUE_DATE_START = datetime.date(2025, 1, 1)
+DUE_DATE_DAYS = 365
+
+# share of payments recorded without a payment date
+UNPAID_SHARE = 0.05
+
+
+def generate_loans(count, seed=0):
+    """count loans with ids 1..count, the same for the same seed"""
+    rng = random.Random(seed)
+    return [
+        {
+            "id": loan_id,
+            "name": f"Loan {loan_id}",
+            "interest_rate": round(rng.uniform(1.0, 10.0), 1),
+            "principal": rng.randrange(1000, 500_000, 500),
+            "due_date": DUE_DATE_START
+            + datetime.timedelta(days=rng.randrange(DUE_DATE_DAYS)),
+        }
+        for loan_id in range(1, count + 1)
+    ]
+
+
+def generate_payments(loans, count, seed=0):
+    """count payments over loans, the same for the same seed
+
+    payments are paid between 10 days early and 60 days late, so every
+    status shows up, and get ids in payment date order like payments
+    recorded as they come in. Undated payments come last.
+    """
+    rng = random.Random(seed)
+    payments = []
+    for _ in range(count):
+        loan = rng.choice(loans)
+        payment_date = None
+        if rng.random() >= UNPAID_SHARE:
+            payment_date = loan["due_date"] + datetime.timedelta(
+                days=rng.randint(-10, 60)
+            )
+        payments.append(
+            {
+                "loan_id": loan["id"],
+                "payment_amount": float(rng.randrange(100, 50_000, 50)),
+                "payment_date": payment_date,
+            }
+        )
+
+    payments.sort(
+        key=lambda p: p["payment_date"] or datetime.date.max,
+    )
+    for payment_id, payment in enumerate(payments, start=1):
+        payment["id"] = payment_id
+    return payments
+
+
+def populate_state(loan_count, payment_count, seed=0, store_class=None):
+    """replace state.loans, state.loan_payments and state.store
+
+    store_class defaults to the backend picked by STORE_BACKEND, the
+    new store is returned. The sqlite backend gets a fresh temporary
+    database instead of SQLITE_PATH, whose rows would be kept over the
+    generated ones.
+    """
+    loans = generate_loans(loan_count, seed)
+    payments = generate_payments(loans, payment_count, seed)
+    if store_class is None:
+        store_class = (
+            SQLiteStore
+            if state.STORE_BACKEND == "sqlite"
+            else state.STORE_BACKENDS[state.STORE_BACKEND]
+        )
+
+    state.loans = loans
+    state.loan_payments = payments
+    state.store = store_class(loans, payments)
+    return state.store
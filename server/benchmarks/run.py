@@ -0,0 +1,288 @@
+import argparse
+import datetime
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from app import app, graphql_backend, graphql_response_cache
+from benchmarks.datagen import populate_state
+from utils import get_payment_status, get_payment_statuses
+
+NESTED_LOANS_QUERY = "{ loans { id loanPayments { id status } } }"
+
+# calls of the scalar functions timed together, one call is too short
+# to time on its own
+SCALAR_BATCH = 1000
+
+
+def graphql_nested_loans(client, store, rng, cached=False):
+    body = json.dumps({"query": NESTED_LOANS_QUERY})
+
+    def run():
+        if not cached:
+            graphql_response_cache.clear()
+        response = client.post(
+            "/graphql/v1", data=body, content_type="application/json"
+        )
+        assert response.status_code == 200, response.data
+
+    return run
+
+
+def graphql_nested_loans_cached(client, store, rng):
+    return graphql_nested_loans(client, store, rng, cached=True)
+
+
+def rest_add_payment(client, store, rng):
+    loan_ids = [loan["id"] for loan in store.get_loans()]
+
+    def run():
+        response = client.post(
+            "/api/v1/payments",
+            data=json.dumps(
+                {
+                    "loan_id": rng.choice(loan_ids),
+                    "payment_amount": 100.0,
+                    "payment_date": "2025-06-01",
+                }
+            ),
+            content_type="application/json",
+        )
+        assert response.status_code == 201, response.data
+
+    return run
+
+
+def payment_status(client, store, rng):
+    loans = store.get_loans()
+    pairs = [
+        (loan, payment)
+        for loan in rng.sample(loans, min(len(loans), SCALAR_BATCH))
+        for payment in store.get_loan_payments(loan["id"])[:1]
+    ]
+
+    def run():
+        for loan, payment in pairs:
+            get_payment_status(loan, payment)
+
+    return run, len(pairs)
+
+
+def payment_statuses_batch(client, store, rng):
+    due_dates = [rng.randrange(738000, 739000) for _ in range(SCALAR_BATCH)]
+    payment_dates = [day + rng.randint(-10, 60) for day in due_dates]
+
+    def run():
+        get_payment_statuses(due_dates, payment_dates)
+
+    return run, SCALAR_BATCH
+
+
+# name -> setup(client, store, rng) returning the timed operation, or
+# the operation and how many operations one call performs. Writes run
+# last so the read benchmarks see the generated data only.
+BENCHMARKS = {
+    "graphql_nested_loans": graphql_nested_loans,
+    "graphql_nested_loans_cached": graphql_nested_loans_cached,
+    "get_payment_status": payment_status,
+    "get_payment_statuses_batch": payment_statuses_batch,
+    "rest_add_payment": rest_add_payment,
+}
+
+
+def measure(operation, iterations, warmup=1):
+    """wall time of each call in seconds, after warmup untimed calls"""
+    for _ in range(warmup):
+        operation()
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings, ops_per_call=1):
+    """timing stats in milliseconds per call plus operations per second"""
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))]
+    return {
+        "iterations": len(timings),
+        "ops_per_call": ops_per_call,
+        "min_ms": ordered[0] * 1000,
+        "median_ms": statistics.median(ordered) * 1000,
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p95_ms": p95 * 1000,
+        "max_ms": ordered[-1] * 1000,
+        "ops_per_sec": ops_per_call * len(timings) / sum(timings),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    loan_count,
+    payment_count,
+    iterations=5,
+    seed=0,
+    store_class=None,
+    names=None,
+    max_cost=None,
+):
+    """run the benchmarks against generated data, returns the results
+
+    every run with the same arguments times the same data and requests.
+    The GraphQL cost limit is max_cost during the run, None turns it off
+    so the queries are timed at any data size.
+    """
+    started = time.perf_counter()
+    store = populate_state(loan_count, payment_count, seed, store_class)
+    load_seconds = time.perf_counter() - started
+
+    client = app.test_client()
+    results = {}
+    configured_max_cost = graphql_backend.max_cost
+    graphql_backend.max_cost = max_cost
+    try:
+        for name, setup in BENCHMARKS.items():
+            if names and name not in names:
+                continue
+            prepared = setup(client, store, random.Random(seed))
+            operation, ops_per_call = (
+                prepared if isinstance(prepared, tuple) else (prepared, 1)
+            )
+            results[name] = summarize(
+                measure(operation, iterations), ops_per_call
+            )
+    finally:
+        graphql_backend.max_cost = configured_max_cost
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": datetime.datetime.now(
+                datetime.timezone.utc
+            ).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "store": type(store).__name__,
+            "loans": loan_count,
+            "payments": payment_count,
+            "seed": seed,
+            "iterations": iterations,
+            "max_cost": max_cost,
+            "store_load_seconds": load_seconds,
+        },
+        "results": results,
+    }
+
+
+def compare_results(baseline, current, threshold=0.2):
+    """median time change per benchmark present in both results
+
+    returns (name, baseline ms, current ms, ratio, regressed) rows, a
+    benchmark regressed when its median got slower by more than
+    threshold
+    """
+    rows = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        ratio = result["median_ms"] / base["median_ms"]
+        rows.append(
+            (
+                name,
+                base["median_ms"],
+                result["median_ms"],
+                ratio,
+                ratio > 1 + threshold,
+            )
+        )
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.run",
+        description="time the API against generated loans and payments",
+    )
+    parser.add_argument("--loans", type=int, default=1000)
+    parser.add_argument("--payments", type=int, default=100_000)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--only", action="append", choices=sorted(BENCHMARKS), default=None
+    )
+    parser.add_argument(
+        "--max-cost",
+        type=int,
+        default=None,
+        help="graphql cost limit during the run, off by default",
+    )
+    parser.add_argument("--output", help="write the results as json here")
+    parser.add_argument(
+        "--baseline",
+        help="results json to compare against, exits 1 on a regression",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="slowdown of the median that counts as a regression",
+    )
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(
+        args.loans,
+        args.payments,
+        iterations=args.iterations,
+        seed=args.seed,
+        names=args.only,
+        max_cost=args.max_cost,
+    )
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    for name, result in report["results"].items():
+        print(
+            f"{name:<28} median {result['median_ms']:10.3f} ms  "
+            f"p95 {result['p95_ms']:10.3f} ms  "
+            f"{result['ops_per_sec']:12.1f} ops/s"
+        )
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    regressed = False
+    for name, base, current, ratio, slower in compare_results(
+        baseline, report, args.threshold
+    ):
+        regressed = regressed or slower
+        flag = "  REGRESSION" if slower else ""
+        print(
+            f"{name:<28} {base:10.3f} -> {current:10.3f} ms  x{ratio:.2f}{flag}"
+        )
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """bounded, thread safe least recently used cache
+
+    Holds at most maxsize entries, getting or setting a key marks it as
+    the most recently used one and the least recently used entry is
+    evicted once the cache is full.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def _set(self, key, value):
+        # callers hold the lock
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            return self._set(key, value)
+
+    def setdefault(self, key, value):
+        """the cached value of key, or value after caching it"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            return self._set(key, value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._entries.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TTLCache(LRUCache):
+    """LRUCache whose entries also expire ttl seconds after being set
+
+    expired entries are dropped when they are looked up, and from the
+    least recently used end whenever a new entry is set, maxsize still
+    bounds the number of entries held
+    """
+
+    def __init__(self, maxsize, ttl, clock=time.monotonic):
+        super().__init__(maxsize)
+        self.ttl = ttl
+        self._clock = clock
+
+    def _live_entry(self, key):
+        # (expires_at, value) of key or None, callers hold the lock
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= self._clock():
+            del self._entries[key]
+            return None
+        return entry
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._live_entry(key)
+            if entry is None:
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _set(self, key, value):
+        now = self._clock()
+        self._entries[key] = (now + self.ttl, value)
+        self._entries.move_to_end(key)
+        while self._entries and (
+            len(self._entries) > self.maxsize
+            or next(iter(self._entries.values()))[0] <= now
+        ):
+            self._entries.popitem(last=False)
+        return value
+
+    def setdefault(self, key, value):
+        with self._lock:
+            entry = self._live_entry(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[1]
+            return self._set(key, value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._live_entry(key)
+            if entry is None:
+                return default
+            del self._entries[key]
+            return entry[1]
@@ -0,0 +1,94 @@
+import datetime
+import json
+import os
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    # dates the way the graphql Date scalar and the web client write them
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    raise TypeError(
+        f"Object of type {type(value).__name__} is not JSON serializable"
+    )
+
+
+def stdlib_dumps(data, pretty=False, sort_keys=False, ensure_ascii=True):
+    """data as JSON utf-8 bytes, using the json module"""
+    return json.dumps(
+        data,
+        default=_default,
+        sort_keys=sort_keys,
+        ensure_ascii=ensure_ascii,
+        indent=2 if pretty else None,
+        separators=(",", ": ") if pretty else (",", ":"),
+    ).encode()
+
+
+def orjson_dumps(data, pretty=False, sort_keys=False, ensure_ascii=True):
+    """data as JSON utf-8 bytes, using orjson
+
+    The bytes are the ones stdlib_dumps writes, anything orjson encodes
+    differently falls back to it: non ASCII text when ensure_ascii is
+    set, ints over 64 bits and non string keys. Floats from 1e16 up or
+    under 1e-4 are written without the exponent sign, the same number.
+    """
+    option = 0
+    if pretty:
+        option |= orjson.OPT_INDENT_2
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    try:
+        body = orjson.dumps(data, default=_default, option=option)
+    except TypeError:
+        return stdlib_dumps(data, pretty, sort_keys, ensure_ascii)
+    if ensure_ascii and not body.isascii():
+        return stdlib_dumps(data, pretty, sort_keys, ensure_ascii)
+    return body
+
+
+# name -> encoder, JSON_ENCODER picks the one used by both APIs
+ENCODERS = {"stdlib": stdlib_dumps}
+if orjson is not None:
+    ENCODERS["orjson"] = orjson_dumps
+
+JSON_ENCODER = os.environ.get(
+    "JSON_ENCODER", "orjson" if orjson is not None else "stdlib"
+)
+dumps_bytes = ENCODERS[JSON_ENCODER]
+
+
+def dumps(data, pretty=False, sort_keys=False, ensure_ascii=True):
+    """data as a JSON string, see dumps_bytes"""
+    return dumps_bytes(data, pretty, sort_keys, ensure_ascii).decode()
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """flask json provider encoding with dumps_bytes
+
+    jsonify writes the bytes the default provider does, except that
+    dates are ISO 8601 strings instead of HTTP dates
+    """
+
+    default = staticmethod(_default)
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(
+            obj, sort_keys=self.sort_keys, ensure_ascii=self.ensure_ascii
+        )
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = self.compact is False or (
+            self.compact is None and self._app.debug
+        )
+        body = dumps_bytes(obj, pretty, self.sort_keys, self.ensure_ascii)
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
@@ -0,0 +1,182 @@
+import threading
+from collections import deque
+from itertools import islice
+
+from encoding import dumps_bytes
+
+# events queued per subscriber before it counts as too slow, and events
+# kept to replay to a reconnecting subscriber
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_HISTORY_SIZE = 1000
+# every subscriber holds a worker thread for as long as it is connected,
+# about 20 KB resident and an 8 MB stack reservation on linux, so a
+# threaded worker accepts far fewer subscribers than the broker could
+# queue for. Served by serve.py a subscriber is a greenlet waiting on
+# its queue instead, a few KB, so that worker takes thousands.
+DEFAULT_MAX_SUBSCRIBERS = 100
+COOPERATIVE_MAX_SUBSCRIBERS = 10_000
+
+# returned by Subscription.get instead of frames when the subscriber
+# missed events and has to reload its data
+RESET = object()
+
+
+def cooperative_worker():
+    """whether gevent has patched threading, see serve.py"""
+    try:
+        from gevent import monkey
+    except ImportError:  # gevent is only needed by serve.py
+        return False
+    return monkey.is_module_patched("threading")
+
+
+def default_max_subscribers():
+    """subscribers a worker of this process accepts by default"""
+    if cooperative_worker():
+        return COOPERATIVE_MAX_SUBSCRIBERS
+    return DEFAULT_MAX_SUBSCRIBERS
+
+
+def encode_event(event_id, event, data):
+    """server-sent event frame, data is written as one line of JSON"""
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (
+        event_id,
+        event.encode(),
+        dumps_bytes(data),
+    )
+
+
+class Subscription:
+    """bounded queue of encoded event frames for one subscriber
+
+    put never blocks the publisher, a subscriber whose queue is full
+    has its queue dropped and gets RESET on its next get instead
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._frames = deque()
+        self._lagged = False
+        self._ready = threading.Condition(threading.Lock())
+
+    def _reset(self):
+        # callers hold the lock
+        self._frames.clear()
+        self._lagged = True
+        self._ready.notify()
+
+    def put(self, frame):
+        with self._ready:
+            if self._lagged:
+                return
+            if len(self._frames) >= self.maxsize:
+                self._reset()
+                return
+            self._frames.append(frame)
+            self._ready.notify()
+
+    def reset(self):
+        """drop the queued frames, the next get returns RESET"""
+        with self._ready:
+            self._reset()
+
+    def get(self, timeout=None):
+        """queued frames, RESET, or an empty list after timeout seconds"""
+        with self._ready:
+            if not self._frames and not self._lagged:
+                self._ready.wait(timeout)
+            if self._lagged:
+                self._lagged = False
+                return RESET
+            frames = list(self._frames)
+            self._frames.clear()
+            return frames
+
+    def __len__(self):
+        return len(self._frames)
+
+
+class EventBroker:
+    """in process publish/subscribe of server-sent events
+
+    Every event gets the next id and is encoded once, then queued for
+    every subscriber and kept in a bounded history. A subscriber that
+    reconnects with the id of the last event it got is sent the events
+    it missed, or RESET once they have left the history.
+    """
+
+    def __init__(
+        self,
+        queue_size=DEFAULT_QUEUE_SIZE,
+        history_size=DEFAULT_HISTORY_SIZE,
+        max_subscribers=DEFAULT_MAX_SUBSCRIBERS,
+    ):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._history = deque(maxlen=history_size)
+        self._subscribers = set()
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    def publish(self, event, data):
+        """publish one event, returns its id"""
+        return self.publish_many(event, [data])
+
+    def publish_many(self, event, items):
+        """publish an event per item in order, returns the last id"""
+        with self._lock:
+            # queued under the lock so every subscriber sees one order
+            for data in items:
+                self._last_id += 1
+                frame = encode_event(self._last_id, event, data)
+                self._history.append(frame)
+                for subscription in self._subscribers:
+                    subscription.put(frame)
+            return self._last_id
+
+    def subscribe(self, last_event_id=None, max_subscribers=None):
+        """a new Subscription, None when max_subscribers are subscribed
+
+        with last_event_id the subscription starts with the events
+        published after it, max_subscribers overrides the broker's limit
+        """
+        if max_subscribers is None:
+            max_subscribers = self.max_subscribers
+        subscription = Subscription(self.queue_size)
+        with self._lock:
+            if len(self._subscribers) >= max_subscribers:
+                return None
+            self._subscribers.add(subscription)
+            if last_event_id is not None:
+                missed = self._last_id - last_event_id
+                if 0 <= missed <= len(self._history):
+                    start = len(self._history) - missed
+                    for frame in islice(self._history, start, None):
+                        subscription.put(frame)
+                else:
+                    # too old, or an id from before a restart
+                    subscription.reset()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def clear(self):
+        """drop the subscribers and the history, ids start over"""
+        with self._lock:
+            self._subscribers.clear()
+            self._history.clear()
+            self._last_id = 0
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    @property
+    def last_event_id(self):
+        return self._last_id
+
+
+# payments added through the REST api, streamed by /api/v1/payments/events
+PAYMENT_EVENTS = EventBroker()
@@ -0,0 +1,162 @@
+import hashlib
+import time
+from functools import partial
+
+from graphql import GraphQLError, parse, validate
+from graphql.language import ast
+from graphql.backend.base import GraphQLBackend, GraphQLDocument
+from graphql.execution import ExecutionResult, execute
+from graphql.validation.rules import specified_rules
+
+from cache import LRUCache
+from graphql_api.cost import depth_limit_rule, portfolio_cost, query_cost
+from metrics import GRAPHQL_OPERATION_SECONDS, GRAPHQL_PHASE_SECONDS
+
+# number of parsed and validated documents kept by default
+DEFAULT_DOCUMENT_CACHE_SIZE = 1024
+
+
+def document_hash(document_string):
+    """sha256 hex digest of a query, the id of persisted queries"""
+    return hashlib.sha256(document_string.encode("utf-8")).hexdigest()
+
+
+class ExtendedExecutionResult(ExecutionResult):
+    """execution result that keeps its extensions in the response"""
+
+    __slots__ = ()
+
+    def to_dict(self, *args, **kwargs):
+        response = super().to_dict(*args, **kwargs)
+        if self.extensions:
+            response["extensions"] = self.extensions
+        return response
+
+
+def _invalid_result(errors, *_args, **_kwargs):
+    return ExecutionResult(errors=errors, invalid=True)
+
+
+def _default_operation_name(document_ast):
+    # name of the operation run when no operation_name is given
+    operations = [
+        definition
+        for definition in document_ast.definitions
+        if isinstance(definition, ast.OperationDefinition)
+    ]
+    if len(operations) == 1 and operations[0].name:
+        return operations[0].name.value
+    return "anonymous"
+
+
+class CachedDocumentBackend(GraphQLBackend):
+    """graphql backend keeping parsed and validated documents in an LRU
+
+    Documents are keyed by the sha256 of their query text. A cached
+    document executes without being parsed or validated again, and
+    documents that failed validation replay their errors. The same keys
+    serve persisted queries, see get_document.
+
+    Operations nested deeper than max_depth fail validation. The cost
+    of an operation, see query_cost, is worked out from its page size
+    arguments and the list sizes returned by list_sizes before it
+    executes, operations over max_cost are rejected without running a
+    resolver. The cost limit is never below portfolio_cost, so listing
+    the whole portfolio once always runs. None turns a limit off.
+    """
+
+    def __init__(
+        self,
+        maxsize=DEFAULT_DOCUMENT_CACHE_SIZE,
+        max_depth=None,
+        max_cost=None,
+        list_sizes=None,
+    ):
+        self._documents = LRUCache(maxsize)
+        self.max_depth = max_depth
+        self.max_cost = max_cost
+        self.list_sizes = list_sizes
+
+    def clear(self):
+        """drop every cached document"""
+        self._documents.clear()
+
+    def get_document(self, key):
+        """cached document for a query hash or None"""
+        return self._documents.get(key)
+
+    def document_from_string(self, schema, document_string):
+        with GRAPHQL_PHASE_SECONDS.time("parse"):
+            return self._document_from_string(schema, document_string)
+
+    def _document_from_string(self, schema, document_string):
+        key = document_hash(document_string)
+        document = self.get_document(key)
+        if document is not None and document.schema is schema:
+            return document
+
+        # syntax errors are raised and never cached
+        document_ast = parse(document_string)
+        rules = specified_rules
+        if self.max_depth is not None:
+            rules = [*rules, depth_limit_rule(self.max_depth)]
+        errors = validate(schema, document_ast, rules)
+        document = GraphQLDocument(
+            schema=schema,
+            document_string=document_string,
+            document_ast=document_ast,
+            execute=(
+                partial(_invalid_result, errors)
+                if errors
+                else partial(
+                    self._execute,
+                    _default_operation_name(document_ast),
+                    schema,
+                    document_ast,
+                )
+            ),
+        )
+
+        return self._documents.set(key, document)
+
+    def _execute(self, default_name, schema, document_ast, *args, **kwargs):
+        # costed with the variables of the request, before any resolver runs
+        list_sizes = self.list_sizes() if self.list_sizes else {}
+        cost = query_cost(
+            schema,
+            document_ast,
+            kwargs.get("operation_name"),
+            kwargs.get("variable_values"),
+            list_sizes,
+        )
+        extensions = {"cost": {"requestedQueryCost": cost}}
+        if self.max_cost is not None:
+            max_cost = max(self.max_cost, portfolio_cost(list_sizes))
+            extensions["cost"]["maximumAvailable"] = max_cost
+            if cost > max_cost:
+                return ExtendedExecutionResult(
+                    errors=[
+                        GraphQLError(
+                            f"Query cost of {cost} exceeds the maximum cost "
+                            f"of {max_cost}"
+                        )
+                    ],
+                    invalid=True,
+                    extensions=extensions,
+                )
+
+        start = time.perf_counter()
+        try:
+            result = execute(schema, document_ast, *args, **kwargs)
+            return ExtendedExecutionResult(
+                data=result.data,
+                errors=result.errors,
+                invalid=result.invalid,
+                extensions={**result.extensions, **extensions},
+            )
+        finally:
+            elapsed = time.perf_counter() - start
+            GRAPHQL_PHASE_SECONDS.observe(elapsed, "execute")
+            GRAPHQL_OPERATION_SECONDS.observe(
+                elapsed, kwargs.get("operation_name") or default_name
+            )
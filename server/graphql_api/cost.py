@@ -0,0 +1,279 @@
+from graphql import GraphQLError
+from graphql.language import ast
+from graphql.type import GraphQLList, GraphQLNonNull
+from graphql.type.definition import get_named_type
+from graphql.validation.rules.base import ValidationRule
+
+import state
+from graphql_api.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from utils import AGING_BUCKETS, PAYMENT_STATUSES
+
+# limits used when the app does not configure its own
+DEFAULT_MAX_QUERY_DEPTH = 10
+DEFAULT_MAX_QUERY_COST = 10_000
+
+# assumed length of list fields without page size arguments and without
+# an estimate from store_list_sizes, and the most a filtered list is
+# costed at
+LIST_SIZE_ESTIMATE = DEFAULT_PAGE_SIZE
+
+
+def _fragments(document_ast):
+    return {
+        definition.name.value: definition
+        for definition in document_ast.definitions
+        if isinstance(definition, ast.FragmentDefinition)
+    }
+
+
+def _operation(document_ast, operation_name=None):
+    operations = [
+        definition
+        for definition in document_ast.definitions
+        if isinstance(definition, ast.OperationDefinition)
+    ]
+    if operation_name is None:
+        return operations[0] if len(operations) == 1 else None
+    for operation in operations:
+        if operation.name and operation.name.value == operation_name:
+            return operation
+    return None
+
+
+def _is_list(graphql_type):
+    if isinstance(graphql_type, GraphQLNonNull):
+        graphql_type = graphql_type.of_type
+    return isinstance(graphql_type, GraphQLList)
+
+
+def _int_argument(node, name, variables):
+    for argument in node.arguments or ():
+        if argument.name.value != name:
+            continue
+        value = argument.value
+        if isinstance(value, ast.Variable):
+            value = (variables or {}).get(value.name.value)
+        elif isinstance(value, ast.IntValue):
+            value = int(value.value)
+        return value if isinstance(value, int) else None
+    return None
+
+
+def _has_arguments(node, variables):
+    # any argument given a value, unset variables don't count
+    for argument in node.arguments or ():
+        value = argument.value
+        if not isinstance(value, ast.Variable):
+            return True
+        if (variables or {}).get(value.name.value) is not None:
+            return True
+    return False
+
+
+def _page_size(field, node, variables):
+    # items a connection field returns, None for other fields
+    if "first" not in field.args and "last" not in field.args:
+        return None
+    sizes = [
+        size
+        for size in (
+            _int_argument(node, "first", variables),
+            _int_argument(node, "last", variables),
+        )
+        if size is not None
+    ]
+    if not sizes:
+        return DEFAULT_PAGE_SIZE
+    return max(0, min(*sizes, MAX_PAGE_SIZE))
+
+
+def query_depth(selection_set, fragments, visited=frozenset()):
+    """deepest field nesting of a selection set, fragments expanded
+
+    introspection fields like __schema are not counted so graphiql can
+    still load the schema
+    """
+    depth = 0
+    for selection in selection_set.selections:
+        if isinstance(selection, ast.Field):
+            if selection.name.value.startswith("__"):
+                continue
+            child = 0
+            if selection.selection_set:
+                child = query_depth(
+                    selection.selection_set, fragments, visited
+                )
+            depth = max(depth, 1 + child)
+        elif isinstance(selection, ast.FragmentSpread):
+            name = selection.name.value
+            fragment = fragments.get(name)
+            if fragment is not None and name not in visited:
+                depth = max(
+                    depth,
+                    query_depth(
+                        fragment.selection_set, fragments, visited | {name}
+                    ),
+                )
+        else:
+            depth = max(
+                depth,
+                query_depth(selection.selection_set, fragments, visited),
+            )
+    return depth
+
+
+def _selection_cost(
+    schema,
+    parent_type,
+    selection_set,
+    fragments,
+    variables,
+    list_sizes,
+    page_size=None,
+    visited=frozenset(),
+):
+    fields = getattr(parent_type, "fields", None) or {}
+    cost = 0
+    for selection in selection_set.selections:
+        if isinstance(selection, ast.FragmentSpread):
+            name = selection.name.value
+            fragment = fragments.get(name)
+            if fragment is None or name in visited:
+                continue
+            cost += _selection_cost(
+                schema,
+                schema.get_type(fragment.type_condition.name.value),
+                fragment.selection_set,
+                fragments,
+                variables,
+                list_sizes,
+                page_size,
+                visited | {name},
+            )
+        elif isinstance(selection, ast.InlineFragment):
+            fragment_type = parent_type
+            if selection.type_condition:
+                fragment_type = schema.get_type(
+                    selection.type_condition.name.value
+                )
+            cost += _selection_cost(
+                schema,
+                fragment_type,
+                selection.selection_set,
+                fragments,
+                variables,
+                list_sizes,
+                page_size,
+                visited,
+            )
+        else:
+            field = fields.get(selection.name.value)
+            # scalars and introspection are free
+            if field is None or not selection.selection_set:
+                continue
+            child = _selection_cost(
+                schema,
+                get_named_type(field.type),
+                selection.selection_set,
+                fragments,
+                variables,
+                list_sizes,
+                _page_size(field, selection, variables),
+                visited,
+            )
+            items = 1
+            if _is_list(field.type):
+                # the edges of a connection hold its page, other lists
+                # hold their estimated size, a filtered list at most
+                # LIST_SIZE_ESTIMATE items as its filters are served
+                # from the store's indexes
+                items = page_size
+                if items is None:
+                    items = list_sizes.get(
+                        f"{parent_type.name}.{selection.name.value}",
+                        LIST_SIZE_ESTIMATE,
+                    )
+                    if _has_arguments(selection, variables):
+                        items = min(items, LIST_SIZE_ESTIMATE)
+            cost += items * (1 + child)
+    return cost
+
+
+def store_list_sizes():
+    """estimated lengths of the plain list fields over the store's data
+
+    keyed on Type.field, loans counts every loan and loanPayments the
+    payments per loan rounded up, so payments listed under every loan
+    add up to at least the payment count
+    """
+    summary = state.store.get_portfolio_summary()
+    loan_count = summary["loan_count"]
+    return {
+        "Query.loans": loan_count,
+        "ExistingLoans.loanPayments": (
+            -(-summary["payment_count"] // loan_count) if loan_count else 0
+        ),
+        "Query.delinquencyAging": len(AGING_BUCKETS),
+        "PortfolioSummary.loanStatusCounts": len(PAYMENT_STATUSES),
+    }
+
+
+def portfolio_cost(list_sizes):
+    """cost of listing every loan with all its payments
+
+    what the web client's unpaginated loans query costs, the backend
+    never limits a query below it so the client works at any portfolio
+    size
+    """
+    return list_sizes.get("Query.loans", 0) * (
+        1 + list_sizes.get("ExistingLoans.loanPayments", 0)
+    )
+
+
+def query_cost(
+    schema, document_ast, operation_name=None, variables=None, list_sizes=None
+):
+    """estimated number of objects an operation resolves
+
+    every object costs 1, connections count the page asked for with
+    first or last and plain lists the size given in list_sizes, keyed
+    on Type.field, or LIST_SIZE_ESTIMATE items, so nested lists
+    multiply. Plain lists given filter arguments count at most
+    LIST_SIZE_ESTIMATE items. Scalars cost nothing.
+    """
+    operation = _operation(document_ast, operation_name)
+    if operation is None:
+        return 0
+    root_type = {
+        "query": schema.get_query_type,
+        "mutation": schema.get_mutation_type,
+        "subscription": schema.get_subscription_type,
+    }[operation.operation]()
+    return _selection_cost(
+        schema,
+        root_type,
+        operation.selection_set,
+        _fragments(document_ast),
+        variables,
+        list_sizes or {},
+    )
+
+
+def depth_limit_rule(max_depth):
+    """validation rule rejecting operations nested deeper than max_depth"""
+
+    class QueryDepthLimit(ValidationRule):
+        def enter_OperationDefinition(self, node, *_args):
+            depth = query_depth(
+                node.selection_set, _fragments(self.context.get_ast())
+            )
+            if depth > max_depth:
+                self.context.report_error(
+                    GraphQLError(
+                        f"Query depth of {depth} exceeds the maximum depth "
+                        f"of {max_depth}",
+                        [node],
+                    )
+                )
+
+    return QueryDepthLimit
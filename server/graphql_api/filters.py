@@ -0,0 +1,61 @@
+import datetime
+
+import graphene
+from flask import g, has_request_context
+from graphql import GraphQLError
+
+from utils import AGING_BUCKETS, PAYMENT_STATUSES
+
+
+def payment_filter_args():
+    """filter arguments of payment list fields"""
+    return {
+        "status": graphene.String(),
+        "payment_date_from": graphene.Date(),
+        "payment_date_to": graphene.Date(),
+    }
+
+
+def loan_filter_args():
+    """filter arguments of loan list fields"""
+    return {
+        **payment_filter_args(),
+        "due_date_from": graphene.Date(),
+        "due_date_to": graphene.Date(),
+        # unpaid loans in an aging bucket as of a date, today by default
+        "aging_bucket": graphene.String(),
+        "as_of": graphene.Date(),
+    }
+
+
+def default_as_of():
+    """today, the as of date of aging queries that don't give one
+
+    fixed for the whole request, so cached responses are keyed on the
+    date their aging buckets were worked out for
+    """
+    if not has_request_context():
+        return datetime.date.today()
+    if "default_as_of" not in g:
+        g.default_as_of = datetime.date.today()
+    return g.default_as_of
+
+
+def get_filters(**args):
+    """given filter arguments, validated, None if there are none"""
+    filters = {name: value for name, value in args.items() if value}
+    status = filters.get("status")
+    if status and status not in PAYMENT_STATUSES:
+        raise GraphQLError(
+            f"status must be one of {', '.join(PAYMENT_STATUSES)}"
+        )
+    aging_bucket = filters.get("aging_bucket")
+    if aging_bucket:
+        if aging_bucket not in AGING_BUCKETS:
+            raise GraphQLError(
+                f"agingBucket must be one of {', '.join(AGING_BUCKETS)}"
+            )
+        filters.setdefault("as_of", default_as_of())
+    elif "as_of" in filters:
+        raise GraphQLError("asOf is only used with agingBucket")
+    return filters or None
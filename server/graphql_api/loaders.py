@@ -0,0 +1,106 @@
+from promise import Promise
+from promise.dataloader import DataLoader
+
+import state
+from metrics import GRAPHQL_LOADER_BATCH_SECONDS
+from utils import NO_DATE, PAYMENT_STATUSES, get_payment_statuses
+
+
+class LoanLoader(DataLoader):
+    """batches loan lookups by loan id"""
+
+    def batch_load_fn(self, loan_ids):
+        with GRAPHQL_LOADER_BATCH_SECONDS.time("loan"):
+            loans = state.store.get_loans_by_ids(loan_ids)
+        return Promise.resolve(loans)
+
+
+class LoanPaymentsLoader(DataLoader):
+    """batches payment lookups by loan id, resolves a list per loan"""
+
+    def batch_load_fn(self, loan_ids):
+        with GRAPHQL_LOADER_BATCH_SECONDS.time("loan_payments"):
+            payments = state.store.get_payments_by_loan_ids(loan_ids)
+        return Promise.resolve(payments)
+
+
+class FilteredLoanPaymentsLoader(DataLoader):
+    """batches filtered payment lookups, resolves a list per loan
+
+    keys are (loan_id, status, payment_date_from, payment_date_to), the
+    loans of every filter combination are fetched in one store call
+    """
+
+    def batch_load_fn(self, keys):
+        loan_ids_by_filters = {}
+        for loan_id, *filters in keys:
+            loan_ids_by_filters.setdefault(tuple(filters), []).append(loan_id)
+
+        payments = {}
+        with GRAPHQL_LOADER_BATCH_SECONDS.time("filtered_loan_payments"):
+            for filters, loan_ids in loan_ids_by_filters.items():
+                for loan_id, loan_payments in zip(
+                    loan_ids,
+                    state.store.find_payments_by_loan_ids(loan_ids, *filters),
+                ):
+                    payments[(loan_id, *filters)] = loan_payments
+        return Promise.resolve([payments[key] for key in keys])
+
+
+class LoanBalanceLoader(DataLoader):
+    """batches loan balance lookups by loan id, resolves a LoanBalance"""
+
+    def batch_load_fn(self, loan_ids):
+        with GRAPHQL_LOADER_BATCH_SECONDS.time("loan_balance"):
+            balances = state.store.get_loan_balances(loan_ids)
+        return Promise.resolve(balances)
+
+
+class PaymentStatusLoader(DataLoader):
+    """batches payment status classification
+
+    keys are (loan_id, payment date ordinal) pairs, the parent loans are
+    fetched through the loan loader and every status of the batch is
+    classified with a single get_payment_statuses call
+    """
+
+    def __init__(self, loan_loader):
+        super().__init__()
+        self.loan_loader = loan_loader
+
+    def batch_load_fn(self, keys):
+        loan_ids = [loan_id for loan_id, _ in keys]
+        return self.loan_loader.load_many(loan_ids).then(
+            lambda loans: self.classify(keys, loans)
+        )
+
+    @staticmethod
+    def classify(keys, loans):
+        with GRAPHQL_LOADER_BATCH_SECONDS.time("payment_status"):
+            codes = get_payment_statuses(
+                [
+                    loan["due_date"].toordinal() if loan else 0
+                    for loan in loans
+                ],
+                [payment_date for _, payment_date in keys],
+            )
+        return [
+            PAYMENT_STATUSES[code] if loan else None
+            for loan, code in zip(loans, codes)
+        ]
+
+
+class Loaders:
+    """per request loaders, a fresh instance keeps the caches request scoped"""
+
+    def __init__(self):
+        self.loan = LoanLoader()
+        self.loan_payments = LoanPaymentsLoader()
+        self.filtered_loan_payments = FilteredLoanPaymentsLoader()
+        self.loan_balance = LoanBalanceLoader()
+        self.payment_status = PaymentStatusLoader(self.loan)
+
+
+def payment_status_key(loan_id, payment_date):
+    """payment_status loader key for a payment"""
+    return loan_id, payment_date.toordinal() if payment_date else NO_DATE
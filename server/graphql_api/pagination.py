@@ -0,0 +1,62 @@
+import base64
+import binascii
+
+from graphene import relay
+from graphql import GraphQLError
+
+CURSOR_PREFIX = "cursor:"
+
+# page size used when neither first nor last is given, and the largest
+# page a client may ask for
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+def to_cursor(record_id):
+    """opaque cursor for a record id"""
+    return base64.b64encode(f"{CURSOR_PREFIX}{record_id}".encode()).decode()
+
+
+def from_cursor(cursor):
+    """record id of a cursor created by to_cursor"""
+    try:
+        value = base64.b64decode(cursor.encode(), validate=True).decode()
+        if not value.startswith(CURSOR_PREFIX):
+            raise ValueError(cursor)
+        return int(value[len(CURSOR_PREFIX) :])
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise GraphQLError(f"Invalid cursor: {cursor}")
+
+
+def get_page_args(first=None, after=None, last=None, before=None):
+    """validate relay connection arguments into store keyset page args"""
+    for name, size in (("first", first), ("last", last)):
+        if size is not None and not 0 <= size <= MAX_PAGE_SIZE:
+            raise GraphQLError(f"{name} must be between 0 and {MAX_PAGE_SIZE}")
+
+    if first is None and last is None:
+        first = DEFAULT_PAGE_SIZE
+
+    return {
+        "first": first,
+        "after": from_cursor(after) if after else None,
+        "last": last,
+        "before": from_cursor(before) if before else None,
+    }
+
+
+def build_connection(connection_type, page):
+    """relay connection instance from a store keyset Page"""
+    edges = [
+        connection_type.Edge(node=item, cursor=to_cursor(item["id"]))
+        for item in page.items
+    ]
+    return connection_type(
+        edges=edges,
+        page_info=relay.PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=page.has_previous_page,
+            has_next_page=page.has_next_page,
+        ),
+    )
@@ -1,10 +1,47 @@
 import graphene
-from state import loans
-from graphql_api.types.loan import ExistingLoans
+from graphene import relay
+import state
+from graphql_api.filters import default_as_of, get_filters, loan_filter_args
+from graphql_api.pagination import build_connection, get_page_args
+from graphql_api.types.loan import ExistingLoans, LoanConnection
+from graphql_api.types.portfolio import AgingBucket, PortfolioSummary
 
 
 class Query(graphene.ObjectType):
-    loans = graphene.List(ExistingLoans)
+    loans = graphene.List(ExistingLoans, **loan_filter_args())
+    loans_connection = relay.ConnectionField(
+        LoanConnection, **loan_filter_args()
+    )
+    portfolio_summary = graphene.Field(PortfolioSummary)
+    delinquency_aging = graphene.List(AgingBucket, as_of=graphene.Date())
 
-    def resolve_loans(self, _info):
-        return loans
+    def resolve_loans(self, _info, **args):
+        filters = get_filters(**args)
+        if filters:
+            # served from the store's due date, payment date and status
+            # indexes
+            return state.store.find_loans(**filters)
+        return state.store.get_loans()
+
+    def resolve_loans_connection(
+        self, _info, first=None, after=None, last=None, before=None, **args
+    ):
+        # keyset page on the loan id index, or on the loans the filters
+        # match
+        page = state.store.page_loans(
+            filters=get_filters(**args),
+            **get_page_args(first, after, last, before),
+        )
+        return build_connection(LoanConnection, page)
+
+    def resolve_portfolio_summary(self, _info):
+        # O(1), the store keeps these counters current on every insert
+        return state.store.get_portfolio_summary()
+
+    def resolve_delinquency_aging(self, _info, as_of=None):
+        # served from the store's index of unpaid loans by due date
+        aging = state.store.get_delinquency_aging(as_of or default_as_of())
+        return [
+            AgingBucket(bucket=bucket, **totals)
+            for bucket, totals in aging.items()
+        ]
@@ -0,0 +1,48 @@
+import hashlib
+import json
+from collections import namedtuple
+
+from cache import LRUCache
+
+# number of responses kept by default
+DEFAULT_RESPONSE_CACHE_SIZE = 512
+
+CachedResponse = namedtuple("CachedResponse", ["body", "etag"])
+
+
+def response_cache_key(
+    query_hash, variables, operation_name, pretty, version, as_of
+):
+    """cache key of a read query against a given store data version
+
+    as_of is the date aging buckets default to, results change with it
+    even when the data doesn't
+    """
+    return (
+        query_hash,
+        json.dumps(variables, sort_keys=True) if variables else None,
+        operation_name,
+        bool(pretty),
+        version,
+        as_of,
+    )
+
+
+def make_etag(body):
+    """strong ETag value of a response body"""
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+class ResponseCache(LRUCache):
+    """bounded cache of encoded /graphql/v1 responses
+
+    Keys include the store data version, which every write bumps, so an
+    entry can never be served after the data it was built from changed,
+    stale entries simply age out of the LRU.
+    """
+
+    def __init__(self, maxsize=DEFAULT_RESPONSE_CACHE_SIZE):
+        super().__init__(maxsize)
+
+    def store_response(self, key, body):
+        return self.set(key, CachedResponse(body, make_etag(body)))
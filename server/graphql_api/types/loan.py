@@ -1,13 +1,23 @@
 import graphene
-from state import loan_payments
+from graphene import relay
+import state
 
-from graphql_api.types.loan_payment import LoanPayment
+from graphql_api.filters import get_filters, payment_filter_args
+from graphql_api.pagination import build_connection, get_page_args
+from graphql_api.types.loan_payment import LoanPayment, LoanPaymentConnection
 
 
 def get_field(obj, field):
     return getattr(obj, field, obj.get(field))
 
 
+def load_balance_field(info, loan, field):
+    # every balance field of a request's loans comes from one batch
+    return info.context.loaders.loan_balance.load(get_field(loan, "id")).then(
+        lambda balance: getattr(balance, field) if balance else None
+    )
+
+
 # loan type
 class ExistingLoans(graphene.ObjectType):
     id = graphene.Int()
@@ -15,9 +25,45 @@ class ExistingLoans(graphene.ObjectType):
     interest_rate = graphene.Float()
     principal = graphene.Int()
     due_date = graphene.Date()
-    loan_payments = graphene.List(LoanPayment)
+    loan_payments = graphene.List(LoanPayment, **payment_filter_args())
+    loan_payments_connection = relay.ConnectionField(LoanPaymentConnection)
+
+    # from the loan's amortization schedule and the payments made so far
+    outstanding_balance = graphene.Float()
+    next_payment_due = graphene.Date()
+    progress_percentage = graphene.Float()
+
+    def resolve_loan_payments(self, info, **args):
+        filters = get_filters(**args)
+        # batched with the other loans of this request
+        if filters:
+            return info.context.loaders.filtered_loan_payments.load(
+                (
+                    get_field(self, "id"),
+                    filters.get("status"),
+                    filters.get("payment_date_from"),
+                    filters.get("payment_date_to"),
+                )
+            )
+        return info.context.loaders.loan_payments.load(get_field(self, "id"))
+
+    def resolve_loan_payments_connection(self, _info, **args):
+        # keyset page on the loan's payment ids
+        page = state.store.page_loan_payments(
+            get_field(self, "id"), **get_page_args(**args)
+        )
+        return build_connection(LoanPaymentConnection, page)
+
+    def resolve_outstanding_balance(self, info):
+        return load_balance_field(info, self, "outstanding_balance")
+
+    def resolve_next_payment_due(self, info):
+        return load_balance_field(info, self, "next_payment_due")
+
+    def resolve_progress_percentage(self, info):
+        return load_balance_field(info, self, "progress_percentage")
+
 
-    def resolve_loan_payments(self, _info):
-        # get loan_id from loan_payments
-        loan_id = get_field(self, "id")
-        return [p for p in loan_payments if p["loan_id"] == loan_id]
+class LoanConnection(relay.Connection):
+    class Meta:
+        node = ExistingLoans
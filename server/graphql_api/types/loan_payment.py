@@ -1,6 +1,6 @@
 import graphene
-from utils import get_payment_status
-from state import loans
+from graphene import relay
+from graphql_api.loaders import payment_status_key
 
 
 def get_field(obj, field):
@@ -15,17 +15,15 @@ class LoanPayment(graphene.ObjectType):
     payment_date = graphene.Date()
     status = graphene.String()
 
-    def resolve_status(self, _info):
-        loan = next(
-            (
-                loan_obj
-                for loan_obj in loans
-                if loan_obj["id"] == get_field(self, "loan_id")
-            ),
-            None,
+    def resolve_status(self, info):
+        # classified in one batch with the other payments of this request
+        return info.context.loaders.payment_status.load(
+            payment_status_key(
+                get_field(self, "loan_id"), get_field(self, "payment_date")
+            )
         )
 
-        if not loan:
-            return None
 
-        return get_payment_status(loan, self)
+class LoanPaymentConnection(relay.Connection):
+    class Meta:
+        node = LoanPayment
@@ -0,0 +1,40 @@
+import graphene
+
+from utils import AGING_BUCKETS
+
+
+# number of loans with a given status
+class LoanStatusCount(graphene.ObjectType):
+    status = graphene.String()
+    count = graphene.Int()
+
+
+# portfolio totals, a loan's status is the status of its latest payment
+class PortfolioSummary(graphene.ObjectType):
+    loan_count = graphene.Int()
+    payment_count = graphene.Int()
+    loan_status_counts = graphene.List(LoanStatusCount)
+    principal_at_risk = graphene.Float()
+    total_payments_received = graphene.Float()
+
+    def resolve_loan_status_counts(self, _info):
+        return [
+            LoanStatusCount(status=status, count=count)
+            for status, count in self["loan_status_counts"].items()
+        ]
+
+
+# unpaid loans whose days past the due date are in a bucket's range,
+# maxDaysPastDue is null for the last bucket
+class AgingBucket(graphene.ObjectType):
+    bucket = graphene.String()
+    min_days_past_due = graphene.Int()
+    max_days_past_due = graphene.Int()
+    loan_count = graphene.Int()
+    principal = graphene.Float()
+
+    def resolve_min_days_past_due(self, _info):
+        return AGING_BUCKETS[self.bucket][0]
+
+    def resolve_max_days_past_due(self, _info):
+        return AGING_BUCKETS[self.bucket][1]
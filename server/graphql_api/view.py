@@ -0,0 +1,157 @@
+import json
+
+from flask import Response, current_app, g, request
+from flask_graphql import GraphQLView
+from graphql.error import format_error as default_format_error
+from graphql_server import HttpQueryError, get_graphql_params
+
+import state
+from encoding import dumps
+from graphql_api.backend import document_hash
+from graphql_api.filters import default_as_of
+from graphql_api.loaders import Loaders
+from graphql_api.middleware import timed_middleware
+from graphql_api.response_cache import response_cache_key
+from metrics import GRAPHQL_PHASE_SECONDS, sampled
+
+
+class RequestContext:
+    """context handed to resolvers, the flask request plus its loaders"""
+
+    def __init__(self, flask_request):
+        self.request = flask_request
+        self.loaders = Loaders()
+
+
+class LoanGraphQLView(GraphQLView):
+    response_cache = None
+    # set when the response has errors, views are made per request
+    has_errors = False
+
+    def get_context(self):
+        # new loaders per request so cached rows never leak across requests
+        return RequestContext(request)
+
+    def get_middleware(self):
+        # resolvers are only timed for the METRICS_SAMPLE_RATE share of
+        # requests, the others run without the middleware at all
+        if not sampled(current_app.config.get("METRICS_SAMPLE_RATE", 1.0)):
+            return self.middleware
+        return timed_middleware(*(self.middleware or ()))
+
+    def format_error(self, error):
+        # called for every error of the execution results and for
+        # request errors, whatever the order of the encoded keys
+        self.has_errors = True
+        return default_format_error(error)
+
+    @staticmethod
+    def encode(data, pretty=False):
+        with GRAPHQL_PHASE_SECONDS.time("encode"):
+            return dumps(data, pretty)
+
+    def parse_body(self):
+        data = super().parse_body()
+        if isinstance(data, list):
+            return data
+        return self.resolve_persisted_query(data)
+
+    def resolve_persisted_query(self, data):
+        """swap a persisted query hash for its cached query text
+
+        Follows the automatic persisted queries protocol, the sha256 of
+        the query is sent in extensions.persistedQuery.sha256Hash. An
+        unknown hash sent without its query gets PersistedQueryNotFound
+        so the client retries with the full query, which caches it.
+        """
+        extensions = data.get("extensions") or request.args.get("extensions")
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpQueryError(400, "Extensions are invalid JSON.")
+
+        persisted_query = (extensions or {}).get("persistedQuery")
+        if not persisted_query:
+            return data
+
+        query_hash = persisted_query.get("sha256Hash")
+        query = data.get("query") or request.args.get("query")
+        if query:
+            if document_hash(query) != query_hash:
+                raise HttpQueryError(400, "provided sha does not match query")
+            return data
+
+        document = self.backend and self.backend.get_document(query_hash)
+        if document is None:
+            raise HttpQueryError(200, "PersistedQueryNotFound")
+        return {**data, "query": document.document_string}
+
+    def get_response_cache_key(self):
+        """response cache key of the request or None if not cacheable
+
+        only query operations are cached, anything that is not a valid
+        single query is left to the regular request handling
+        """
+        try:
+            data = self.parse_body()
+            if isinstance(data, list):
+                return None
+            params = get_graphql_params(data, request.args)
+            if not params.query:
+                return None
+            document = self.backend.document_from_string(
+                self.schema, params.query
+            )
+        except Exception:
+            return None
+
+        if document.get_operation_type(params.operation_name) != "query":
+            return None
+
+        return response_cache_key(
+            document_hash(params.query),
+            params.variables,
+            params.operation_name,
+            self.pretty or request.args.get("pretty"),
+            state.store.version,
+            default_as_of(),
+        )
+
+    def dispatch_request(self):
+        # resolvers, the response cache key and the cached body all read
+        # one version of the store, writes wait until the request is done
+        with state.store.consistent_read():
+            return self.dispatch_cached_request()
+
+    def dispatch_cached_request(self):
+        if (
+            self.response_cache is None
+            or self.backend is None
+            or request.method not in ("GET", "POST")
+            or (request.method == "GET" and self.should_display_graphiql())
+            # a profiled request is executed, not replayed from the cache
+            or g.get("profiling")
+        ):
+            return super().dispatch_request()
+
+        key = self.get_response_cache_key()
+        if key is None:
+            return super().dispatch_request()
+
+        cached = self.response_cache.get(key)
+        if cached is None:
+            response = super().dispatch_request()
+            # results with errors, even next to data, are not cached
+            if response.status_code != 200 or self.has_errors:
+                return response
+            cached = self.response_cache.store_response(
+                key, response.get_data()
+            )
+
+        response = Response(
+            cached.body, status=200, content_type="application/json"
+        )
+        response.set_etag(cached.etag)
+        # conditional GETs with a matching If-None-Match get a 304
+        return response.make_conditional(request)
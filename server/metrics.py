@@ -0,0 +1,172 @@
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# histogram bucket upper bounds in seconds
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# label value used once a histogram holds max_series label sets
+OVERFLOW_LABEL = "other"
+
+
+def _escape(value):
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+    )
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    """thread safe latency histogram with labels
+
+    observations are counted per label set in fixed buckets, label sets
+    past max_series are folded into one OVERFLOW_LABEL series so client
+    supplied values can't grow it without bound
+    """
+
+    def __init__(
+        self,
+        name,
+        documentation,
+        labelnames=(),
+        buckets=DEFAULT_BUCKETS,
+        max_series=500,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.max_series = max_series
+        self._lock = threading.Lock()
+        # label values -> [per bucket counts + overflow, sum, count]
+        self._series = {}
+
+    def observe(self, value, *labelvalues):
+        """record a duration in seconds for the given label values"""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                if len(self._series) >= self.max_series:
+                    labelvalues = (OVERFLOW_LABEL,) * len(self.labelnames)
+                series = self._series.setdefault(
+                    labelvalues, [[0] * (len(self.buckets) + 1), 0.0, 0]
+                )
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labelvalues):
+        """observe the duration of the with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        """the histogram in the prometheus text format"""
+        with self._lock:
+            series = {
+                labelvalues: (list(counts), total, count)
+                for labelvalues, (counts, total, count) in self._series.items()
+            }
+
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for labelvalues, (counts, total, count) in sorted(series.items()):
+            labels = list(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels([*labels, ("le", bound)])
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines)
+
+
+class MetricsRegistry:
+    """named histograms rendered together by the /metrics route"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, name, documentation, labelnames=(), **options):
+        histogram = Histogram(name, documentation, labelnames, **options)
+        self._metrics.append(histogram)
+        return histogram
+
+    def clear(self):
+        for metric in self._metrics:
+            metric.clear()
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+def sampled(rate):
+    """whether to sample an event kept with probability rate"""
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+REGISTRY = MetricsRegistry()
+
+GRAPHQL_PHASE_SECONDS = REGISTRY.histogram(
+    "graphql_phase_seconds",
+    "time spent parsing, executing and encoding graphql requests",
+    ["phase"],
+)
+GRAPHQL_OPERATION_SECONDS = REGISTRY.histogram(
+    "graphql_operation_seconds",
+    "graphql execution time per operation name",
+    ["operation"],
+)
+GRAPHQL_RESOLVER_SECONDS = REGISTRY.histogram(
+    "graphql_resolver_seconds",
+    "time spent in each resolver, Type.field, for sampled requests",
+    ["field"],
+)
+GRAPHQL_LOADER_BATCH_SECONDS = REGISTRY.histogram(
+    "graphql_loader_batch_seconds",
+    "time spent loading one dataloader batch",
+    ["loader"],
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_seconds",
+    "REST api request duration",
+    ["method", "endpoint", "status"],
+)
@@ -0,0 +1,205 @@
+import cProfile
+import hmac
+import os
+import pstats
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from functools import wraps
+
+from flask import current_app, g, jsonify, request
+
+from encoding import dumps_bytes
+
+# sent with PROFILING_TOKEN to profile one request
+PROFILE_HEADER = "X-Profile-Token"
+# file name of the dump of a profile that could not go in the response
+DUMP_HEADER = "X-Profile-Dump"
+
+# functions and allocation sites reported by default
+DEFAULT_PROFILE_TOP = 20
+
+# the profiler and tracemalloc see the whole thread and process, so one
+# request is profiled at a time
+_profile_lock = threading.Lock()
+
+# frames of tracemalloc itself are left out of the allocation sites
+_ALLOCATION_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+)
+
+
+class RequestProfile:
+    """cProfile and tracemalloc over one request
+
+    reports the hottest functions by time spent in their own code and
+    the top allocation sites by memory allocated while the profile ran
+    """
+
+    def __init__(self, top=DEFAULT_PROFILE_TOP):
+        self.top = top
+        self._profiler = cProfile.Profile()
+        self._was_tracing = tracemalloc.is_tracing()
+
+    def start(self):
+        if not self._was_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self._before = tracemalloc.take_snapshot()
+        self._started = time.perf_counter()
+        self._profiler.enable()
+
+    def stop(self):
+        """stop profiling, returns the report"""
+        self._profiler.disable()
+        duration = time.perf_counter() - self._started
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if not self._was_tracing:
+            tracemalloc.stop()
+
+        return {
+            "durationMs": round(duration * 1000, 3),
+            "peakTracedMemory": peak,
+            "functions": self._functions(),
+            "allocations": self._allocations(after),
+        }
+
+    def _functions(self):
+        stats = pstats.Stats(self._profiler).sort_stats("tottime")
+        functions = []
+        for function in stats.fcn_list[: self.top]:
+            _, calls, total, cumulative, _ = stats.stats[function]
+            filename, line, name = function
+            functions.append(
+                {
+                    "function": f"{filename}:{line}({name})",
+                    "calls": calls,
+                    "totalTimeMs": round(total * 1000, 3),
+                    "cumulativeTimeMs": round(cumulative * 1000, 3),
+                }
+            )
+        return functions
+
+    def _allocations(self, after):
+        differences = after.filter_traces(_ALLOCATION_FILTERS).compare_to(
+            self._before.filter_traces(_ALLOCATION_FILTERS), "lineno"
+        )
+        return [
+            {
+                "site": f"{diff.traceback[0].filename}:"
+                f"{diff.traceback[0].lineno}",
+                "size": diff.size_diff,
+                "count": diff.count_diff,
+            }
+            for diff in differences[: self.top]
+            if diff.size_diff > 0
+        ]
+
+
+def dump_name():
+    """unique file name of a profile dump"""
+    return (
+        f"profile-{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        ".json"
+    )
+
+
+def write_dump(report, name, directory=None):
+    """write a report to a JSON file, in the temp directory by default"""
+    path = os.path.join(directory or tempfile.gettempdir(), name)
+    with open(path, "wb") as dump:
+        dump.write(dumps_bytes(report, pretty=True))
+
+
+def attach_report(response, report):
+    """put the report in the JSON response's extensions.profile
+
+    responses that are not a JSON object are left as they are and the
+    report goes to a dump file named in the X-Profile-Dump header
+    """
+    data = None
+    if response.is_json and not response.is_streamed:
+        data = response.get_json(silent=True)
+    if not isinstance(data, dict):
+        name = response.headers[DUMP_HEADER] = dump_name()
+        write_dump(report, name, current_app.config.get("PROFILE_DIR"))
+        return
+
+    data["extensions"] = {**(data.get("extensions") or {}), "profile": report}
+    response.set_data(dumps_bytes(data))
+    # the ETag was computed for the body without the report
+    response.headers.pop("ETag", None)
+
+
+def _profile_token():
+    # the request's token when profiling is configured, None otherwise
+    expected = current_app.config.get("PROFILING_TOKEN")
+    if not expected:
+        return None
+    return request.headers.get(PROFILE_HEADER)
+
+
+def profiled(view):
+    """profile requests to view that send the profiling token
+
+    Profiling is enabled by setting PROFILING_TOKEN, a request sending
+    it in X-Profile-Token runs under RequestProfile and gets the report
+    in its extensions. Streamed responses are profiled until they are
+    closed and their report is dumped to PROFILE_DIR. Other requests
+    only pay for a config lookup.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = _profile_token()
+        if token is None:
+            return view(*args, **kwargs)
+        if not hmac.compare_digest(
+            token.encode(), current_app.config["PROFILING_TOKEN"].encode()
+        ):
+            return jsonify({"error": "Invalid profiling token"}), 403
+        if not _profile_lock.acquire(blocking=False):
+            return (
+                jsonify({"error": "Another request is being profiled"}),
+                409,
+            )
+
+        profile = RequestProfile(
+            current_app.config.get("PROFILE_TOP", DEFAULT_PROFILE_TOP)
+        )
+        # views can tell, e.g. to execute instead of replaying a cache
+        g.profiling = True
+        try:
+            profile.start()
+            response = current_app.make_response(view(*args, **kwargs))
+        except BaseException:
+            try:
+                profile.stop()
+            finally:
+                _profile_lock.release()
+            raise
+
+        if response.is_streamed:
+            name = response.headers[DUMP_HEADER] = dump_name()
+            directory = current_app.config.get("PROFILE_DIR")
+
+            def finish():
+                try:
+                    write_dump(profile.stop(), name, directory)
+                finally:
+                    _profile_lock.release()
+
+            response.call_on_close(finish)
+            return response
+
+        try:
+            attach_report(response, profile.stop())
+        finally:
+            _profile_lock.release()
+        return response
+
+    return wrapper
@@ -1,6 +1,28 @@
 import datetime
+from collections.abc import Mapping
+
 from marshmallow import Schema, fields, ValidationError, validates
 
+# messages PaymentDTO reports, PaymentValidator reports the same ones
+INVALID_INPUT = "Invalid input type."
+MISSING_FIELD = "Missing data for required field."
+NULL_FIELD = "Field may not be null."
+UNKNOWN_FIELD = "Unknown field."
+INVALID_INTEGER = "Not a valid integer."
+INVALID_NUMBER = "Not a valid number."
+NUMBER_TOO_LARGE = "Number too large."
+SPECIAL_NUMBER = "Special numeric values (nan or infinity) are not permitted."
+INVALID_STRING = "Not a valid string."
+AMOUNT_NOT_POSITIVE = "payment_amount must be greater than 0"
+INVALID_DATE = "Invalid date format. Use YYYY-MM-DD"
+
+
+def parse_payment_date(value):
+    """parse a YYYY-MM-DD payment date string into a date"""
+    if len(value) != 10 or value[4] != "-" or value[7] != "-":
+        raise ValueError(value)
+    return datetime.date.fromisoformat(value)
+
 
 class PaymentDTO(Schema):
     loan_id = fields.Int(required=True)
@@ -12,14 +34,114 @@ class PaymentDTO(Schema):
         if value is None:
             raise ValidationError("payment_amount is required")
         if value <= 0:
-            raise ValidationError("payment_amount must be greater than 0")
+            raise ValidationError(AMOUNT_NOT_POSITIVE)
 
     @validates("payment_date")
     def validate_payment_date(self, value):
         if value is None:
             raise ValidationError("payment_date cannot be null or empty")
         try:
-            year, month, day = map(int, value.split("-"))
-            datetime.date(year, month, day)
+            parse_payment_date(value)
         except (ValueError, AttributeError):
-            raise ValidationError("Invalid date format. Use YYYY-MM-DD")
+            raise ValidationError(INVALID_DATE)
+
+
+def _number(value, num_type, invalid):
+    # marshmallow's non strict number coercion, bools are rejected
+    if value is True or value is False:
+        raise ValidationError(invalid)
+    try:
+        return num_type(value)
+    except (TypeError, ValueError):
+        raise ValidationError(invalid)
+    except OverflowError:
+        raise ValidationError(NUMBER_TOO_LARGE)
+
+
+def _parse_loan_id(value):
+    return _number(value, int, INVALID_INTEGER)
+
+
+def _parse_payment_amount(value):
+    amount = _number(value, float, INVALID_NUMBER)
+    # nan fails every comparison, infinities are out of this range
+    if not -float("inf") < amount < float("inf"):
+        raise ValidationError(SPECIAL_NUMBER)
+    if amount <= 0:
+        raise ValidationError(AMOUNT_NOT_POSITIVE)
+    return amount
+
+
+def _parse_payment_date(value):
+    if not isinstance(value, (str, bytes)):
+        raise ValidationError(INVALID_STRING)
+    try:
+        return parse_payment_date(value)
+    except (ValueError, TypeError):
+        raise ValidationError(INVALID_DATE)
+
+
+class PaymentValidator:
+    """reusable single pass validator for payment payloads
+
+    Accepts and rejects the same payloads as PaymentDTO with the same
+    messages, but checks each field once with a plain function instead
+    of going through a marshmallow schema, and returns payment_date
+    parsed into a date so callers don't parse it again.
+    """
+
+    FIELDS = (
+        ("loan_id", _parse_loan_id),
+        ("payment_amount", _parse_payment_amount),
+        ("payment_date", _parse_payment_date),
+    )
+    FIELD_NAMES = frozenset(name for name, _ in FIELDS)
+
+    def validate(self, data):
+        """(row, errors) for one payload
+
+        row holds the parsed fields that are valid, errors maps field
+        names to lists of messages like marshmallow's err.messages
+        """
+        if not isinstance(data, Mapping):
+            return {}, {"_schema": [INVALID_INPUT]}
+
+        row, errors = {}, {}
+        present = 0
+        for name, parse in self.FIELDS:
+            if name not in data:
+                errors[name] = [MISSING_FIELD]
+                continue
+            present += 1
+            value = data[name]
+            if value is None:
+                errors[name] = [NULL_FIELD]
+                continue
+            try:
+                row[name] = parse(value)
+            except ValidationError as err:
+                errors[name] = err.messages
+
+        if len(data) > present:
+            for name in data:
+                if name not in self.FIELD_NAMES:
+                    errors[name] = [UNKNOWN_FIELD]
+        return row, errors
+
+    def validate_many(self, records):
+        """(rows, errors) for many payloads
+
+        rows are aligned with records, errors maps the index of every
+        invalid record to its messages
+        """
+        rows, errors = [], {}
+        for index, data in enumerate(records):
+            row, row_errors = self.validate(data)
+            rows.append(row)
+            if row_errors:
+                errors[index] = row_errors
+        return rows, errors
+
+
+# shared by every payment write path, the validator holds no state
+payment_validator = PaymentValidator()
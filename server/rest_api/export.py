@@ -0,0 +1,149 @@
+import csv
+import io
+
+from flask import Response, jsonify, request
+import state
+from encoding import dumps_bytes
+from utils import NO_DATE, PAYMENT_STATUSES, get_payment_statuses
+
+# loans read from the store per chunk, bounds the memory of an export
+# whatever the size of the portfolio
+EXPORT_CHUNK_SIZE = 500
+
+EXPORT_COLUMNS = (
+    "loan_id",
+    "loan_name",
+    "interest_rate",
+    "principal",
+    "due_date",
+    "payment_id",
+    "payment_amount",
+    "payment_date",
+    "status",
+)
+
+
+def _read_chunk(store, chunk_size, after):
+    # a chunk's loans and payments come from one store version, the
+    # lock is released before its rows are sent
+    with store.consistent_read():
+        page = store.page_loans(first=chunk_size, after=after)
+        loan_ids = [loan["id"] for loan in page.items]
+        return page, store.get_payments_by_loan_ids(loan_ids)
+
+
+def export_rows(store, chunk_size=EXPORT_CHUNK_SIZE):
+    """rows of the loan book, one per payment with its loan and status
+
+    loans without payments get one Unpaid row with empty payment fields.
+    Loans are read chunk_size at a time in id order and each chunk is
+    classified in one get_payment_statuses batch, so only one chunk is
+    held in memory at a time.
+    """
+    after = None
+    while True:
+        page, payments_by_loan = _read_chunk(store, chunk_size, after)
+        pairs = [
+            (loan, payment)
+            for loan, payments in zip(page.items, payments_by_loan)
+            for payment in payments or (None,)
+        ]
+        codes = get_payment_statuses(
+            [loan["due_date"].toordinal() for loan, _ in pairs],
+            [
+                (
+                    payment["payment_date"].toordinal()
+                    if payment and payment["payment_date"]
+                    else NO_DATE
+                )
+                for _, payment in pairs
+            ],
+        )
+        for (loan, payment), code in zip(pairs, codes):
+            payment = payment or {}
+            yield {
+                "loan_id": loan["id"],
+                "loan_name": loan["name"],
+                "interest_rate": loan["interest_rate"],
+                "principal": loan["principal"],
+                "due_date": loan["due_date"],
+                "payment_id": payment.get("id"),
+                "payment_amount": payment.get("payment_amount"),
+                "payment_date": payment.get("payment_date"),
+                "status": PAYMENT_STATUSES[code],
+            }
+
+        if not page.has_next_page:
+            return
+        after = page.items[-1]["id"]
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def ndjson_export(rows, chunk_size=EXPORT_CHUNK_SIZE):
+    """NDJSON body, one JSON object per row"""
+    for chunk in _chunks(rows, chunk_size):
+        yield b"".join(dumps_bytes(row) + b"\n" for row in chunk)
+
+
+def csv_export(rows, chunk_size=EXPORT_CHUNK_SIZE):
+    """CSV body with a header line, empty cells for missing values"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    # the header goes out before the store is read
+    yield buffer.getvalue()
+    for chunk in _chunks(rows, chunk_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(
+            [row[column] for column in EXPORT_COLUMNS] for row in chunk
+        )
+        yield buffer.getvalue()
+
+
+# format -> (body generator, mimetype)
+EXPORT_FORMATS = {
+    "ndjson": (ndjson_export, "application/x-ndjson"),
+    "csv": (csv_export, "text/csv"),
+}
+
+
+def export_loans():
+    """REST endpoint streaming the loan book with payments and statuses
+
+    ?format= picks ndjson, the default, or csv. Rows are generated while
+    the response is sent, so the first bytes go out right away and
+    memory use doesn't grow with the portfolio.
+    """
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        return (
+            jsonify(
+                {
+                    "error": "Unsupported format, use one of "
+                    + ", ".join(EXPORT_FORMATS)
+                }
+            ),
+            400,
+        )
+
+    body, mimetype = EXPORT_FORMATS[export_format]
+    return Response(
+        body(export_rows(state.store)),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": (
+                f"attachment; filename=loans.{export_format}"
+            )
+        },
+    )
@@ -0,0 +1,72 @@
+from flask import Response, current_app, jsonify, request
+
+from events import PAYMENT_EVENTS, RESET
+
+# seconds between keepalive comments on an idle stream, writing is how a
+# closed connection gets noticed and its subscription dropped
+DEFAULT_HEARTBEAT = 15.0
+
+# EventSource clients wait this many milliseconds before reconnecting
+RETRY_FRAME = b"retry: 3000\n\n"
+KEEPALIVE_FRAME = b": keepalive\n\n"
+# tells a subscriber that missed events to reload its data, it has no id
+# so a reconnect still resumes after the last event it got
+RESET_FRAME = b"event: reset\ndata: {}\n\n"
+
+
+def event_stream(subscription, heartbeat=DEFAULT_HEARTBEAT):
+    """server-sent event body of a subscription, runs until closed"""
+    yield RETRY_FRAME
+    while True:
+        frames = subscription.get(heartbeat)
+        if frames is RESET:
+            yield RESET_FRAME
+        elif frames:
+            yield b"".join(frames)
+        else:
+            yield KEEPALIVE_FRAME
+
+
+def _last_event_id():
+    # EventSource sends the header on reconnects, the query parameter
+    # lets a client resume on its first connection
+    value = request.headers.get("Last-Event-ID") or request.args.get(
+        "lastEventId"
+    )
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+def payment_events():
+    """REST endpoint streaming added payments as server-sent events
+
+    Every payment added through the REST api is sent as a `payment`
+    event with the payment and its status. An idle subscriber costs a
+    small queue and a waiting worker thread, or greenlet under serve.py,
+    until it disconnects, EVENT_STREAM_MAX_SUBSCRIBERS caps them per
+    worker. Subscribers that
+    fall behind get a `reset` event and should reload the loans instead
+    of receiving the events they missed.
+    """
+    subscription = PAYMENT_EVENTS.subscribe(
+        _last_event_id(),
+        current_app.config.get("EVENT_STREAM_MAX_SUBSCRIBERS"),
+    )
+    if subscription is None:
+        return jsonify({"error": "Too many subscribers, retry later"}), 503
+
+    response = Response(
+        event_stream(
+            subscription,
+            current_app.config.get(
+                "EVENT_STREAM_HEARTBEAT", DEFAULT_HEARTBEAT
+            ),
+        ),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # also runs when the client leaves before the stream started
+    response.call_on_close(lambda: PAYMENT_EVENTS.unsubscribe(subscription))
+    return response
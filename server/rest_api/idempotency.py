@@ -0,0 +1,130 @@
+import hashlib
+from collections import namedtuple
+from functools import wraps
+
+from flask import current_app, jsonify, request
+
+from cache import TTLCache
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+# keys remembered by default and for how long, one entry holds a
+# created payment response of a few hundred bytes
+DEFAULT_IDEMPOTENCY_CACHE_SIZE = 10_000
+DEFAULT_IDEMPOTENCY_TTL = 24 * 60 * 60
+MAX_KEY_LENGTH = 255
+
+StoredResponse = namedtuple(
+    "StoredResponse", ["fingerprint", "status", "body", "mimetype"]
+)
+
+
+class _InFlight:
+    """placeholder of a key whose first request is still running"""
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+
+
+def request_fingerprint():
+    """sha256 of the request body, a retry sends the same body"""
+    return hashlib.sha256(request.get_data()).hexdigest()
+
+
+class IdempotencyCache(TTLCache):
+    """responses of created resources keyed by Idempotency-Key
+
+    bounded to maxsize keys, each one expires ttl seconds after it was
+    stored, so memory stays capped however many clients retry
+    """
+
+    def __init__(
+        self,
+        maxsize=DEFAULT_IDEMPOTENCY_CACHE_SIZE,
+        ttl=DEFAULT_IDEMPOTENCY_TTL,
+        **options,
+    ):
+        super().__init__(maxsize, ttl, **options)
+
+
+def idempotent(cache):
+    """make a POST view replay its 201 response for a repeated key
+
+    The first request with a key runs the view, a 201 response is then
+    stored and returned to every retry with the same key and body
+    without running the view again. Other responses release the key so
+    the client can retry. A key reused with a different body gets 422,
+    and a retry arriving while the first request runs gets 409.
+    Requests without the header run as usual.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if key is None:
+                return view(*args, **kwargs)
+            if not key or len(key) > MAX_KEY_LENGTH:
+                return (
+                    jsonify(
+                        {
+                            "error": f"{IDEMPOTENCY_HEADER} must be 1 to "
+                            f"{MAX_KEY_LENGTH} characters"
+                        }
+                    ),
+                    400,
+                )
+
+            fingerprint = request_fingerprint()
+            claim = _InFlight(fingerprint)
+            entry = cache.setdefault(key, claim)
+            if entry is not claim:
+                if entry.fingerprint != fingerprint:
+                    return (
+                        jsonify(
+                            {
+                                "error": f"{IDEMPOTENCY_HEADER} was already "
+                                "used with a different request"
+                            }
+                        ),
+                        422,
+                    )
+                if isinstance(entry, _InFlight):
+                    return (
+                        jsonify(
+                            {
+                                "error": "A request with this "
+                                f"{IDEMPOTENCY_HEADER} is still in progress"
+                            }
+                        ),
+                        409,
+                    )
+                response = current_app.response_class(
+                    entry.body, status=entry.status, mimetype=entry.mimetype
+                )
+                response.headers[REPLAYED_HEADER] = "true"
+                return response
+
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+            except BaseException:
+                cache.pop(key)
+                raise
+            if response.status_code == 201:
+                cache.set(
+                    key,
+                    StoredResponse(
+                        fingerprint,
+                        response.status_code,
+                        response.get_data(),
+                        response.mimetype,
+                    ),
+                )
+            else:
+                cache.pop(key)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -1,11 +1,30 @@
-import datetime
+import json
 from flask import jsonify, request
-from marshmallow import ValidationError
-from state import loan_payments, loans
-from rest_api.dtos.payment_dto import PaymentDTO
+import state
+from events import PAYMENT_EVENTS
+from rest_api.dtos.payment_dto import payment_validator
+from utils import get_payment_status
 
-# loan lookup
-loan_lookup = {loan["id"]: loan for loan in loans}
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/ndjson")
+
+
+def serialize_payment(payment):
+    """JSON friendly payment returned by the payments endpoints"""
+    return {
+        "id": payment["id"],
+        "loan_id": payment["loan_id"],
+        "payment_amount": payment["payment_amount"],
+        # dates are written by the app's json provider
+        "payment_date": payment["payment_date"] or None,
+    }
+
+
+def payment_event(loan, payment):
+    """data of the payment event sent to /api/v1/payments/events"""
+    return {
+        "payment": serialize_payment(payment),
+        "status": get_payment_status(loan, payment),
+    }
 
 
 def add_payment():
@@ -13,61 +32,31 @@ def add_payment():
     try:
         data = request.get_json()
 
-        # validate request data via DTO
-        try:
-            validated_data = PaymentDTO().load(data)
-        except ValidationError as err:
-            return jsonify({"error": err.messages}), 400
+        # validate and parse request data in one pass
+        validated_data, errors = payment_validator.validate(data)
+        if errors:
+            return jsonify({"error": errors}), 400
 
         loan_id = validated_data["loan_id"]
-        payment_amount = validated_data.get("payment_amount")
-        payment_date_str = validated_data.get("payment_date")
 
         # validate loan exists
-        loan_obj = loan_lookup.get(loan_id)
+        loan_obj = state.store.get_loan(loan_id)
         if not loan_obj:
             return jsonify({"error": f"Loan with id {loan_id} not found"}), 404
 
-        # parse payment date
-        payment_date = None
-        if payment_date_str:
-            try:
-                year, month, day = map(int, payment_date_str.split("-"))
-                payment_date = datetime.date(year, month, day)
-            except Exception:
-                return (
-                    jsonify({"error": "Invalid date format, use YYYY-MM-DD"}),
-                    400,
-                )
-
-        # generate new payment ID
-        payment_id = max([p["id"] for p in loan_payments], default=0) + 1
-
-        # create new payment
-        new_payment = {
-            "id": payment_id,
-            "loan_id": loan_id,
-            "payment_amount": payment_amount,
-            "payment_date": payment_date,
-        }
-
-        # append to in memory loan_payments store
-        loan_payments.append(new_payment)
+        # create the new payment, the store allocates its ID
+        new_payment = state.store.add_payment(
+            loan_id,
+            validated_data["payment_amount"],
+            validated_data["payment_date"],
+        )
+        PAYMENT_EVENTS.publish("payment", payment_event(loan_obj, new_payment))
 
         return (
             jsonify(
                 {
                     "message": "Payment added successfully",
-                    "payment": {
-                        "id": new_payment["id"],
-                        "loan_id": new_payment["loan_id"],
-                        "payment_amount": new_payment["payment_amount"],
-                        "payment_date": (
-                            str(new_payment["payment_date"])
-                            if new_payment["payment_date"]
-                            else None
-                        ),
-                    },
+                    "payment": serialize_payment(new_payment),
                 }
             ),
             201,
@@ -75,3 +64,101 @@ def add_payment():
 
     except Exception:
         return jsonify({"error": "Internal server error"}), 500
+
+
+def read_batch_records():
+    """read batch records from a JSON array or a streamed NDJSON body
+
+    Returns the records and a dict of index -> error for NDJSON lines
+    that are not valid JSON, those lines keep their index as an empty
+    record so results line up with the input.
+    """
+    if request.mimetype in NDJSON_MIMETYPES:
+        records, errors = [], {}
+        # iterate the stream line by line instead of buffering the body
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                errors[len(records)] = "Invalid JSON"
+                records.append({})
+        return records, errors
+
+    records = request.get_json(silent=True)
+    if not isinstance(records, list):
+        raise ValueError("Expected a JSON array of payments")
+    return records, {}
+
+
+def add_payments_batch():
+    """REST endpoint to add many payments in a single request
+
+    Accepts a JSON array or an NDJSON body, validates every record in
+    bulk and inserts all valid ones under a single store write lock.
+    Each input row gets a result with either the created payment or
+    its errors.
+    """
+    try:
+        try:
+            records, errors = read_batch_records()
+        except ValueError as err:
+            return jsonify({"error": str(err)}), 400
+
+        if not records:
+            return jsonify({"error": "No payments provided"}), 400
+
+        # validate and parse request data in one pass over the records
+        rows, row_errors = payment_validator.validate_many(records)
+        errors = {**row_errors, **errors}
+
+        valid_indexes, valid_rows, valid_loans = [], [], []
+        for index, row in enumerate(rows):
+            if index in errors:
+                continue
+
+            # validate loan exists
+            loan = state.store.get_loan(row["loan_id"])
+            if not loan:
+                errors[index] = f"Loan with id {row['loan_id']} not found"
+                continue
+
+            valid_indexes.append(index)
+            valid_rows.append(row)
+            valid_loans.append(loan)
+
+        inserted = state.store.add_payments(valid_rows)
+        payments = dict(zip(valid_indexes, inserted))
+        if inserted:
+            PAYMENT_EVENTS.publish_many(
+                "payment",
+                [
+                    payment_event(loan, payment)
+                    for loan, payment in zip(valid_loans, inserted)
+                ],
+            )
+
+        results = [
+            (
+                {"index": index, "payment": serialize_payment(payments[index])}
+                if index in payments
+                else {"index": index, "error": errors[index]}
+            )
+            for index in range(len(records))
+        ]
+
+        return (
+            jsonify(
+                {
+                    "inserted": len(payments),
+                    "failed": len(errors),
+                    "results": results,
+                }
+            ),
+            201 if not errors else 207,
+        )
+
+    except Exception:
+        return jsonify({"error": "Internal server error"}), 500
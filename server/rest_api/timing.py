@@ -0,0 +1,23 @@
+import time
+
+from flask import g, request
+
+from metrics import HTTP_REQUEST_SECONDS
+
+
+def start_request_timer():
+    """before_request hook, remembers when the request started"""
+    g.request_started = time.perf_counter()
+
+
+def record_request_time(response):
+    """after_request hook, observes the request duration"""
+    started = g.pop("request_started", None)
+    if started is not None:
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            request.method,
+            request.url_rule.rule if request.url_rule else "unmatched",
+            str(response.status_code),
+        )
+    return response
@@ -0,0 +1,23 @@
+"""serves the app from a gevent WSGI server
+
+Every request, and every open payment event stream, is a greenlet
+instead of a worker thread, so idle dashboards cost a few KB each and a
+worker takes thousands of them, see events.default_max_subscribers.
+threading is patched before the app is imported, so the store locks
+and the event queues wait cooperatively.
+"""
+
+from gevent import monkey
+
+monkey.patch_all()
+
+import os  # noqa: E402
+
+from gevent.pywsgi import WSGIServer  # noqa: E402
+
+from app import app  # noqa: E402
+
+if __name__ == "__main__":
+    WSGIServer(
+        ("0.0.0.0", int(os.environ.get("PORT", "5000"))), app, log=None
+    ).serve_forever()
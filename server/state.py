@@ -1,4 +1,11 @@
 import datetime
+import os
+from functools import partial
+
+from storage.columnar import ColumnarStore
+from storage.memory import MemoryStore
+from storage.sqlite import SQLiteStore
+from storage.wal import open_persistent_store
 
 # in memory store for loans, loan_payments
 loans = [
@@ -42,3 +49,38 @@ loan_payments = [
     {"id": 2, "loan_id": 2, "payment_date": datetime.date(2025, 3, 15)},
     {"id": 3, "loan_id": 3, "payment_date": datetime.date(2025, 4, 5)},
 ]
+
+# store backends, STORE_BACKEND=columnar keeps payments in compact
+# typed arrays instead of dicts for large resident portfolios and
+# STORE_BACKEND=sqlite keeps them in the SQLITE_PATH database, shared by
+# every worker process
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "numida.db")
+STORE_BACKENDS = {
+    "memory": MemoryStore,
+    "columnar": ColumnarStore,
+    "sqlite": partial(SQLiteStore, path=SQLITE_PATH),
+}
+STORE_BACKEND = os.environ.get("STORE_BACKEND", "memory")
+
+# PERSISTENCE_DIR=<dir> makes the in memory backends log every added
+# payment to disk and restore them on startup, the payments above only
+# seed an empty directory
+PERSISTENCE_DIR = os.environ.get("PERSISTENCE_DIR")
+
+# the sqlite backend is durable on its own, there is no payment log to
+# keep next to it
+if PERSISTENCE_DIR and STORE_BACKEND == "sqlite":
+    raise ValueError(
+        "PERSISTENCE_DIR only applies to the memory and columnar "
+        "backends, STORE_BACKEND=sqlite already keeps its data in "
+        "SQLITE_PATH"
+    )
+
+# indexed store wrapping the lists above, resolvers and REST handlers
+# should go through it instead of scanning the lists
+if PERSISTENCE_DIR:
+    store = open_persistent_store(
+        STORE_BACKENDS[STORE_BACKEND], loans, loan_payments, PERSISTENCE_DIR
+    )
+else:
+    store = STORE_BACKENDS[STORE_BACKEND](loans, loan_payments)
@@ -0,0 +1,223 @@
+import datetime
+import math
+from array import array
+
+from storage.memory import MemoryStore
+from utils import NO_DATE
+
+
+class PaymentView:
+    """read only view of a single row of a PaymentColumns table
+
+    Exposes the payment fields as attributes for the graphene types and
+    through item access / get() for code written against payment dicts.
+    """
+
+    __slots__ = ("_columns", "row")
+
+    FIELDS = ("id", "loan_id", "payment_amount", "payment_date")
+
+    def __init__(self, columns, row):
+        self._columns = columns
+        self.row = row
+
+    @property
+    def id(self):
+        return self._columns.ids[self.row]
+
+    @property
+    def loan_id(self):
+        return self._columns.loan_ids[self.row]
+
+    @property
+    def payment_amount(self):
+        amount = self._columns.payment_amounts[self.row]
+        return None if math.isnan(amount) else amount
+
+    @property
+    def payment_date(self):
+        ordinal = self._columns.payment_dates[self.row]
+        if ordinal == NO_DATE:
+            return None
+        return datetime.date.fromordinal(ordinal)
+
+    def __getitem__(self, field):
+        if field not in self.FIELDS:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def get(self, field, default=None):
+        if field not in self.FIELDS:
+            return default
+        return getattr(self, field)
+
+    def __repr__(self):
+        fields = ", ".join(f"{f}={self[f]!r}" for f in self.FIELDS)
+        return f"PaymentView({fields})"
+
+
+class PaymentColumns:
+    """payments stored column wise in typed arrays
+
+    ids and loan ids are 64 bit ints, dates are day ordinals and amounts
+    are doubles, so a payment costs a few dozen bytes instead of a dict
+    with boxed values. Iterating yields PaymentView rows.
+    """
+
+    def __init__(self):
+        self.ids = array("q")
+        self.loan_ids = array("q")
+        self.payment_dates = array("i")
+        self.payment_amounts = array("d")
+
+    def _columns(self):
+        return (
+            self.ids,
+            self.loan_ids,
+            self.payment_dates,
+            self.payment_amounts,
+        )
+
+    def append(self, payment_id, loan_id, payment_amount, payment_date):
+        """append a row and return a view of it
+
+        the row is added to every column or to none, a value a column
+        rejects takes the values already appended back out
+        """
+        row = (
+            payment_id,
+            loan_id,
+            payment_date.toordinal() if payment_date else NO_DATE,
+            math.nan if payment_amount is None else payment_amount,
+        )
+        appended = []
+        try:
+            for column, value in zip(self._columns(), row):
+                column.append(value)
+                appended.append(column)
+        except BaseException:
+            for column in appended:
+                column.pop()
+            raise
+        return PaymentView(self, len(self.ids) - 1)
+
+    def copy(self):
+        """independent copy of the columns"""
+        columns = PaymentColumns()
+        for column, source in zip(columns._columns(), self._columns()):
+            column.extend(source)
+        return columns
+
+    def view(self, row):
+        return PaymentView(self, row)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return (PaymentView(self, row) for row in range(len(self.ids)))
+
+
+class ColumnarStore(MemoryStore):
+    """MemoryStore variant keeping payments in PaymentColumns
+
+    The indexes hold row numbers in typed arrays rather than references
+    to payment dicts, views are only created when payments are read.
+    """
+
+    @classmethod
+    def from_payment_columns(cls, loans, columns, payment_indexes=None):
+        """store adopting the given columns without copying them"""
+        return cls(loans, columns, payment_indexes)
+
+    def _create_payment_table(self, loan_payments):
+        if isinstance(loan_payments, PaymentColumns):
+            return loan_payments
+
+        columns = PaymentColumns()
+        for payment in loan_payments:
+            columns.append(
+                payment["id"],
+                payment["loan_id"],
+                payment.get("payment_amount"),
+                payment.get("payment_date"),
+            )
+        return columns
+
+    def _append_payment(
+        self, payment_id, loan_id, payment_amount, payment_date
+    ):
+        return self.loan_payments.append(
+            payment_id, loan_id, payment_amount, payment_date
+        )
+
+    def _copy_payment_table(self):
+        # snapshots write from the copy, a buffer exported over the
+        # live arrays would make every append fail while it is written
+        return self.loan_payments.copy()
+
+    def _max_payment_id(self):
+        return max(self.loan_payments.ids, default=0)
+
+    def _payment_row_refs(self, rows):
+        # refs are the row numbers, index rows are adopted as they are
+        return rows if isinstance(rows, array) else array("q", rows)
+
+    def _payment_columns(self):
+        columns = self.loan_payments
+        return (
+            columns.loan_ids,
+            columns.payment_amounts,
+            columns.payment_dates,
+        )
+
+    def _new_ref_list(self):
+        return array("q")
+
+    def _payment_ref(self, payment):
+        return payment.row
+
+    def _payment_from_ref(self, ref):
+        return self.loan_payments.view(ref)
+
+    def _payment_ref_id(self, ref):
+        return self.loan_payments.ids[ref]
+
+
+def measure_footprint(store_class, payment_count, loan_count=1000):
+    """bytes allocated by a store holding payment_count payments"""
+    import tracemalloc
+
+    loans = [
+        {"id": i, "principal": 10000, "due_date": datetime.date(2025, 3, 1)}
+        for i in range(1, loan_count + 1)
+    ]
+    # payments arrive in payment date order over a year
+    start = datetime.date(2025, 1, 1).toordinal()
+
+    tracemalloc.start()
+    try:
+        store = store_class(loans, [])
+        baseline = tracemalloc.get_traced_memory()[0]
+        for i in range(payment_count):
+            store.add_payment(
+                i % loan_count + 1,
+                float(i % 5000),
+                datetime.date.fromordinal(start + i * 365 // payment_count),
+            )
+        return tracemalloc.get_traced_memory()[0] - baseline
+    finally:
+        tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    # python -m storage.columnar [payment_count]
+    import sys
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    for store_class in (MemoryStore, ColumnarStore):
+        size = measure_footprint(store_class, count)
+        print(
+            f"{store_class.__name__:<14} {count} payments: "
+            f"{size / 1024 / 1024:8.2f} MiB, {size / count:6.1f} B/payment"
+        )
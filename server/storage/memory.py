@@ -0,0 +1,754 @@
+import datetime
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from operator import itemgetter
+
+from amortization import LoanSchedule
+from storage.paging import keyset_page
+from storage.rwlock import ReadWriteLock, read_locked
+from storage.sequence import IdSequence
+from utils import (
+    AGING_BUCKETS,
+    DEFAULTED,
+    LATE,
+    NO_DATE,
+    PAYMENT_STATUSES,
+    UNPAID,
+    get_aging_due_range,
+    get_payment_status,
+    get_payment_statuses,
+)
+
+# loan statuses whose principal counts as at risk
+AT_RISK_STATUSES = frozenset(
+    PAYMENT_STATUSES[code] for code in (LATE, DEFAULTED, UNPAID)
+)
+
+
+def _ordinal_range(ordinals, date_from=None, date_to=None):
+    # index bounds of the inclusive [date_from, date_to] range of a
+    # sorted sequence of day ordinals
+    lo = (
+        0
+        if date_from is None
+        else bisect_left(ordinals, date_from.toordinal())
+    )
+    hi = (
+        len(ordinals)
+        if date_to is None
+        else bisect_right(ordinals, date_to.toordinal())
+    )
+    return lo, max(lo, hi)
+
+
+# the payment indexes of a store as row numbers into its payments, so
+# they can be written to a snapshot and adopted without indexing every
+# payment again, see build_payment_indexes
+PaymentIndexes = namedtuple(
+    "PaymentIndexes",
+    [
+        "row_count",
+        "date_rows",
+        "date_ordinals",
+        "status_rows",
+        "status_counts",
+        "loan_rows",
+        "loan_ids",
+        "loan_counts",
+        "loan_amounts_paid",
+        "loan_latest_ordinals",
+        "loan_latest_codes",
+    ],
+)
+
+
+def build_payment_indexes(due_ordinals, loan_ids, amounts, ordinals):
+    """PaymentIndexes of payment columns
+
+    due_ordinals maps loan ids to due date ordinals. Dated rows are
+    sorted by payment date, rows of known loans by status code and all
+    rows by loan id, each sort keeps the row order of equal keys. Every
+    loan with payments gets a run of loan_rows with its amount paid and
+    the date and status code of its latest dated payment, the last one
+    of that date, or NO_DATE.
+    """
+    rows = range(len(loan_ids))
+    codes = get_payment_statuses(
+        [due_ordinals.get(loan_id, NO_DATE) for loan_id in loan_ids],
+        ordinals,
+    )
+
+    date_rows = array(
+        "q",
+        sorted(
+            (row for row in rows if ordinals[row] != NO_DATE),
+            key=ordinals.__getitem__,
+        ),
+    )
+    status_rows = array(
+        "q",
+        sorted(
+            (row for row in rows if loan_ids[row] in due_ordinals),
+            key=codes.__getitem__,
+        ),
+    )
+    status_counts = array("q", bytes(8 * len(PAYMENT_STATUSES)))
+    for row in status_rows:
+        status_counts[codes[row]] += 1
+
+    indexes = PaymentIndexes(
+        row_count=len(rows),
+        date_rows=date_rows,
+        date_ordinals=array("i", (ordinals[row] for row in date_rows)),
+        status_rows=status_rows,
+        status_counts=status_counts,
+        loan_rows=array("q", sorted(rows, key=loan_ids.__getitem__)),
+        loan_ids=array("q"),
+        loan_counts=array("q"),
+        loan_amounts_paid=array("d"),
+        loan_latest_ordinals=array("i"),
+        loan_latest_codes=array("b"),
+    )
+    for row in indexes.loan_rows:
+        loan_id = loan_ids[row]
+        if not indexes.loan_ids or indexes.loan_ids[-1] != loan_id:
+            indexes.loan_ids.append(loan_id)
+            indexes.loan_counts.append(0)
+            indexes.loan_amounts_paid.append(0)
+            indexes.loan_latest_ordinals.append(NO_DATE)
+            indexes.loan_latest_codes.append(UNPAID)
+        indexes.loan_counts[-1] += 1
+
+        # missing amounts are None or nan depending on the table
+        amount = amounts[row]
+        if amount and not math.isnan(amount):
+            indexes.loan_amounts_paid[-1] += amount
+
+        ordinal = ordinals[row]
+        # NO_DATE is below every date
+        if ordinal != NO_DATE and ordinal >= indexes.loan_latest_ordinals[-1]:
+            indexes.loan_latest_ordinals[-1] = ordinal
+            indexes.loan_latest_codes[-1] = codes[row]
+    return indexes
+
+
+class MemoryStore:
+    """in memory store for loans and loan payments
+
+    Keeps a primary key index on loans and a loan_id -> payments
+    secondary index next to the raw lists so resolvers and the REST
+    handlers never have to scan the full lists to find a record.
+    Payments are also indexed by payment date (sorted, for bisect range
+    scans) and by status, and unpaid loans by due date for the aging
+    buckets, all indexes are updated on every insert.
+
+    Indexes hold payment refs, for this store the payment dicts
+    themselves, subclasses may use something more compact. They are
+    built in bulk as PaymentIndexes, given payment_indexes of the
+    first rows of loan_payments, e.g. read from a snapshot, only the
+    rows after them are indexed one by one.
+    """
+
+    def __init__(self, loans=None, loan_payments=None, payment_indexes=None):
+        self.loans = loans if loans is not None else []
+        self.loan_payments = self._create_payment_table(
+            loan_payments if loan_payments is not None else []
+        )
+
+        # primary key index, loan id -> loan, plus loans sorted by id
+        # for keyset pagination
+        self._loans_by_id = {loan["id"]: loan for loan in self.loans}
+        self._loans_by_sorted_id = sorted(
+            self.loans, key=lambda loan: loan["id"]
+        )
+
+        # due date index, loans sorted by due date with their ordinals
+        self._loans_by_due_date = sorted(
+            self.loans, key=lambda loan: loan["due_date"]
+        )
+        self._loan_due_ordinals = array(
+            "i",
+            (loan["due_date"].toordinal() for loan in self._loans_by_due_date),
+        )
+
+        # loans without any dated payment
+        self._unpaid_loan_ids = set(self._loans_by_id)
+
+        # portfolio aggregates, a loan's status is the status of its
+        # latest dated payment or Unpaid, kept current on every insert
+        self._loan_latest_payment = {}
+        self._loan_status_counts = dict.fromkeys(PAYMENT_STATUSES, 0)
+        self._loan_status_counts[PAYMENT_STATUSES[UNPAID]] = len(self.loans)
+        self._principal_at_risk = sum(loan["principal"] for loan in self.loans)
+        self._total_payments_received = 0
+
+        # amount paid per loan, kept current on every insert, and the
+        # amortization schedules built so far, loans never change so a
+        # schedule is built once
+        self._loan_amount_paid = {}
+        self._loan_schedules = {}
+
+        # secondary indexes, loan id -> payments of that loan, payments
+        # sorted by payment date and status -> payments
+        self._payments_by_loan_id = {}
+        self._payment_date_ordinals = array("i")
+        self._payment_date_refs = self._new_ref_list()
+        self._payments_by_status = {
+            status: self._new_ref_list() for status in PAYMENT_STATUSES
+        }
+        if payment_indexes is None:
+            payment_indexes = self.payment_indexes(self._payment_columns())
+        self._adopt_payment_indexes(payment_indexes)
+
+        # aging index, loans without a dated payment sorted by due date
+        # with their ordinals, a loan leaves it with its first dated
+        # payment
+        self._unpaid_loans_by_due_date = [
+            loan
+            for loan in self._loans_by_due_date
+            if loan["id"] in self._unpaid_loan_ids
+        ]
+        self._unpaid_due_ordinals = array(
+            "i",
+            (
+                loan["due_date"].toordinal()
+                for loan in self._unpaid_loans_by_due_date
+            ),
+        )
+
+        # payments after the rows the indexes cover, e.g. replayed from
+        # the log written after a snapshot
+        for ref in self._payment_row_refs(
+            range(payment_indexes.row_count, len(self.loan_payments))
+        ):
+            self._index_payment(self._payment_from_ref(ref))
+
+        # payment ids are seeded once here instead of scanning on writes
+        self._payment_ids = IdSequence(self._max_payment_id() + 1)
+
+        # writes take the write lock, reads the read lock so they never
+        # see an insert half way through updating the indexes
+        self.lock = ReadWriteLock()
+
+        # durable log of added payments, set by PaymentPersistence.attach
+        self.payment_log = None
+
+        # data version, bumped by every write so readers can key caches
+        # on it and never serve data from before a write
+        self.version = 0
+
+    @classmethod
+    def from_payment_columns(cls, loans, columns, payment_indexes=None):
+        """store for payments loaded as PaymentColumns, e.g. a snapshot"""
+        # a snapshot has a few hundred distinct dates, each is converted
+        # once and shared by its payments
+        dates = {
+            ordinal: datetime.date.fromordinal(ordinal)
+            for ordinal in set(columns.payment_dates)
+            if ordinal != NO_DATE
+        }
+        return cls(
+            loans,
+            [
+                {
+                    "id": payment_id,
+                    "loan_id": loan_id,
+                    "payment_amount": None if math.isnan(amount) else amount,
+                    "payment_date": dates.get(ordinal),
+                }
+                for payment_id, loan_id, amount, ordinal in zip(
+                    columns.ids,
+                    columns.loan_ids,
+                    columns.payment_amounts,
+                    columns.payment_dates,
+                )
+            ],
+            payment_indexes,
+        )
+
+    def _create_payment_table(self, loan_payments):
+        # payments are kept as the given list of dicts
+        return loan_payments
+
+    def _append_payment(
+        self, payment_id, loan_id, payment_amount, payment_date
+    ):
+        # callers must hold the write lock
+        payment = {
+            "id": payment_id,
+            "loan_id": loan_id,
+            "payment_amount": payment_amount,
+            "payment_date": payment_date,
+        }
+        self.loan_payments.append(payment)
+        return payment
+
+    def _max_payment_id(self):
+        return max(map(itemgetter("id"), self.loan_payments), default=0)
+
+    def _new_ref_list(self):
+        return []
+
+    def _payment_ref(self, payment):
+        return payment
+
+    def _payment_from_ref(self, ref):
+        return ref
+
+    def _payment_ref_id(self, ref):
+        return ref["id"]
+
+    def _payment_row_refs(self, rows):
+        # refs of the payments at the given rows of the payment table
+        return list(map(self.loan_payments.__getitem__, rows))
+
+    def _payment_columns(self):
+        # loan ids, amounts and date ordinals of all payments
+        payments = self.loan_payments
+        return (
+            [p["loan_id"] for p in payments],
+            [p.get("payment_amount") for p in payments],
+            [
+                p["payment_date"].toordinal() if p["payment_date"] else NO_DATE
+                for p in payments
+            ],
+        )
+
+    def payment_indexes(self, columns):
+        """PaymentIndexes of (loan ids, amounts, date ordinals) columns
+
+        the loans never change, so snapshots build them from a copy of
+        the payments without holding the store's lock
+        """
+        due_ordinals = {
+            loan["id"]: loan["due_date"].toordinal() for loan in self.loans
+        }
+        return build_payment_indexes(due_ordinals, *columns)
+
+    def _adopt_payment_indexes(self, indexes):
+        # bulk version of _index_payment for the rows the indexes cover,
+        # only their per loan runs are walked in python
+        self._payment_date_ordinals = indexes.date_ordinals
+        self._payment_date_refs = self._payment_row_refs(indexes.date_rows)
+
+        start = 0
+        for status, count in zip(PAYMENT_STATUSES, indexes.status_counts):
+            self._payments_by_status[status] = self._payment_row_refs(
+                indexes.status_rows[start : start + count]
+            )
+            start += count
+
+        start = 0
+        for loan_id, count, amount_paid, ordinal, code in zip(
+            indexes.loan_ids,
+            indexes.loan_counts,
+            indexes.loan_amounts_paid,
+            indexes.loan_latest_ordinals,
+            indexes.loan_latest_codes,
+        ):
+            self._payments_by_loan_id[loan_id] = self._payment_row_refs(
+                indexes.loan_rows[start : start + count]
+            )
+            start += count
+
+            if amount_paid:
+                self._total_payments_received += amount_paid
+                self._loan_amount_paid[loan_id] = amount_paid
+
+            if ordinal != NO_DATE:
+                self._unpaid_loan_ids.discard(loan_id)
+                loan = self._loans_by_id.get(loan_id)
+                if loan:
+                    self._update_loan_status(
+                        loan, ordinal, PAYMENT_STATUSES[code]
+                    )
+
+    def _index_payment(self, payment):
+        ref = self._payment_ref(payment)
+        loan_id = payment["loan_id"]
+        payment_date = payment["payment_date"]
+
+        refs = self._payments_by_loan_id.get(loan_id)
+        if refs is None:
+            refs = self._payments_by_loan_id[loan_id] = self._new_ref_list()
+        refs.append(ref)
+
+        if payment_date and loan_id in self._unpaid_loan_ids:
+            self._unpaid_loan_ids.discard(loan_id)
+            self._remove_unpaid_loan(self._loans_by_id[loan_id])
+
+        if payment_date:
+            # payments mostly arrive in date order, so this is usually
+            # an append at the end of the index
+            ordinal = payment_date.toordinal()
+            position = bisect_right(self._payment_date_ordinals, ordinal)
+            self._payment_date_ordinals.insert(position, ordinal)
+            self._payment_date_refs.insert(position, ref)
+
+        # the seed payments have no payment_amount
+        payment_amount = payment.get("payment_amount")
+        if payment_amount:
+            self._total_payments_received += payment_amount
+            self._loan_amount_paid[loan_id] = (
+                self._loan_amount_paid.get(loan_id, 0) + payment_amount
+            )
+
+        # status only depends on the loan due date and the payment date,
+        # so it never changes once the payment is indexed
+        loan = self._loans_by_id.get(loan_id)
+        if loan:
+            status = get_payment_status(loan, payment)
+            self._payments_by_status[status].append(ref)
+            if payment_date:
+                self._update_loan_status(
+                    loan, payment_date.toordinal(), status
+                )
+
+    def _remove_unpaid_loan(self, loan):
+        # drops the loan from the aging index, only the loans due on the
+        # same day are scanned
+        lo, hi = _ordinal_range(
+            self._unpaid_due_ordinals, loan["due_date"], loan["due_date"]
+        )
+        for index in range(lo, hi):
+            if self._unpaid_loans_by_due_date[index]["id"] == loan["id"]:
+                del self._unpaid_loans_by_due_date[index]
+                del self._unpaid_due_ordinals[index]
+                return
+
+    def _update_loan_status(self, loan, ordinal, status):
+        # moves the loan between the status counters when the payment
+        # is its latest one, backdated payments leave it as it is
+        latest = self._loan_latest_payment.get(loan["id"])
+        if latest is not None and ordinal < latest[0]:
+            return
+
+        previous = latest[1] if latest else PAYMENT_STATUSES[UNPAID]
+        self._loan_latest_payment[loan["id"]] = (ordinal, status)
+        self._loan_status_counts[previous] -= 1
+        self._loan_status_counts[status] += 1
+        if (previous in AT_RISK_STATUSES) != (status in AT_RISK_STATUSES):
+            sign = 1 if status in AT_RISK_STATUSES else -1
+            self._principal_at_risk += sign * loan["principal"]
+
+    def consistent_read(self):
+        """context in which every read sees the same version of the data
+
+        holds the read lock, a GraphQL request runs all its resolvers in
+        one so it never mixes data from before and after a write
+        """
+        return self.lock.read_locked()
+
+    @read_locked
+    def get_loans(self):
+        """all loans in insertion order"""
+        return self.loans
+
+    @read_locked
+    def get_loan(self, loan_id):
+        """loan by id or None if it doesn't exist"""
+        return self._loans_by_id.get(loan_id)
+
+    @read_locked
+    def get_loans_by_ids(self, loan_ids):
+        """loans for many ids, aligned with loan_ids, None when missing"""
+        return [self._loans_by_id.get(loan_id) for loan_id in loan_ids]
+
+    @read_locked
+    def page_loans(self, filters=None, **page_args):
+        """keyset page of loans ordered by id, see keyset_page
+
+        filters are find_loans arguments, the page is then taken from
+        the loans they match
+        """
+        loans = self._loans_by_sorted_id
+        if filters:
+            loans = self.find_loans(**filters)
+        return keyset_page(loans, lambda loan: loan["id"], **page_args)
+
+    @read_locked
+    def find_loans(
+        self,
+        status=None,
+        payment_date_from=None,
+        payment_date_to=None,
+        due_date_from=None,
+        due_date_to=None,
+        aging_bucket=None,
+        as_of=None,
+    ):
+        """loans matching all given filters, ordered by id
+
+        status and payment dates match loans with at least one such
+        payment, an Unpaid status matches loans without a dated payment
+        and an aging bucket the unpaid loans in it as of a date
+        """
+        loan_ids = None
+
+        if due_date_from or due_date_to:
+            lo, hi = _ordinal_range(
+                self._loan_due_ordinals, due_date_from, due_date_to
+            )
+            loan_ids = {
+                self._loans_by_due_date[index]["id"] for index in range(lo, hi)
+            }
+
+        if aging_bucket:
+            matched = {
+                loan["id"] for loan in self._aging_loans(aging_bucket, as_of)
+            }
+            loan_ids = matched if loan_ids is None else loan_ids & matched
+
+        if status == PAYMENT_STATUSES[UNPAID]:
+            # unpaid loans have no payment date to match a range against
+            matched = (
+                set()
+                if payment_date_from or payment_date_to
+                else self._unpaid_loan_ids
+            )
+            loan_ids = matched if loan_ids is None else loan_ids & matched
+        elif status or payment_date_from or payment_date_to:
+            matched = {
+                self._payment_from_ref(ref)["loan_id"]
+                for ref in self._find_payment_refs(
+                    None, status, payment_date_from, payment_date_to
+                )
+            }
+            loan_ids = matched if loan_ids is None else loan_ids & matched
+
+        if loan_ids is None:
+            return list(self._loans_by_sorted_id)
+        return [self._loans_by_id[loan_id] for loan_id in sorted(loan_ids)]
+
+    @read_locked
+    def get_portfolio_summary(self):
+        """portfolio totals, read from counters kept by every insert"""
+        return {
+            "loan_count": len(self.loans),
+            "payment_count": len(self.loan_payments),
+            "loan_status_counts": dict(self._loan_status_counts),
+            "principal_at_risk": self._principal_at_risk,
+            "total_payments_received": self._total_payments_received,
+        }
+
+    def _aging_loans(self, bucket, as_of):
+        # slice of the aging index due within the bucket's date range
+        lo, hi = _ordinal_range(
+            self._unpaid_due_ordinals, *get_aging_due_range(bucket, as_of)
+        )
+        return self._unpaid_loans_by_due_date[lo:hi]
+
+    @read_locked
+    def get_delinquency_aging(self, as_of):
+        """unpaid loan count and principal per aging bucket as of a date
+
+        every bucket is a due date range of the aging index, so it is
+        found with two bisects whatever the date
+        """
+        aging = {}
+        for bucket in AGING_BUCKETS:
+            loans = self._aging_loans(bucket, as_of)
+            aging[bucket] = {
+                "loan_count": len(loans),
+                "principal": sum(loan["principal"] for loan in loans),
+            }
+        return aging
+
+    @read_locked
+    def get_loan_balances(self, loan_ids):
+        """LoanBalance per loan id, aligned with loan_ids, None if missing"""
+        balances = []
+        for loan_id in loan_ids:
+            loan = self._loans_by_id.get(loan_id)
+            if loan is None:
+                balances.append(None)
+                continue
+            schedule = self._loan_schedules.get(loan_id)
+            if schedule is None:
+                # built under the read lock, concurrent readers may both
+                # build it but end up with equal schedules
+                schedule = self._loan_schedules[loan_id] = LoanSchedule(loan)
+            balances.append(
+                schedule.balance(self._loan_amount_paid.get(loan_id, 0))
+            )
+        return balances
+
+    @read_locked
+    def get_loan_payments(self, loan_id):
+        """payments of a single loan in insertion order"""
+        return [
+            self._payment_from_ref(ref)
+            for ref in self._payments_by_loan_id.get(loan_id, ())
+        ]
+
+    @read_locked
+    def get_payments_by_loan_ids(self, loan_ids):
+        """payments of many loans, one list per loan aligned with loan_ids"""
+        return [self.get_loan_payments(loan_id) for loan_id in loan_ids]
+
+    @read_locked
+    def page_loan_payments(self, loan_id, **page_args):
+        """keyset page of a loan's payments ordered by id"""
+        # payment ids are allocated in order so each loan's payments
+        # are already sorted by id
+        page = keyset_page(
+            self._payments_by_loan_id.get(loan_id, ()),
+            self._payment_ref_id,
+            **page_args,
+        )
+        return page._replace(
+            items=[self._payment_from_ref(ref) for ref in page.items]
+        )
+
+    def _find_payment_refs(
+        self, loan_id, status, payment_date_from, payment_date_to
+    ):
+        # start from the most selective index and check the remaining
+        # filters on its candidates only
+        by_date = payment_date_from or payment_date_to
+        if loan_id is not None:
+            refs = self._payments_by_loan_id.get(loan_id, ())
+        elif by_date:
+            lo, hi = _ordinal_range(
+                self._payment_date_ordinals, payment_date_from, payment_date_to
+            )
+            if status and len(self._payments_by_status[status]) < hi - lo:
+                refs = self._payments_by_status[status]
+            else:
+                refs = self._payment_date_refs[lo:hi]
+                by_date = False
+        elif status:
+            return self._payments_by_status[status]
+        else:
+            return [self._payment_ref(p) for p in self.loan_payments]
+
+        date_from = payment_date_from.toordinal() if payment_date_from else 0
+        date_to = payment_date_to.toordinal() if payment_date_to else None
+        matched = []
+        for ref in refs:
+            payment = self._payment_from_ref(ref)
+            payment_date = payment["payment_date"]
+            if by_date and (
+                not payment_date
+                or payment_date.toordinal() < date_from
+                or (date_to is not None and payment_date.toordinal() > date_to)
+            ):
+                continue
+            if status and (
+                get_payment_status(
+                    self._loans_by_id[payment["loan_id"]], payment
+                )
+                != status
+            ):
+                continue
+            matched.append(ref)
+        return matched
+
+    @read_locked
+    def find_payments(
+        self,
+        loan_id=None,
+        status=None,
+        payment_date_from=None,
+        payment_date_to=None,
+    ):
+        """payments matching all given filters, ordered by id
+
+        payment dates are an inclusive range, payments without a date
+        never match a date range
+        """
+        refs = self._find_payment_refs(
+            loan_id, status, payment_date_from, payment_date_to
+        )
+        return [
+            self._payment_from_ref(ref)
+            for ref in sorted(refs, key=self._payment_ref_id)
+        ]
+
+    @read_locked
+    def find_payments_by_loan_ids(
+        self,
+        loan_ids,
+        status=None,
+        payment_date_from=None,
+        payment_date_to=None,
+    ):
+        """find_payments for many loans, one list aligned with loan_ids"""
+        # each loan's refs are in id order, so are its matches
+        return [
+            [
+                self._payment_from_ref(ref)
+                for ref in self._find_payment_refs(
+                    loan_id, status, payment_date_from, payment_date_to
+                )
+            ]
+            for loan_id in loan_ids
+        ]
+
+    def _insert_payment(self, loan_id, payment_amount, payment_date):
+        # callers must hold the write lock
+        payment = self._append_payment(
+            self._payment_ids.next_id(), loan_id, payment_amount, payment_date
+        )
+        self._index_payment(payment)
+        return payment
+
+    def _log_payments(self, payments):
+        # callers must hold the write lock so the log order matches the
+        # id order, returns what to pass to _wait_durable
+        if self.payment_log is None or not payments:
+            return None
+        return self.payment_log.append(payments)
+
+    def _wait_durable(self, lsn):
+        # called after releasing the write lock, writers only wait for
+        # the fsync of their own records
+        if lsn is not None:
+            self.payment_log.wait_durable(lsn)
+
+    def _copy_payment_table(self):
+        # callers must hold the write lock, payment dicts never change
+        # once added so a shallow copy is enough
+        return list(self.loan_payments)
+
+    def rotate_payment_log(self):
+        """start a new payment log segment for a snapshot
+
+        returns a copy of the payments before the new segment and its
+        number, both taken under the write lock, so the snapshot is
+        written from the copy while payments keep being added
+        """
+        with self.lock.write_locked():
+            return self._copy_payment_table(), self.payment_log.rotate()
+
+    def add_payment(self, loan_id, payment_amount, payment_date):
+        """create a payment with the next payment id and index it"""
+        with self.lock.write_locked():
+            payment = self._insert_payment(
+                loan_id, payment_amount, payment_date
+            )
+            self.version += 1
+            lsn = self._log_payments([payment])
+        self._wait_durable(lsn)
+        return payment
+
+    def add_payments(self, rows):
+        """create many payments under a single write lock acquisition
+
+        rows are dicts with loan_id, payment_amount and payment_date,
+        the created payments are returned in the same order
+        """
+        with self.lock.write_locked():
+            payments = [
+                self._insert_payment(
+                    row["loan_id"], row["payment_amount"], row["payment_date"]
+                )
+                for row in rows
+            ]
+            if payments:
+                self.version += 1
+            lsn = self._log_payments(payments)
+        self._wait_durable(lsn)
+        return payments
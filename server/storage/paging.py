@@ -0,0 +1,40 @@
+from collections import namedtuple
+
+# one page of records plus whether records exist before / after it
+Page = namedtuple("Page", ["items", "has_previous_page", "has_next_page"])
+
+
+def bisect_by(items, value, key, right=False):
+    """bisect a sequence sorted by key, bisect's key= needs python 3.10"""
+    lo, hi = 0, len(items)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        mid_key = key(items[mid])
+        if mid_key < value or (right and mid_key == value):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def keyset_page(items, key, first=None, after=None, last=None, before=None):
+    """page of a sequence sorted by a unique key
+
+    after / before are exclusive key bounds found by bisecting, then
+    first / last trim the range from the front / back, so every page
+    costs O(log n + page size) however deep it is.
+    """
+    start = 0 if after is None else bisect_by(items, after, key, right=True)
+    end = len(items) if before is None else bisect_by(items, before, key)
+    end = max(start, end)
+
+    if first is not None:
+        end = min(end, start + first)
+    if last is not None:
+        start = max(start, end - last)
+
+    return Page(
+        items=[items[index] for index in range(start, end)],
+        has_previous_page=start > 0,
+        has_next_page=end < len(items),
+    )
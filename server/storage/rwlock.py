@@ -0,0 +1,88 @@
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+
+class ReadWriteLock:
+    """readers-writer lock, many readers or a single writer
+
+    Writers are preferred, once a writer waits no new reader gets in so
+    a steady stream of reads can't starve writes. Reads are reentrant
+    per thread, also for the thread holding the write lock, so a read
+    nested in another read or in a write never deadlocks. A read lock
+    can't be upgraded to a write lock.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writers_waiting = 0
+        self._local = threading.local()
+
+    def acquire_read(self):
+        depth = getattr(self._local, "depth", 0)
+        if depth or self._writer == threading.get_ident():
+            self._local.depth = depth + 1
+            return
+
+        with self._cond:
+            while self._writer is not None or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        self._local.depth = 1
+
+    def release_read(self):
+        self._local.depth -= 1
+        if self._local.depth or self._writer == threading.get_ident():
+            return
+
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        if getattr(self._local, "depth", 0):
+            raise RuntimeError("a read lock can't be upgraded to a write lock")
+
+        with self._cond:
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = threading.get_ident()
+
+    def release_write(self):
+        with self._cond:
+            self._writer = None
+            self._cond.notify_all()
+
+    @contextmanager
+    def read_locked(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write_locked(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+def read_locked(method):
+    """run a store method under the store's read lock"""
+
+    @wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.lock.read_locked():
+            return method(self, *args, **kwargs)
+
+    return locked
@@ -0,0 +1,20 @@
+import threading
+
+
+class IdSequence:
+    """monotonic, thread safe id allocator
+
+    Seeded once with the next free id, every call hands out ids that
+    were never handed out before, no matter how many threads ask.
+    """
+
+    def __init__(self, start=1):
+        self._lock = threading.Lock()
+        self._next = start
+
+    def next_id(self):
+        """allocate a single id"""
+        with self._lock:
+            value = self._next
+            self._next += 1
+            return value
@@ -0,0 +1,856 @@
+import datetime
+import json
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from amortization import LoanSchedule
+from storage.memory import AT_RISK_STATUSES
+from storage.paging import Page
+from utils import (
+    AGING_BUCKETS,
+    NO_DATE,
+    PAYMENT_STATUSES,
+    UNPAID,
+    get_aging_due_range,
+    get_payment_status_code,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS loans (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    interest_rate REAL NOT NULL,
+    principal NUMERIC NOT NULL,
+    due_date TEXT NOT NULL,
+    term_months INTEGER,
+    status INTEGER NOT NULL DEFAULT 3, -- UNPAID
+    last_payment_date TEXT,
+    last_payment_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS loan_payments (
+    id INTEGER PRIMARY KEY,
+    loan_id INTEGER NOT NULL,
+    payment_amount REAL,
+    payment_date TEXT,
+    status INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_loans_due_date ON loans (due_date);
+CREATE INDEX IF NOT EXISTS idx_loan_payments_loan_id
+    ON loan_payments (loan_id);
+CREATE INDEX IF NOT EXISTS idx_loan_payments_payment_date
+    ON loan_payments (payment_date);
+CREATE TABLE IF NOT EXISTS meta (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (id, version) VALUES (1, 0);
+CREATE TABLE IF NOT EXISTS loan_amount_paid (
+    loan_id INTEGER PRIMARY KEY,
+    amount_paid REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS loan_status_counts (
+    status INTEGER PRIMARY KEY,
+    loan_count INTEGER NOT NULL,
+    principal NUMERIC NOT NULL
+);
+CREATE TABLE IF NOT EXISTS payment_totals (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    payment_count INTEGER NOT NULL,
+    amount_received REAL NOT NULL
+);
+"""
+
+# keeps loan_amount_paid current on every insert, created after the
+# table is backfilled, see _migrate
+AMOUNT_PAID_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS loan_payments_amount_paid
+AFTER INSERT ON loan_payments
+WHEN NEW.payment_amount IS NOT NULL
+BEGIN
+    INSERT INTO loan_amount_paid (loan_id, amount_paid)
+    VALUES (NEW.loan_id, NEW.payment_amount)
+    ON CONFLICT (loan_id)
+    DO UPDATE SET amount_paid = amount_paid + excluded.amount_paid;
+END
+"""
+
+# status codes are stored next to the rows, payments get theirs when
+# inserted and loans the one of their latest dated payment, ordered by
+# date then id like MemoryStore. The triggers keep the portfolio
+# counters current in the transaction of the write, they are created
+# after the counters are backfilled, see _migrate
+SUMMARY_TRIGGERS = (
+    """
+CREATE TRIGGER IF NOT EXISTS loans_status_counts
+AFTER INSERT ON loans
+BEGIN
+    UPDATE loan_status_counts
+    SET loan_count = loan_count + 1, principal = principal + NEW.principal
+    WHERE status = NEW.status;
+END
+""",
+    """
+CREATE TRIGGER IF NOT EXISTS loans_status_change
+AFTER UPDATE OF status ON loans
+WHEN OLD.status IS NOT NEW.status
+BEGIN
+    UPDATE loan_status_counts
+    SET loan_count = loan_count - 1, principal = principal - OLD.principal
+    WHERE status = OLD.status;
+    UPDATE loan_status_counts
+    SET loan_count = loan_count + 1, principal = principal + NEW.principal
+    WHERE status = NEW.status;
+END
+""",
+    """
+CREATE TRIGGER IF NOT EXISTS loan_payments_totals
+AFTER INSERT ON loan_payments
+BEGIN
+    UPDATE payment_totals
+    SET payment_count = payment_count + 1,
+        amount_received = amount_received
+            + COALESCE(NEW.payment_amount, 0);
+    UPDATE loans
+    SET status = NEW.status,
+        last_payment_date = NEW.payment_date,
+        last_payment_id = NEW.id
+    WHERE id = NEW.loan_id AND NEW.payment_date IS NOT NULL
+        AND (last_payment_date IS NULL
+            OR (NEW.payment_date, NEW.id)
+                > (last_payment_date, last_payment_id));
+END
+""",
+)
+
+LOAN_COLUMNS = (
+    "l.id, l.name, l.interest_rate, l.principal, l.due_date, l.term_months"
+)
+PAYMENT_COLUMNS = "p.id, p.loan_id, p.payment_amount, p.payment_date"
+
+# dates are stored as ISO text, which sorts and compares like dates
+INSERT_LOAN = (
+    "INSERT OR IGNORE INTO loans "
+    "(id, name, interest_rate, principal, due_date, term_months) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+# the payment status is classified from the loan's due date on insert
+PAYMENT_STATUS = "payment_status((SELECT due_date FROM loans WHERE id = ?), ?)"
+INSERT_PAYMENT = (
+    "INSERT OR IGNORE INTO loan_payments "
+    "(id, loan_id, payment_amount, payment_date, status) "
+    f"VALUES (?, ?, ?, ?, {PAYMENT_STATUS})"
+)
+BUMP_VERSION = "UPDATE meta SET version = version + 1"
+SELECT_VERSION = "SELECT version FROM meta"
+
+SELECT_SUMMARY = (
+    "SELECT s.status, s.loan_count, s.principal, t.payment_count, "
+    "t.amount_received FROM loan_status_counts s, payment_totals t"
+)
+
+# connections cache compiled statements, the statements used here are
+# fixed strings or a small set of filter combinations
+STATEMENT_CACHE_SIZE = 256
+
+# idle connections kept for reuse once released, threads beyond it get a
+# fresh connection that is closed when released
+DEFAULT_POOL_SIZE = 8
+
+# loans without a dated payment, the aging buckets hold these
+UNPAID_CONDITION = "l.last_payment_date IS NULL"
+
+
+def _to_date(value):
+    return datetime.date.fromisoformat(value) if value else None
+
+
+def _from_date(value):
+    return value.isoformat() if value else None
+
+
+def _payment_status(due_date, payment_date):
+    # sql function payment_status(due_date, payment_date), the status
+    # code from get_payment_status_code like in every other store,
+    # payments of unknown loans have no status
+    if due_date is None:
+        return None
+    return get_payment_status_code(
+        datetime.date.fromisoformat(due_date).toordinal(),
+        (
+            datetime.date.fromisoformat(payment_date).toordinal()
+            if payment_date
+            else NO_DATE
+        ),
+    )
+
+
+def _due_date_conditions(due_date_from, due_date_to):
+    # conditions and params of an inclusive due date range, on the
+    # idx_loans_due_date index
+    conditions, params = [], []
+    if due_date_from:
+        conditions.append("l.due_date >= ?")
+        params.append(_from_date(due_date_from))
+    if due_date_to:
+        conditions.append("l.due_date <= ?")
+        params.append(_from_date(due_date_to))
+    return conditions, params
+
+
+def _loan_from_row(row):
+    loan = {
+        "id": row[0],
+        "name": row[1],
+        "interest_rate": row[2],
+        "principal": row[3],
+        "due_date": _to_date(row[4]),
+    }
+    # like the seed loans, loans without a term have no term_months
+    if row[5] is not None:
+        loan["term_months"] = row[5]
+    return loan
+
+
+def _payment_from_row(row):
+    return {
+        "id": row[0],
+        "loan_id": row[1],
+        "payment_amount": row[2],
+        "payment_date": _to_date(row[3]),
+    }
+
+
+class SQLiteStore:
+    """store backed by a SQLite database file
+
+    Same interface as MemoryStore, so resolvers and REST handlers run
+    against it unchanged, but the data lives on disk and is shared by
+    every process opening the same file, e.g. several gunicorn workers.
+    The database runs in WAL journal mode so readers never block the
+    writer, each thread uses its own connection until it releases it to
+    a bounded pool of idle connections, and filters, paging and the
+    portfolio summary are answered by indexed queries.
+
+    The given loans and payments seed the database, rows that already
+    exist are kept as they are. Without a path a private temporary
+    database is used.
+    """
+
+    def __init__(
+        self,
+        loans=None,
+        loan_payments=None,
+        path=None,
+        pool_size=DEFAULT_POOL_SIZE,
+    ):
+        if path is None:
+            self._temp_dir = tempfile.TemporaryDirectory()
+            path = os.path.join(self._temp_dir.name, "numida.db")
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+
+        # amortization schedules built so far, loans never change
+        self._loan_schedules = {}
+
+        self._connection().executescript(SCHEMA)
+        with self._transaction() as conn:
+            self._migrate(conn)
+            conn.executemany(
+                INSERT_LOAN,
+                (
+                    (
+                        loan["id"],
+                        loan["name"],
+                        loan["interest_rate"],
+                        loan["principal"],
+                        _from_date(loan["due_date"]),
+                        loan.get("term_months"),
+                    )
+                    for loan in loans or ()
+                ),
+            )
+            conn.executemany(
+                INSERT_PAYMENT,
+                (
+                    (
+                        payment["id"],
+                        payment["loan_id"],
+                        payment.get("payment_amount"),
+                        _from_date(payment.get("payment_date")),
+                        payment["loan_id"],
+                        _from_date(payment.get("payment_date")),
+                    )
+                    for payment in loan_payments or ()
+                ),
+            )
+
+    def _migrate(self, conn):
+        # brings database files created by older versions up to date,
+        # runs in a write transaction so only one process migrates
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(loans)")}
+        if "term_months" not in columns:
+            conn.execute("ALTER TABLE loans ADD COLUMN term_months INTEGER")
+        if "status" not in columns:
+            conn.execute(
+                "ALTER TABLE loans "
+                f"ADD COLUMN status INTEGER NOT NULL DEFAULT {UNPAID}"
+            )
+            conn.execute("ALTER TABLE loans ADD COLUMN last_payment_date TEXT")
+            conn.execute(
+                "ALTER TABLE loans ADD COLUMN last_payment_id INTEGER"
+            )
+            conn.execute("ALTER TABLE loan_payments ADD COLUMN status INTEGER")
+            # the status of every payment, then of every loan from its
+            # latest dated payment
+            conn.execute(
+                "UPDATE loan_payments SET status = payment_status("
+                "(SELECT due_date FROM loans WHERE id = loan_id), "
+                "payment_date)"
+            )
+            conn.execute(
+                "UPDATE loans SET "
+                "(status, last_payment_date, last_payment_id) = ("
+                "SELECT p.status, p.payment_date, p.id FROM loan_payments p "
+                "WHERE p.loan_id = loans.id AND p.payment_date IS NOT NULL "
+                "ORDER BY p.payment_date DESC, p.id DESC LIMIT 1) "
+                "WHERE EXISTS (SELECT 1 FROM loan_payments p "
+                "WHERE p.loan_id = loans.id AND p.payment_date IS NOT NULL)"
+            )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_loan_payments_status "
+            "ON loan_payments (status, loan_id)"
+        )
+
+        # the trigger fills loan_amount_paid from its creation on, an
+        # empty table next to paid payments predates it
+        conn.execute(
+            "INSERT INTO loan_amount_paid (loan_id, amount_paid) "
+            "SELECT loan_id, SUM(payment_amount) FROM loan_payments "
+            "WHERE payment_amount IS NOT NULL "
+            "AND NOT EXISTS (SELECT 1 FROM loan_amount_paid) "
+            "GROUP BY loan_id"
+        )
+        conn.execute(AMOUNT_PAID_TRIGGER)
+
+        # the counters start from the rows already there, a database
+        # that has them keeps them
+        conn.execute(
+            "INSERT OR IGNORE INTO loan_status_counts "
+            "(status, loan_count, principal) "
+            "SELECT s.value, COUNT(l.id), COALESCE(SUM(l.principal), 0) "
+            "FROM json_each(?) s LEFT JOIN loans l ON l.status = s.value "
+            "GROUP BY s.value",
+            (json.dumps(list(range(len(PAYMENT_STATUSES)))),),
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO payment_totals "
+            "(id, payment_count, amount_received) "
+            "SELECT 1, COUNT(*), COALESCE(SUM(payment_amount), 0) "
+            "FROM loan_payments"
+        )
+        for trigger in SUMMARY_TRIGGERS:
+            conn.execute(trigger)
+
+    def _connection(self):
+        # the connection of this thread, taken from the idle pool or
+        # opened, a connection is only used by one thread at a time
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.create_function(
+            "payment_status", 2, _payment_status, deterministic=True
+        )
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    def release_connection(self):
+        """hand this thread's connection back to the idle pool
+
+        called at the end of every request, threads of a threaded server
+        come and go and would otherwise each keep a connection open. The
+        connection is closed when the pool is full.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            with self._connections_lock:
+                self._connections.remove(conn)
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        # write transaction, BEGIN IMMEDIATE takes the database write
+        # lock up front so concurrent writers wait instead of failing
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @contextmanager
+    def consistent_read(self):
+        """context in which every read sees the same version of the data
+
+        a read transaction, in WAL mode it reads one snapshot of the
+        database while other connections keep writing
+        """
+        conn = self._connection()
+        if conn.in_transaction:
+            yield
+            return
+
+        conn.execute("BEGIN")
+        try:
+            yield
+        finally:
+            conn.execute("COMMIT")
+
+    def _query(self, sql, params=()):
+        return self._connection().execute(sql, params).fetchall()
+
+    def _exists(self, sql, params=()):
+        return bool(self._query(f"SELECT EXISTS ({sql})", params)[0][0])
+
+    def close(self):
+        """close the connections of every thread"""
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+        self._idle = queue.LifoQueue(maxsize=self._idle.maxsize)
+
+    @property
+    def version(self):
+        """data version, bumped by every write from any process"""
+        return self._query(SELECT_VERSION)[0][0]
+
+    def get_loans(self):
+        """all loans ordered by id"""
+        return [
+            _loan_from_row(row)
+            for row in self._query(
+                f"SELECT {LOAN_COLUMNS} FROM loans l ORDER BY l.id"
+            )
+        ]
+
+    def get_loan(self, loan_id):
+        """loan by id or None if it doesn't exist"""
+        rows = self._query(
+            f"SELECT {LOAN_COLUMNS} FROM loans l WHERE l.id = ?", (loan_id,)
+        )
+        return _loan_from_row(rows[0]) if rows else None
+
+    def get_loans_by_ids(self, loan_ids):
+        """loans for many ids, aligned with loan_ids, None when missing"""
+        # the ids are bound as one json array so the statement is the
+        # same whatever the number of ids
+        loans_by_id = {
+            row[0]: _loan_from_row(row)
+            for row in self._query(
+                f"SELECT {LOAN_COLUMNS} FROM loans l "
+                "WHERE l.id IN (SELECT value FROM json_each(?))",
+                (json.dumps(list(loan_ids)),),
+            )
+        }
+        return [loans_by_id.get(loan_id) for loan_id in loan_ids]
+
+    def _keyset_page(
+        self,
+        select,
+        table,
+        where="1",
+        params=(),
+        first=None,
+        after=None,
+        last=None,
+        before=None,
+    ):
+        # sql version of keyset_page over table rows ordered by id, the
+        # page is read from the primary key with a LIMIT on either end
+        bounds, bound_params = [where], list(params)
+        if after is not None:
+            bounds.append("id > ?")
+            bound_params.append(after)
+        if before is not None:
+            bounds.append("id < ?")
+            bound_params.append(before)
+        condition = " AND ".join(bounds)
+
+        if first is not None:
+            rows = self._query(
+                f"{select} WHERE {condition} ORDER BY id LIMIT ?",
+                (*bound_params, first),
+            )
+            if last is not None:
+                window_end = rows[-1][0] if rows else None
+                rows = rows[max(0, len(rows) - last) :]
+        elif last is not None:
+            rows = self._query(
+                f"{select} WHERE {condition} ORDER BY id DESC LIMIT ?",
+                (*bound_params, last),
+            )[::-1]
+        else:
+            rows = self._query(
+                f"{select} WHERE {condition} ORDER BY id", bound_params
+            )
+
+        def exists(bound, value):
+            if value is None:
+                return self._exists(
+                    f"SELECT 1 FROM {table} WHERE {where}", params
+                )
+            return self._exists(
+                f"SELECT 1 FROM {table} WHERE {where} AND id {bound} ?",
+                (*params, value),
+            )
+
+        if rows:
+            return Page(
+                items=rows,
+                has_previous_page=exists("<", rows[0][0]),
+                has_next_page=exists(">", rows[-1][0]),
+            )
+
+        # an empty page sits right after the rows first kept, or at the
+        # end of the range when last is 0, or at the start of the range
+        if first is not None and last is not None and window_end is not None:
+            return Page([], True, exists(">", window_end))
+        if (
+            first is None
+            and last == 0
+            and self._exists(
+                f"SELECT 1 FROM {table} WHERE {condition}", bound_params
+            )
+        ):
+            return Page(
+                [],
+                exists("<", before),
+                before is not None and exists(">=", before),
+            )
+        return Page(
+            [],
+            after is not None and exists("<=", after),
+            exists(">", after),
+        )
+
+    def page_loans(self, filters=None, **page_args):
+        """keyset page of loans ordered by id, see keyset_page
+
+        filters are find_loans arguments, the page is then taken from
+        the loans they match
+        """
+        conditions, params = self._loan_conditions(**(filters or {}))
+        page = self._keyset_page(
+            f"SELECT {LOAN_COLUMNS} FROM loans l",
+            "loans l",
+            " AND ".join(conditions) or "1",
+            params,
+            **page_args,
+        )
+        return page._replace(items=[_loan_from_row(row) for row in page.items])
+
+    def _loan_conditions(
+        self,
+        status=None,
+        payment_date_from=None,
+        payment_date_to=None,
+        due_date_from=None,
+        due_date_to=None,
+        aging_bucket=None,
+        as_of=None,
+    ):
+        # where conditions on loans l for the filters of find_loans
+        conditions, params = _due_date_conditions(due_date_from, due_date_to)
+
+        if aging_bucket:
+            aging_conditions, aging_params = _due_date_conditions(
+                *get_aging_due_range(aging_bucket, as_of)
+            )
+            conditions.extend(aging_conditions + [UNPAID_CONDITION])
+            params.extend(aging_params)
+
+        if status == PAYMENT_STATUSES[UNPAID]:
+            # unpaid loans have no payment date to match a range against
+            if payment_date_from or payment_date_to:
+                return ["0"], []
+            conditions.append(UNPAID_CONDITION)
+        elif status or payment_date_from or payment_date_to:
+            payment_conditions, payment_params = self._payment_conditions(
+                status, payment_date_from, payment_date_to
+            )
+            conditions.append(
+                "EXISTS (SELECT 1 FROM loan_payments p WHERE p.loan_id = l.id"
+                f" AND {' AND '.join(payment_conditions)})"
+            )
+            params.extend(payment_params)
+
+        return conditions, params
+
+    def find_loans(self, **filters):
+        """loans matching all given filters, ordered by id
+
+        status and payment dates match loans with at least one such
+        payment, an Unpaid status matches loans without a dated payment
+        and an aging bucket the unpaid loans in it as of a date
+        """
+        conditions, params = self._loan_conditions(**filters)
+        where = " AND ".join(conditions) or "1"
+        return [
+            _loan_from_row(row)
+            for row in self._query(
+                f"SELECT {LOAN_COLUMNS} FROM loans l WHERE {where} "
+                "ORDER BY l.id",
+                params,
+            )
+        ]
+
+    def get_portfolio_summary(self):
+        """portfolio totals, read from the counters kept by triggers"""
+        loan_status_counts = dict.fromkeys(PAYMENT_STATUSES, 0)
+        principal_at_risk = 0
+        for (
+            code,
+            loan_count,
+            principal,
+            payment_count,
+            total_payments_received,
+        ) in self._query(SELECT_SUMMARY):
+            status = PAYMENT_STATUSES[code]
+            loan_status_counts[status] = loan_count
+            if status in AT_RISK_STATUSES:
+                principal_at_risk += principal
+
+        return {
+            "loan_count": sum(loan_status_counts.values()),
+            "payment_count": payment_count,
+            "loan_status_counts": loan_status_counts,
+            "principal_at_risk": principal_at_risk,
+            "total_payments_received": total_payments_received,
+        }
+
+    def get_delinquency_aging(self, as_of):
+        """unpaid loan count and principal per aging bucket as of a date
+
+        counted by the database in one pass over the unpaid loans
+        """
+        cases, params = [], []
+        for bucket in AGING_BUCKETS:
+            conditions, bounds = _due_date_conditions(
+                *get_aging_due_range(bucket, as_of)
+            )
+            cases.append(f"WHEN {' AND '.join(conditions)} THEN ?")
+            params.extend(bounds + [bucket])
+
+        aging = {
+            bucket: {"loan_count": 0, "principal": 0}
+            for bucket in AGING_BUCKETS
+        }
+        for bucket, loan_count, principal in self._query(
+            f"SELECT CASE {' '.join(cases)} END, COUNT(*), SUM(l.principal) "
+            f"FROM loans l WHERE {UNPAID_CONDITION} GROUP BY 1",
+            params,
+        ):
+            aging[bucket] = {"loan_count": loan_count, "principal": principal}
+        return aging
+
+    def get_loan_balances(self, loan_ids):
+        """LoanBalance per loan id, aligned with loan_ids, None if missing"""
+        balances = {}
+        for row in self._query(
+            f"SELECT {LOAN_COLUMNS}, COALESCE(b.amount_paid, 0) "
+            "FROM loans l LEFT JOIN loan_amount_paid b ON b.loan_id = l.id "
+            "WHERE l.id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(loan_ids)),),
+        ):
+            schedule = self._loan_schedules.get(row[0])
+            if schedule is None:
+                schedule = self._loan_schedules[row[0]] = LoanSchedule(
+                    _loan_from_row(row)
+                )
+            balances[row[0]] = schedule.balance(row[-1])
+        return [balances.get(loan_id) for loan_id in loan_ids]
+
+    def get_loan_payments(self, loan_id):
+        """payments of a single loan in insertion order"""
+        return [
+            _payment_from_row(row)
+            for row in self._query(
+                f"SELECT {PAYMENT_COLUMNS} FROM loan_payments p "
+                "WHERE p.loan_id = ? ORDER BY p.id",
+                (loan_id,),
+            )
+        ]
+
+    def get_payments_by_loan_ids(self, loan_ids):
+        """payments of many loans, one list per loan aligned with loan_ids"""
+        payments_by_loan_id = {loan_id: [] for loan_id in loan_ids}
+        for row in self._query(
+            f"SELECT {PAYMENT_COLUMNS} FROM loan_payments p "
+            "WHERE p.loan_id IN (SELECT value FROM json_each(?)) "
+            "ORDER BY p.id",
+            (json.dumps(list(payments_by_loan_id)),),
+        ):
+            payments_by_loan_id[row[1]].append(_payment_from_row(row))
+        return [payments_by_loan_id[loan_id] for loan_id in loan_ids]
+
+    def page_loan_payments(self, loan_id, **page_args):
+        """keyset page of a loan's payments ordered by id"""
+        page = self._keyset_page(
+            f"SELECT {PAYMENT_COLUMNS} FROM loan_payments p",
+            "loan_payments",
+            "loan_id = ?",
+            (loan_id,),
+            **page_args,
+        )
+        return page._replace(
+            items=[_payment_from_row(row) for row in page.items]
+        )
+
+    def _payment_conditions(self, status, payment_date_from, payment_date_to):
+        # where clauses on loan_payments p
+        conditions, params = [], []
+        if payment_date_from:
+            conditions.append("p.payment_date >= ?")
+            params.append(_from_date(payment_date_from))
+        if payment_date_to:
+            conditions.append("p.payment_date <= ?")
+            params.append(_from_date(payment_date_to))
+        if status:
+            conditions.append("p.status = ?")
+            params.append(PAYMENT_STATUSES.index(status))
+        return conditions, params
+
+    def find_payments(
+        self,
+        loan_id=None,
+        status=None,
+        payment_date_from=None,
+        payment_date_to=None,
+    ):
+        """payments matching all given filters, ordered by id
+
+        payment dates are an inclusive range, payments without a date
+        never match a date range
+        """
+        conditions, params = self._payment_conditions(
+            status, payment_date_from, payment_date_to
+        )
+        if loan_id is not None:
+            conditions.insert(0, "p.loan_id = ?")
+            params.insert(0, loan_id)
+
+        where = " AND ".join(conditions) or "1"
+        return [
+            _payment_from_row(row)
+            for row in self._query(
+                f"SELECT {PAYMENT_COLUMNS} FROM loan_payments p "
+                f"WHERE {where} ORDER BY p.id",
+                params,
+            )
+        ]
+
+    def find_payments_by_loan_ids(
+        self,
+        loan_ids,
+        status=None,
+        payment_date_from=None,
+        payment_date_to=None,
+    ):
+        """find_payments for many loans, one list aligned with loan_ids"""
+        conditions, params = self._payment_conditions(
+            status, payment_date_from, payment_date_to
+        )
+        where = " AND ".join(
+            ["p.loan_id IN (SELECT value FROM json_each(?))", *conditions]
+        )
+        payments_by_loan_id = {loan_id: [] for loan_id in loan_ids}
+        for row in self._query(
+            f"SELECT {PAYMENT_COLUMNS} FROM loan_payments p "
+            f"WHERE {where} ORDER BY p.id",
+            (json.dumps(list(payments_by_loan_id)), *params),
+        ):
+            payments_by_loan_id[row[1]].append(_payment_from_row(row))
+        return [payments_by_loan_id[loan_id] for loan_id in loan_ids]
+
+    def _insert_payment(self, conn, loan_id, payment_amount, payment_date):
+        cursor = conn.execute(
+            "INSERT INTO loan_payments "
+            "(loan_id, payment_amount, payment_date, status) "
+            f"VALUES (?, ?, ?, {PAYMENT_STATUS})",
+            (
+                loan_id,
+                payment_amount,
+                _from_date(payment_date),
+                loan_id,
+                _from_date(payment_date),
+            ),
+        )
+        return {
+            "id": cursor.lastrowid,
+            "loan_id": loan_id,
+            "payment_amount": payment_amount,
+            "payment_date": payment_date,
+        }
+
+    def add_payment(self, loan_id, payment_amount, payment_date):
+        """create a payment with the next payment id"""
+        with self._transaction() as conn:
+            payment = self._insert_payment(
+                conn, loan_id, payment_amount, payment_date
+            )
+            conn.execute(BUMP_VERSION)
+        return payment
+
+    def add_payments(self, rows):
+        """create many payments in a single transaction
+
+        rows are dicts with loan_id, payment_amount and payment_date,
+        the created payments are returned in the same order
+        """
+        with self._transaction() as conn:
+            payments = [
+                self._insert_payment(
+                    conn,
+                    row["loan_id"],
+                    row["payment_amount"],
+                    row["payment_date"],
+                )
+                for row in rows
+            ]
+            if payments:
+                conn.execute(BUMP_VERSION)
+        return payments
@@ -0,0 +1,378 @@
+import glob
+import math
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from array import array
+
+from storage.columnar import PaymentColumns
+from storage.memory import PaymentIndexes
+from utils import NO_DATE
+
+# payment log record, id, loan_id, amount (nan when missing), payment
+# date ordinal (NO_DATE when missing) and a crc32 of those fields so a
+# torn write at the tail of a segment is detected on replay
+RECORD = struct.Struct("<qqdi")
+RECORD_CRC = struct.Struct("<I")
+RECORD_SIZE = RECORD.size + RECORD_CRC.size
+
+# snapshot header, magic, payment count and the first log segment that
+# is not covered by the snapshot, the columns follow the header. Since
+# version 2 the arrays of the store's PaymentIndexes follow the columns,
+# each after its typecode and length.
+SNAPSHOT_MAGIC = b"NUMSNAP2"
+SNAPSHOT_MAGIC_V1 = b"NUMSNAP1"
+SNAPSHOT_HEADER = struct.Struct("<8sqq")
+SNAPSHOT_ARRAY_HEADER = struct.Struct("<cq")
+SNAPSHOT_FILE = "snapshot.bin"
+SEGMENT_PATTERN = "wal-{:08d}.log"
+
+# payments logged since the last snapshot before a new one is taken
+DEFAULT_SNAPSHOT_EVERY = 100_000
+
+
+def encode_payment(payment):
+    amount = payment["payment_amount"]
+    payment_date = payment["payment_date"]
+    fields = RECORD.pack(
+        payment["id"],
+        payment["loan_id"],
+        math.nan if amount is None else amount,
+        payment_date.toordinal() if payment_date else NO_DATE,
+    )
+    return fields + RECORD_CRC.pack(zlib.crc32(fields))
+
+
+def segment_path(directory, segment):
+    return os.path.join(directory, SEGMENT_PATTERN.format(segment))
+
+
+def list_segments(directory):
+    """log segment numbers in the directory, oldest first"""
+    return sorted(
+        int(os.path.basename(path)[4:-4])
+        for path in glob.glob(os.path.join(directory, "wal-*.log"))
+    )
+
+
+def replay_segment(path, columns):
+    """append the payments of a log segment to columns
+
+    stops at the first incomplete or corrupt record, that is a write
+    which never became durable, and returns the number of payments read
+    """
+    with open(path, "rb") as log_file:
+        data = log_file.read()
+
+    count = 0
+    for offset in range(0, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+        fields = data[offset : offset + RECORD.size]
+        (crc,) = RECORD_CRC.unpack_from(data, offset + RECORD.size)
+        if zlib.crc32(fields) != crc:
+            break
+        payment_id, loan_id, amount, ordinal = RECORD.unpack(fields)
+        columns.ids.append(payment_id)
+        columns.loan_ids.append(loan_id)
+        columns.payment_amounts.append(amount)
+        columns.payment_dates.append(ordinal)
+        count += 1
+    return count
+
+
+def payment_columns(payments):
+    """payments as PaymentColumns, columns are returned as they are"""
+    if isinstance(payments, PaymentColumns):
+        return payments
+
+    columns = PaymentColumns()
+    for payment in payments:
+        columns.append(
+            payment["id"],
+            payment["loan_id"],
+            payment.get("payment_amount"),
+            payment["payment_date"],
+        )
+    return columns
+
+
+def write_snapshot(directory, columns, next_segment, payment_indexes):
+    """write the payments of columns and their indexes as a snapshot
+
+    the snapshot is column major so it can be loaded with one
+    array.frombytes per column or index, it is written to a temporary
+    file and renamed into place so a crash never leaves a partial
+    snapshot
+    """
+    path = os.path.join(directory, SNAPSHOT_FILE)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as snapshot_file:
+        snapshot_file.write(
+            SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(columns), next_segment)
+        )
+        for column in (
+            columns.ids,
+            columns.loan_ids,
+            columns.payment_amounts,
+            columns.payment_dates,
+        ):
+            snapshot_file.write(memoryview(column))
+        for index in payment_indexes[1:]:
+            snapshot_file.write(
+                SNAPSHOT_ARRAY_HEADER.pack(index.typecode.encode(), len(index))
+            )
+            snapshot_file.write(memoryview(index))
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(temp_path, path)
+
+
+def read_snapshot(directory):
+    """memory map the snapshot into PaymentColumns and PaymentIndexes
+
+    returns the columns, their indexes and the first log segment to
+    replay on top of them, or (None, None, None) when there is no
+    snapshot yet. Version 1 snapshots have no indexes, they are None.
+    """
+    path = os.path.join(directory, SNAPSHOT_FILE)
+    if not os.path.exists(path):
+        return None, None, None
+
+    columns = PaymentColumns()
+    payment_indexes = None
+    with open(path, "rb") as snapshot_file, mmap.mmap(
+        snapshot_file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+        magic, count, next_segment = SNAPSHOT_HEADER.unpack_from(mapped)
+        if magic not in (SNAPSHOT_MAGIC, SNAPSHOT_MAGIC_V1):
+            raise ValueError(f"{path} is not a payments snapshot")
+
+        offset = SNAPSHOT_HEADER.size
+        for column in (
+            columns.ids,
+            columns.loan_ids,
+            columns.payment_amounts,
+            columns.payment_dates,
+        ):
+            size = count * column.itemsize
+            column.frombytes(mapped[offset : offset + size])
+            offset += size
+
+        if magic == SNAPSHOT_MAGIC:
+            indexes = []
+            for _ in PaymentIndexes._fields[1:]:
+                typecode, length = SNAPSHOT_ARRAY_HEADER.unpack_from(
+                    mapped, offset
+                )
+                offset += SNAPSHOT_ARRAY_HEADER.size
+                index = array(typecode.decode())
+                size = length * index.itemsize
+                index.frombytes(mapped[offset : offset + size])
+                offset += size
+                indexes.append(index)
+            payment_indexes = PaymentIndexes(count, *indexes)
+    return columns, payment_indexes, next_segment
+
+
+class PaymentLog:
+    """append only payment log with group commit
+
+    append only copies the encoded records into a buffer and returns
+    their log sequence number, a flusher thread writes and fsyncs
+    everything buffered so far in one go. Writers that arrive while an
+    fsync is running are committed together by the next one, so
+    durability never serialises the write path on a single fsync.
+    """
+
+    def __init__(self, directory, segment):
+        self.directory = directory
+        self.segment = segment
+        self._file = open(segment_path(directory, segment), "ab")
+        self._cond = threading.Condition()
+        self._pending = bytearray()
+        self._appended_lsn = 0
+        self._durable_lsn = 0
+        self._error = None
+        self._closed = False
+        self._flusher = threading.Thread(
+            target=self._flush_loop, name="payment-log-flusher", daemon=True
+        )
+        self._flusher.start()
+
+    def append(self, payments):
+        """buffer payments and return the lsn to wait for"""
+        records = b"".join(encode_payment(payment) for payment in payments)
+        with self._cond:
+            self._pending += records
+            self._appended_lsn += 1
+            self._cond.notify_all()
+            return self._appended_lsn
+
+    def wait_durable(self, lsn):
+        """block until everything up to lsn is fsynced"""
+        with self._cond:
+            while self._durable_lsn < lsn and self._error is None:
+                self._cond.wait()
+            if self._error is not None:
+                raise self._error
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending and self._closed:
+                    return
+                records, self._pending = self._pending, bytearray()
+                lsn = self._appended_lsn
+                log_file = self._file
+
+            try:
+                log_file.write(records)
+                log_file.flush()
+                os.fsync(log_file.fileno())
+            except OSError as err:
+                with self._cond:
+                    self._error = err
+                    self._cond.notify_all()
+                return
+
+            with self._cond:
+                self._durable_lsn = max(self._durable_lsn, lsn)
+                self._cond.notify_all()
+
+    def _sync(self):
+        # wait until the flusher has committed everything appended
+        with self._cond:
+            lsn = self._appended_lsn
+        self.wait_durable(lsn)
+
+    def rotate(self):
+        """make the log durable and continue in a new segment
+
+        callers must make sure nothing is appended meanwhile, the store
+        calls it under its write lock
+        """
+        self._sync()
+        with self._cond:
+            self._file.close()
+            self.segment += 1
+            self._file = open(segment_path(self.directory, self.segment), "ab")
+        return self.segment
+
+    def close(self):
+        self._sync()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join()
+        self._file.close()
+
+
+class PaymentPersistence:
+    """durable payments for a store, a payment log plus snapshots
+
+    load() rebuilds the payments from the latest snapshot and the log
+    segments written after it, attach() then logs every payment the
+    store adds. Every snapshot_every logged payments a snapshot is
+    written in the background and the segments it covers are removed.
+    """
+
+    def __init__(self, directory, snapshot_every=DEFAULT_SNAPSHOT_EVERY):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.log = None
+        self._store = None
+        self._logged_since_snapshot = 0
+        self.snapshot_thread = None
+        self._snapshot_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def load(self, seed_payments=()):
+        """payments as PaymentColumns and the PaymentIndexes of the rows
+        restored from the snapshot, the seed is used without snapshot
+        and then the indexes are None
+        """
+        columns, payment_indexes, first_segment = read_snapshot(self.directory)
+        if columns is None:
+            columns, first_segment = PaymentColumns(), 0
+            for payment in seed_payments:
+                columns.append(
+                    payment["id"],
+                    payment["loan_id"],
+                    payment.get("payment_amount"),
+                    payment.get("payment_date"),
+                )
+
+        segments = [
+            s for s in list_segments(self.directory) if s >= first_segment
+        ]
+        for segment in segments:
+            replay_segment(segment_path(self.directory, segment), columns)
+
+        # never append behind a possibly torn tail, start a new segment
+        next_segment = max(segments, default=first_segment - 1) + 1
+        self.log = PaymentLog(self.directory, next_segment)
+        return columns, payment_indexes
+
+    def attach(self, store):
+        self._store = store
+        store.payment_log = self
+
+    def append(self, payments):
+        """log payments, called by the store under its write lock"""
+        lsn = self.log.append(payments)
+        self._logged_since_snapshot += len(payments)
+        if self._logged_since_snapshot >= self.snapshot_every:
+            self._logged_since_snapshot = 0
+            self.snapshot_thread = threading.Thread(
+                target=self.snapshot, name="payment-snapshot", daemon=True
+            )
+            self.snapshot_thread.start()
+        return lsn
+
+    def wait_durable(self, lsn):
+        self.log.wait_durable(lsn)
+
+    def rotate(self):
+        return self.log.rotate()
+
+    def snapshot(self):
+        """write a snapshot of the store and drop the covered segments"""
+        with self._snapshot_lock:
+            payments, next_segment = self._store.rotate_payment_log()
+            columns = payment_columns(payments)
+            # indexed here, off the write lock, so restoring adopts the
+            # indexes instead of indexing every payment again
+            write_snapshot(
+                self.directory,
+                columns,
+                next_segment,
+                self._store.payment_indexes(
+                    (
+                        columns.loan_ids,
+                        columns.payment_amounts,
+                        columns.payment_dates,
+                    )
+                ),
+            )
+            for segment in list_segments(self.directory):
+                if segment < next_segment:
+                    os.remove(segment_path(self.directory, segment))
+
+    def close(self):
+        self.log.close()
+
+
+def open_persistent_store(
+    store_class, loans, seed_payments, directory, **options
+):
+    """store whose payments survive restarts, see PaymentPersistence"""
+    persistence = PaymentPersistence(directory, **options)
+    store = store_class.from_payment_columns(
+        loans, *persistence.load(seed_payments)
+    )
+    persistence.attach(store)
+    return store
@@ -1,14 +1,89 @@
+import csv
 import datetime
+import importlib.util
+import io
 import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch
 from copy import deepcopy
+from functools import partial
 
-from app import app
-from utils import get_payment_status
+import amortization
+import storage.wal
+import state
+import utils
+from benchmarks.datagen import (
+    generate_loans,
+    generate_payments,
+    populate_state,
+)
+from cache import TTLCache
+from benchmarks.run import (
+    BENCHMARKS,
+    NESTED_LOANS_QUERY,
+    compare_results,
+    run_benchmarks,
+)
+from encoding import ENCODERS
+from events import (
+    COOPERATIVE_MAX_SUBSCRIBERS,
+    DEFAULT_MAX_SUBSCRIBERS,
+    PAYMENT_EVENTS,
+    RESET,
+    EventBroker,
+    default_max_subscribers,
+)
+from flask.json.provider import DefaultJSONProvider
+from graphql_server import json_encode
+from app import (
+    app,
+    graphql_backend,
+    graphql_response_cache,
+    payment_idempotency_cache,
+)
+from graphql_api.backend import CachedDocumentBackend, document_hash
+from graphql_api.cost import DEFAULT_MAX_QUERY_COST, LIST_SIZE_ESTIMATE
+from graphql_api.schema import schema
+from metrics import GRAPHQL_RESOLVER_SECONDS, Histogram
+from profiling import DUMP_HEADER, _profile_lock
+from marshmallow import ValidationError
+from rest_api.dtos.payment_dto import PaymentDTO, payment_validator
+from rest_api.export import export_rows
+from rest_api.feed import KEEPALIVE_FRAME, RESET_FRAME, RETRY_FRAME
+from storage.columnar import (
+    ColumnarStore,
+    PaymentColumns,
+    measure_footprint,
+)
+from storage.memory import MemoryStore
+from storage.paging import keyset_page
+from storage.rwlock import ReadWriteLock
+from storage.sqlite import SQLiteStore
+from storage.wal import list_segments, open_persistent_store, segment_path
+from utils import (
+    AGING_BUCKETS,
+    NO_DATE,
+    PAYMENT_STATUSES,
+    get_payment_status,
+    get_payment_status_code,
+    get_payment_statuses,
+)
 
 
 class FlaskAppTestCase(unittest.TestCase):
+    store_class = MemoryStore
+    # whether the store keeps payments in memory and can be persisted
+    # with a payment log
+    in_memory = True
+
     def setUp(self):
         self.app = app.test_client()
         self.app.testing = True
@@ -72,40 +147,42 @@ class FlaskAppTestCase(unittest.TestCase):
         self.mocked_loans = deepcopy(self.loans_fixture)
         self.mocked_loan_payments = deepcopy(self.loan_payments_fixture)
 
-        # patch state.loans and state.loan_payments where they are defined
-        # to ensures all imports from state use the mocked data
-        self.loans_patcher = patch("state.loans", new=self.mocked_loans)
-        self.loan_payments_patcher = patch(
-            "state.loan_payments", new=self.mocked_loan_payments
+        # patch state.store with a store built from the mocked data
+        # to ensure all resolvers and handlers use the mocked data
+        self.store_patcher = patch(
+            "state.store",
+            new=self.store_class(self.mocked_loans, self.mocked_loan_payments),
         )
-        self.loans_patcher.start()
-        self.loan_payments_patcher.start()
+        self.store_patcher.start()
 
-        # since they're imported at module level
-        self.rest_loans_patcher = patch(
-            "rest_api.payments.loans", new=self.mocked_loans
-        )
-        self.rest_loan_payments_patcher = patch(
-            "rest_api.payments.loan_payments", new=self.mocked_loan_payments
-        )
-        self.rest_loans_patcher.start()
-        self.rest_loan_payments_patcher.start()
+        # responses cached for a previous test's store must not leak
+        graphql_response_cache.clear()
+        payment_idempotency_cache.clear()
+        PAYMENT_EVENTS.clear()
 
-        # create a fresh loan_lookup from the mocked loans
-        self.mocked_loan_lookup = {
-            loan["id"]: loan for loan in self.mocked_loans
-        }
-        self.loan_lookup_patcher = patch(
-            "rest_api.payments.loan_lookup", new=self.mocked_loan_lookup
+    def tearDown(self):
+        self.store_patcher.stop()
+
+    def open_persistent_store(self, directory, **options):
+        if not self.in_memory:
+            self.skipTest("the store is already durable")
+        store = open_persistent_store(
+            self.store_class,
+            deepcopy(self.loans_fixture),
+            deepcopy(self.loan_payments_fixture),
+            directory,
+            **options,
         )
-        self.loan_lookup_patcher.start()
+        self.addCleanup(store.payment_log.close)
+        return store
 
-    def tearDown(self):
-        self.loans_patcher.stop()
-        self.loan_payments_patcher.stop()
-        self.rest_loans_patcher.stop()
-        self.rest_loan_payments_patcher.stop()
-        self.loan_lookup_patcher.stop()
+    def graphql(self, query, variables=None):
+        response = self.app.post(
+            "/graphql/v1",
+            data=json.dumps({"query": query, "variables": variables}),
+            content_type="application/json",
+        )
+        return response, json.loads(response.data)
 
     # test home route
     def test_home_route(self):
@@ -258,6 +335,2116 @@ class FlaskAppTestCase(unittest.TestCase):
         )
         self.assertIn(response.status_code, [400, 500])
 
+    def test_add_payment_concurrent_ids_are_unique(self):
+        """Test concurrent payment posts never receive the same ID"""
+
+        def post_payment(_):
+            return self.app.post(
+                "/api/v1/payments",
+                data=json.dumps(
+                    {
+                        "loan_id": 4,
+                        "payment_amount": 10.0,
+                        "payment_date": "2025-03-10",
+                    }
+                ),
+                content_type="application/json",
+            )
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(post_payment, range(50)))
+
+        ids = [json.loads(r.data)["payment"]["id"] for r in responses]
+        self.assertEqual(sorted(ids), list(range(4, 54)))
+
+    def test_concurrent_reads_and_writes_stay_consistent(self):
+        """Test GraphQL reads never see a half applied write under load"""
+        query = """
+            {
+              portfolioSummary { paymentCount totalPaymentsReceived }
+              loans { id loanPayments { id paymentAmount } }
+            }
+        """
+
+        def post_payment(i):
+            return self.app.post(
+                "/api/v1/payments",
+                data=json.dumps(
+                    {
+                        "loan_id": i % 4 + 1,
+                        "payment_amount": 10.0,
+                        "payment_date": "2025-03-10",
+                    }
+                ),
+                content_type="application/json",
+            ).status_code
+
+        def read_portfolio(_):
+            return self.graphql(query)[1]
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            futures = [
+                executor.submit(post_payment if i % 2 else read_portfolio, i)
+                for i in range(400)
+            ]
+            results = [future.result() for future in futures]
+
+        self.assertEqual(results[1::2], [201] * 200)
+        for data in results[::2]:
+            self.assertNotIn("errors", data)
+            summary = data["data"]["portfolioSummary"]
+            payments = [
+                payment
+                for loan in data["data"]["loans"]
+                for payment in loan["loanPayments"]
+            ]
+            # the summary and the loans come from the same version
+            self.assertEqual(summary["paymentCount"], len(payments))
+            self.assertEqual(
+                summary["totalPaymentsReceived"],
+                sum(payment["paymentAmount"] for payment in payments),
+            )
+
+        payments = state.store.find_payments()
+        self.assertEqual(
+            [payment["id"] for payment in payments], list(range(1, 204))
+        )
+
+    def test_read_write_lock_prefers_writers_and_reenters_reads(self):
+        """Test a waiting writer blocks new readers but not nested reads"""
+        lock = ReadWriteLock()
+        writer_waiting = threading.Event()
+        order = []
+
+        def write():
+            writer_waiting.set()
+            with lock.write_locked():
+                order.append("write")
+
+        def read():
+            with lock.read_locked():
+                order.append("read")
+
+        with lock.read_locked():
+            writer = threading.Thread(target=write)
+            writer.start()
+            writer_waiting.wait()
+            while not lock._writers_waiting:
+                time.sleep(0.001)
+
+            reader = threading.Thread(target=read)
+            reader.start()
+            reader.join(0.05)
+            self.assertTrue(reader.is_alive())
+
+            # a nested read of the thread already reading gets in
+            with lock.read_locked():
+                order.append("nested read")
+            with self.assertRaises(RuntimeError):
+                lock.acquire_write()
+
+        writer.join()
+        reader.join()
+        self.assertEqual(order, ["nested read", "write", "read"])
+
+    # REST API batch payment tests
+    def test_payment_validator_matches_the_dto(self):
+        """Test the single pass validator reports what PaymentDTO does"""
+        valid = {
+            "loan_id": 1,
+            "payment_amount": 10.5,
+            "payment_date": "2025-03-01",
+        }
+        payloads = [
+            None,
+            [],
+            "payment",
+            {},
+            valid,
+            {**valid, "loan_id": "5", "payment_amount": "12.5"},
+            {**valid, "loan_id": 5.5, "payment_amount": 1},
+            {**valid, "loan_id": True, "payment_amount": False},
+            {**valid, "loan_id": None, "payment_date": None},
+            {**valid, "loan_id": "1e3", "payment_amount": "abc"},
+            {**valid, "loan_id": float("inf"), "payment_amount": 1e400},
+            {**valid, "payment_amount": float("nan")},
+            {**valid, "payment_amount": 0},
+            {**valid, "payment_amount": -1, "payment_date": 20250301},
+            {**valid, "payment_date": ""},
+            {**valid, "payment_date": "2025-3-1"},
+            {**valid, "payment_date": "20250301"},
+            {**valid, "payment_date": "2025-02-30"},
+            {**valid, "payment_date": "2025-03-01T00:00"},
+            {**valid, "payment_date": ["2025-03-01"]},
+            {**valid, "extra": 1, "other": None},
+            {"loan_id": [1], "payment_amount": {}},
+        ]
+        for payload in payloads:
+            with self.subTest(payload=payload):
+                row, errors = payment_validator.validate(payload)
+                try:
+                    loaded = PaymentDTO().load(payload)
+                except ValidationError as err:
+                    self.assertEqual(errors, err.messages)
+                    continue
+                self.assertEqual(errors, {})
+                self.assertEqual(
+                    row,
+                    {
+                        **loaded,
+                        "payment_date": datetime.date.fromisoformat(
+                            loaded["payment_date"]
+                        ),
+                    },
+                )
+
+        rows, errors = payment_validator.validate_many([valid, 5, {}])
+        self.assertEqual(rows[0]["payment_date"], datetime.date(2025, 3, 1))
+        with self.assertRaises(ValidationError) as context:
+            PaymentDTO(many=True).load([valid, 5, {}])
+        self.assertEqual(errors, context.exception.messages)
+
+    def test_add_payment_requires_padded_iso_dates(self):
+        """Test payment dates must be YYYY-MM-DD"""
+        response = self.app.post(
+            "/api/v1/payments",
+            data=json.dumps(
+                {
+                    "loan_id": 1,
+                    "payment_amount": 10,
+                    "payment_date": "2025-3-1",
+                }
+            ),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            json.loads(response.data),
+            {
+                "error": {
+                    "payment_date": ["Invalid date format. Use YYYY-MM-DD"]
+                }
+            },
+        )
+
+    def post_payment(self, payload, key=None):
+        response = self.app.post(
+            "/api/v1/payments",
+            data=json.dumps(payload),
+            content_type="application/json",
+            headers={"Idempotency-Key": key} if key is not None else {},
+        )
+        return response, json.loads(response.data)
+
+    def test_add_payment_idempotency_key_replays_the_response(self):
+        """Test a retried payment is created once and replayed"""
+        payload = {
+            "loan_id": 4,
+            "payment_amount": 1500.0,
+            "payment_date": "2025-03-10",
+        }
+        first, created = self.post_payment(payload, "retry-1")
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn("Idempotent-Replayed", first.headers)
+
+        with patch.object(state.store, "add_payment") as add_payment:
+            retry, replayed = self.post_payment(payload, "retry-1")
+        add_payment.assert_not_called()
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(len(state.store.get_loan_payments(4)), 1)
+
+        # another key or no key creates another payment
+        _, other = self.post_payment(payload, "retry-2")
+        _, unkeyed = self.post_payment(payload)
+        self.assertEqual(
+            {other["payment"]["id"], unkeyed["payment"]["id"]},
+            {created["payment"]["id"] + 1, created["payment"]["id"] + 2},
+        )
+
+    def test_add_payment_idempotency_key_conflicts(self):
+        """Test a key can't be reused for another request or in flight"""
+        payload = {
+            "loan_id": 4,
+            "payment_amount": 1500.0,
+            "payment_date": "2025-03-10",
+        }
+        # failed requests don't use up the key
+        response, _ = self.post_payment({**payload, "loan_id": 999}, "k")
+        self.assertEqual(response.status_code, 404)
+        response, _ = self.post_payment(payload, "k")
+        self.assertEqual(response.status_code, 201)
+
+        response, data = self.post_payment(
+            {**payload, "payment_amount": 10.0}, "k"
+        )
+        self.assertEqual(response.status_code, 422)
+        self.assertIn("different request", data["error"])
+
+        response, _ = self.post_payment(payload, "x" * 256)
+        self.assertEqual(response.status_code, 400)
+
+        # a retry while the first request is still running
+        started, release = threading.Event(), threading.Event()
+        add_payment = state.store.add_payment
+
+        def slow_add_payment(*args):
+            started.set()
+            release.wait(5)
+            return add_payment(*args)
+
+        with patch.object(state.store, "add_payment", slow_add_payment):
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                first = pool.submit(
+                    lambda: app.test_client().post(
+                        "/api/v1/payments",
+                        data=json.dumps(payload),
+                        content_type="application/json",
+                        headers={"Idempotency-Key": "slow"},
+                    )
+                )
+                self.assertTrue(started.wait(5))
+                response, data = self.post_payment(payload, "slow")
+                release.set()
+                self.assertEqual(first.result().status_code, 201)
+        self.assertEqual(response.status_code, 409)
+
+    def read_events(self, body):
+        """(id, event, data) of the frames in the next body chunk"""
+        events = []
+        for frame in next(body).decode().split("\n\n")[:-1]:
+            fields = dict(line.split(": ", 1) for line in frame.split("\n"))
+            events.append(
+                (
+                    int(fields["id"]),
+                    fields["event"],
+                    json.loads(fields["data"]),
+                )
+            )
+        return events
+
+    def test_payment_events_stream_added_payments(self):
+        """Test added payments are pushed to event stream subscribers"""
+        response = self.app.get("/api/v1/payments/events")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        self.assertEqual(response.headers["Cache-Control"], "no-cache")
+        body = iter(response.response)
+        self.assertEqual(next(body), RETRY_FRAME)
+        self.assertEqual(PAYMENT_EVENTS.subscriber_count, 1)
+
+        self.post_payment(
+            {
+                "loan_id": 4,
+                "payment_amount": 1500.0,
+                "payment_date": "2025-03-10",
+            }
+        )
+        self.app.post(
+            "/api/v1/payments/batch",
+            data=json.dumps(
+                [
+                    {
+                        "loan_id": 1,
+                        "payment_amount": 10.0,
+                        "payment_date": "2025-05-01",
+                    },
+                    {
+                        "loan_id": 999,
+                        "payment_amount": 10.0,
+                        "payment_date": "2025-05-01",
+                    },
+                    {
+                        "loan_id": 2,
+                        "payment_amount": 20.0,
+                        "payment_date": "2025-03-02",
+                    },
+                ]
+            ),
+            content_type="application/json",
+        )
+
+        events = self.read_events(body)
+        self.assertEqual([event_id for event_id, _, _ in events], [1, 2, 3])
+        self.assertEqual({event for _, event, _ in events}, {"payment"})
+        self.assertEqual(
+            [
+                (data["payment"]["loan_id"], data["status"])
+                for _, _, data in events
+            ],
+            [(4, "Late"), (1, "Defaulted"), (2, "On Time")],
+        )
+        self.assertEqual(
+            events[0][2]["payment"],
+            {
+                "id": 4,
+                "loan_id": 4,
+                "payment_amount": 1500.0,
+                "payment_date": "2025-03-10",
+            },
+        )
+
+        response.close()
+        self.assertEqual(PAYMENT_EVENTS.subscriber_count, 0)
+
+    def test_payment_events_resume_after_last_event_id(self):
+        """Test a reconnecting subscriber gets the events it missed"""
+        for amount in (1.0, 2.0, 3.0):
+            self.post_payment(
+                {
+                    "loan_id": 4,
+                    "payment_amount": amount,
+                    "payment_date": "2025-03-10",
+                }
+            )
+
+        response = self.app.get(
+            "/api/v1/payments/events", headers={"Last-Event-ID": "1"}
+        )
+        body = iter(response.response)
+        next(body)
+        events = self.read_events(body)
+        self.assertEqual(
+            [
+                (event_id, data["payment"]["payment_amount"])
+                for event_id, _, data in events
+            ],
+            [(2, 2.0), (3, 3.0)],
+        )
+        response.close()
+
+        # ids from before the history or a restart can't be resumed
+        for last_event_id in ("-5", "99"):
+            response = self.app.get(
+                f"/api/v1/payments/events?lastEventId={last_event_id}"
+            )
+            body = iter(response.response)
+            next(body)
+            self.assertEqual(next(body), RESET_FRAME)
+            response.close()
+
+    def test_payment_events_keepalive_and_subscriber_limit(self):
+        """Test idle streams get keepalives and subscribers are capped"""
+        app.config["EVENT_STREAM_HEARTBEAT"] = 0.01
+        self.addCleanup(app.config.__setitem__, "EVENT_STREAM_HEARTBEAT", 15.0)
+        response = self.app.get("/api/v1/payments/events")
+        body = iter(response.response)
+        next(body)
+        self.assertEqual(next(body), KEEPALIVE_FRAME)
+
+        # each stream holds a worker thread, so workers take few of them
+        self.assertEqual(app.config["EVENT_STREAM_MAX_SUBSCRIBERS"], 100)
+        with patch.dict(app.config, {"EVENT_STREAM_MAX_SUBSCRIBERS": 1}):
+            full = self.app.get("/api/v1/payments/events")
+        self.assertEqual(full.status_code, 503)
+        response.close()
+
+    def test_payment_events_limit_follows_the_worker(self):
+        """Test greenlet workers take far more streams than threaded ones"""
+        self.assertEqual(default_max_subscribers(), DEFAULT_MAX_SUBSCRIBERS)
+        with patch("events.cooperative_worker", return_value=True):
+            self.assertEqual(
+                default_max_subscribers(), COOPERATIVE_MAX_SUBSCRIBERS
+            )
+
+    @unittest.skipIf(
+        importlib.util.find_spec("gevent") is None, "gevent is not installed"
+    )
+    def test_payment_events_on_greenlets_take_over_100_streams(self):
+        """Test serve.py's worker accepts streams past the threaded limit"""
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import serve\n"
+                "from app import app\n"
+                "client = app.test_client()\n"
+                "streams = [\n"
+                "    client.get('/api/v1/payments/events') for _ in range(150)\n"
+                "]\n"
+                "print(app.config['EVENT_STREAM_MAX_SUBSCRIBERS'])\n"
+                "print(sorted({stream.status_code for stream in streams}))\n",
+            ],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(
+            result.stdout.split("\n")[:2],
+            [str(COOPERATIVE_MAX_SUBSCRIBERS), "[200]"],
+        )
+
+    def test_event_broker_drops_slow_subscribers_queues(self):
+        """Test a full subscriber queue is reset without blocking"""
+        broker = EventBroker(queue_size=3, history_size=3)
+        slow, fast = broker.subscribe(), broker.subscribe()
+        broker.publish("payment", {"n": 1})
+        self.assertEqual(len(fast.get()), 1)
+
+        broker.publish_many("payment", [{"n": 2}, {"n": 3}, {"n": 4}])
+        self.assertIs(slow.get(), RESET)
+        self.assertEqual(len(fast.get()), 3)
+        self.assertEqual(slow.get(timeout=0), [])
+
+        # later events are queued again once the reset was read
+        self.assertEqual(broker.publish("payment", {"n": 5}), 5)
+        (frame,) = slow.get()
+        self.assertTrue(frame.startswith(b"id: 5\nevent: payment\n"))
+
+        # the history holds the last 3 events
+        self.assertEqual(len(broker.subscribe(last_event_id=2).get()), 3)
+        self.assertIs(broker.subscribe(last_event_id=1).get(), RESET)
+        self.assertEqual(broker.subscribe(last_event_id=5).get(0), [])
+
+    def test_ttl_cache_expires_and_bounds_entries(self):
+        """Test TTL cache entries expire and the size stays capped"""
+        now = [0.0]
+        cache = TTLCache(maxsize=3, ttl=10, clock=lambda: now[0])
+        cache.set("a", 1)
+        now[0] = 5
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.setdefault("a", 9), 1)
+
+        now[0] = 10
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.setdefault("a", 3), 3)
+        self.assertIsNone(cache.pop("missing"))
+
+        # expired entries at the least recently used end are dropped on
+        # every set, and maxsize evicts the least recently used one
+        now[0] = 15
+        cache.set("c", 4)
+        self.assertEqual(len(cache), 2)
+        cache.set("d", 5)
+        cache.set("e", 6)
+        self.assertEqual(len(cache), 3)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.pop("e"), 6)
+
+    def test_add_payments_batch_json_array(self):
+        """Test adding many payments from a JSON array"""
+        payload = [
+            {
+                "loan_id": 4,
+                "payment_amount": 100.0,
+                "payment_date": "2025-03-02",
+            },
+            {
+                "loan_id": 4,
+                "payment_amount": 200.0,
+                "payment_date": "2025-03-03",
+            },
+        ]
+        response = self.app.post(
+            "/api/v1/payments/batch",
+            data=json.dumps(payload),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.data)
+        self.assertEqual(data["inserted"], 2)
+        self.assertEqual(data["failed"], 0)
+        self.assertEqual([r["payment"]["id"] for r in data["results"]], [4, 5])
+        self.assertEqual(len(state.store.get_loan_payments(4)), 2)
+
+    def test_add_payments_batch_ndjson_with_row_errors(self):
+        """Test NDJSON batch reports per row errors and keeps valid rows"""
+        lines = [
+            json.dumps(
+                {
+                    "loan_id": 4,
+                    "payment_amount": 10.0,
+                    "payment_date": "2025-03-02",
+                }
+            ),
+            "not json",
+            json.dumps(
+                {
+                    "loan_id": 999,
+                    "payment_amount": 10.0,
+                    "payment_date": "2025-03-02",
+                }
+            ),
+            json.dumps(
+                {
+                    "loan_id": 4,
+                    "payment_amount": -1,
+                    "payment_date": "2025-13-45",
+                }
+            ),
+        ]
+        response = self.app.post(
+            "/api/v1/payments/batch",
+            data="\n".join(lines) + "\n",
+            content_type="application/x-ndjson",
+        )
+        self.assertEqual(response.status_code, 207)
+        data = json.loads(response.data)
+        self.assertEqual(data["inserted"], 1)
+        self.assertEqual(data["failed"], 3)
+        results = data["results"]
+        self.assertEqual(results[0]["payment"]["loan_id"], 4)
+        self.assertEqual(results[1]["error"], "Invalid JSON")
+        self.assertIn("not found", results[2]["error"])
+        self.assertIn("payment_amount", results[3]["error"])
+        self.assertIn("payment_date", results[3]["error"])
+
+    def test_add_payments_batch_rejects_non_array(self):
+        """Test batch endpoint rejects a JSON body that is not an array"""
+        response = self.app.post(
+            "/api/v1/payments/batch",
+            data=json.dumps({"loan_id": 4}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", json.loads(response.data))
+
+    # export api tests
+    def test_export_streams_ndjson_rows(self):
+        """Test the export has a row per payment and per unpaid loan"""
+        response = self.app.get("/api/v1/export")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+
+        rows = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual(
+            [(row["payment_id"], row["status"]) for row in rows],
+            [(1, "On Time"), (2, "Late"), (3, "Defaulted"), (None, "Unpaid")],
+        )
+        self.assertEqual(
+            rows[0],
+            {
+                "loan_id": 1,
+                "loan_name": "Tom's Loan",
+                "interest_rate": 5.0,
+                "principal": 10000,
+                "due_date": "2025-03-01",
+                "payment_id": 1,
+                "payment_amount": 1000,
+                "payment_date": "2025-03-04",
+                "status": "On Time",
+            },
+        )
+
+    def test_export_streams_csv_rows(self):
+        """Test the CSV export starts with the header before reading data"""
+        with patch.object(
+            state.store, "page_loans", wraps=state.store.page_loans
+        ) as page_loans:
+            response = self.app.get("/api/v1/export?format=csv")
+            body = iter(response.response)
+            header = next(body)
+            page_loans.assert_not_called()
+            text = b"".join([header, *body]).decode()
+            rows = list(csv.DictReader(io.StringIO(text)))
+
+        self.assertEqual(response.mimetype, "text/csv")
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1]["status"], "Late")
+        self.assertEqual(rows[1]["payment_date"], "2025-03-15")
+        self.assertEqual(rows[3]["payment_id"], "")
+        self.assertEqual(rows[3]["status"], "Unpaid")
+
+    def test_export_reads_the_store_one_chunk_at_a_time(self):
+        """Test export rows are generated lazily, chunk by chunk"""
+        with patch.object(
+            state.store, "page_loans", wraps=state.store.page_loans
+        ) as page_loans:
+            rows = export_rows(state.store, chunk_size=2)
+            first = next(rows)
+            self.assertEqual(page_loans.call_count, 1)
+            remaining = list(rows)
+        self.assertEqual(page_loans.call_count, 2)
+        self.assertEqual(
+            [row["loan_id"] for row in [first, *remaining]], [1, 2, 3, 4]
+        )
+
+    def test_export_rejects_unknown_formats(self):
+        """Test export only serves ndjson and csv"""
+        response = self.app.get("/api/v1/export?format=xml")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", json.loads(response.data))
+
+    # GraphQL API tests
+    def test_graphql_loans_with_payments_and_status(self):
+        """Test nested loans query resolves payments and statuses"""
+        response, data = self.graphql(
+            "{ loans { id loanPayments { id loanId status } } }"
+        )
+        self.assertEqual(response.status_code, 200)
+        loans = {loan["id"]: loan for loan in data["data"]["loans"]}
+        self.assertEqual(len(loans), 4)
+        self.assertEqual(
+            loans[1]["loanPayments"],
+            [{"id": 1, "loanId": 1, "status": "On Time"}],
+        )
+        self.assertEqual(loans[2]["loanPayments"][0]["status"], "Late")
+        self.assertEqual(loans[3]["loanPayments"][0]["status"], "Defaulted")
+        self.assertEqual(loans[4]["loanPayments"], [])
+
+    def test_graphql_reflects_added_payment(self):
+        """Test a payment added via REST is visible through the loan index"""
+        payload = {
+            "loan_id": 4,
+            "payment_amount": 1500.0,
+            "payment_date": "2025-03-10",
+        }
+        self.app.post(
+            "/api/v1/payments",
+            data=json.dumps(payload),
+            content_type="application/json",
+        )
+        _, data = self.graphql("{ loans { id loanPayments { id status } } }")
+        loans = {loan["id"]: loan for loan in data["data"]["loans"]}
+        self.assertEqual(
+            loans[4]["loanPayments"], [{"id": 4, "status": "Late"}]
+        )
+
+    def test_graphql_batches_lookups_per_relationship(self):
+        """Test nested lookups are batched into one store call per relation"""
+        store = state.store
+        with patch.object(
+            store,
+            "get_payments_by_loan_ids",
+            wraps=store.get_payments_by_loan_ids,
+        ) as payments_batch, patch.object(
+            store, "get_loans_by_ids", wraps=store.get_loans_by_ids
+        ) as loans_batch:
+            self.graphql("{ loans { id loanPayments { id status } } }")
+
+        payments_batch.assert_called_once()
+        self.assertEqual(list(payments_batch.call_args[0][0]), [1, 2, 3, 4])
+        loans_batch.assert_called_once()
+        self.assertEqual(list(loans_batch.call_args[0][0]), [1, 2, 3])
+
+    def test_graphql_batches_filtered_payments(self):
+        """Test filtered loanPayments are one store call per filter set"""
+        store = state.store
+        with patch.object(
+            store,
+            "find_payments_by_loan_ids",
+            wraps=store.find_payments_by_loan_ids,
+        ) as payments_batch, patch.object(
+            store, "find_payments", wraps=store.find_payments
+        ) as find_payments:
+            _, data = self.graphql("""
+                {
+                  loans {
+                    id
+                    late: loanPayments(status: "Late") { id }
+                    march: loanPayments(
+                      paymentDateFrom: "2025-03-01"
+                      paymentDateTo: "2025-03-31"
+                    ) { id }
+                  }
+                }
+                """)
+
+        find_payments.assert_not_called()
+        self.assertEqual(payments_batch.call_count, 2)
+        for call in payments_batch.call_args_list:
+            self.assertEqual(list(call[0][0]), [1, 2, 3, 4])
+        self.assertEqual(
+            [loan["late"] for loan in data["data"]["loans"]],
+            [[], [{"id": 2}], [], []],
+        )
+        self.assertEqual(
+            [loan["march"] for loan in data["data"]["loans"]],
+            [
+                [
+                    {"id": payment["id"]}
+                    for payment in store.find_payments(
+                        loan_id=loan_id,
+                        payment_date_from=datetime.date(2025, 3, 1),
+                        payment_date_to=datetime.date(2025, 3, 31),
+                    )
+                ]
+                for loan_id in (1, 2, 3, 4)
+            ],
+        )
+
+    def test_graphql_classifies_statuses_in_one_batch(self):
+        """Test all payment statuses of a query are classified in one call"""
+        with patch(
+            "graphql_api.loaders.get_payment_statuses",
+            wraps=get_payment_statuses,
+        ) as classify:
+            self.graphql("{ loans { loanPayments { status } } }")
+
+        classify.assert_called_once()
+        self.assertEqual(len(classify.call_args[0][0]), 3)
+
+    def test_graphql_loans_connection_pages_forward_and_back(self):
+        """Test loansConnection keyset pagination in both directions"""
+        query = """
+            query ($first: Int, $after: String, $last: Int, $before: String) {
+              loansConnection(
+                first: $first, after: $after, last: $last, before: $before
+              ) {
+                pageInfo { hasNextPage hasPreviousPage endCursor startCursor }
+                edges { node { id } }
+              }
+            }
+        """
+        ids, after = [], None
+        while True:
+            _, data = self.graphql(query, {"first": 1, "after": after})
+            connection = data["data"]["loansConnection"]
+            ids += [edge["node"]["id"] for edge in connection["edges"]]
+            after = connection["pageInfo"]["endCursor"]
+            if not connection["pageInfo"]["hasNextPage"]:
+                break
+        self.assertEqual(ids, [1, 2, 3, 4])
+
+        _, data = self.graphql(query, {"last": 2, "before": after})
+        connection = data["data"]["loansConnection"]
+        self.assertEqual(
+            [edge["node"]["id"] for edge in connection["edges"]], [2, 3]
+        )
+        self.assertTrue(connection["pageInfo"]["hasPreviousPage"])
+        self.assertTrue(connection["pageInfo"]["hasNextPage"])
+
+    def test_graphql_loans_connection_filters(self):
+        """Test loansConnection pages only the loans its filters match"""
+        query = """
+            query ($status: String, $after: String) {
+              loansConnection(status: $status, first: 1, after: $after) {
+                pageInfo { hasNextPage endCursor }
+                edges { node { id } }
+              }
+            }
+        """
+        for status, expected in (
+            ("Late", [2]),
+            ("Unpaid", [4]),
+            ("Defaulted", [3]),
+            (None, [1, 2, 3, 4]),
+        ):
+            ids, after = [], None
+            while True:
+                _, data = self.graphql(
+                    query, {"status": status, "after": after}
+                )
+                connection = data["data"]["loansConnection"]
+                ids += [edge["node"]["id"] for edge in connection["edges"]]
+                after = connection["pageInfo"]["endCursor"]
+                if not connection["pageInfo"]["hasNextPage"]:
+                    break
+            self.assertEqual(ids, expected, status)
+
+        _, data = self.graphql("""
+            {
+              loansConnection(
+                status: "Unpaid", paymentDateFrom: "2025-03-01"
+              ) {
+                pageInfo { hasNextPage hasPreviousPage }
+                edges { node { id } }
+              }
+            }
+            """)
+        self.assertEqual(
+            data["data"]["loansConnection"],
+            {
+                "pageInfo": {"hasNextPage": False, "hasPreviousPage": False},
+                "edges": [],
+            },
+        )
+
+    def test_graphql_loan_payments_connection(self):
+        """Test loanPaymentsConnection pages a loan's payments by id"""
+        for day in (2, 3, 4):
+            self.app.post(
+                "/api/v1/payments",
+                data=json.dumps(
+                    {
+                        "loan_id": 4,
+                        "payment_amount": 10.0,
+                        "payment_date": f"2025-03-0{day}",
+                    }
+                ),
+                content_type="application/json",
+            )
+        _, data = self.graphql("""
+            {
+              loansConnection(last: 1) {
+                edges {
+                  node {
+                    loanPaymentsConnection(first: 2) {
+                      pageInfo { hasNextPage }
+                      edges { node { id status } }
+                    }
+                  }
+                }
+              }
+            }
+            """)
+        payments = data["data"]["loansConnection"]["edges"][0]["node"][
+            "loanPaymentsConnection"
+        ]
+        self.assertTrue(payments["pageInfo"]["hasNextPage"])
+        self.assertEqual(
+            [edge["node"] for edge in payments["edges"]],
+            [{"id": 4, "status": "On Time"}, {"id": 5, "status": "On Time"}],
+        )
+
+    def test_graphql_loans_connection_invalid_arguments(self):
+        """Test invalid cursors and oversized pages are rejected"""
+        _, data = self.graphql(
+            '{ loansConnection(after: "nope") { edges { cursor } } }'
+        )
+        self.assertIn("Invalid cursor", data["errors"][0]["message"])
+
+        _, data = self.graphql(
+            "{ loansConnection(first: 1000) { edges { cursor } } }"
+        )
+        self.assertIn("first must be between", data["errors"][0]["message"])
+
+    def test_graphql_filter_loans_by_status_and_dates(self):
+        """Test loans filters by payment status, payment and due dates"""
+        _, data = self.graphql('{ loans(status: "Late") { id } }')
+        self.assertEqual(data["data"]["loans"], [{"id": 2}])
+
+        _, data = self.graphql('{ loans(status: "Unpaid") { id } }')
+        self.assertEqual(data["data"]["loans"], [{"id": 4}])
+
+        _, data = self.graphql("""
+            {
+              loans(paymentDateFrom: "2025-03-10", paymentDateTo: "2025-04-30") {
+                id
+                loanPayments(status: "Defaulted") { id }
+              }
+            }
+            """)
+        self.assertEqual(
+            data["data"]["loans"],
+            [
+                {"id": 2, "loanPayments": []},
+                {"id": 3, "loanPayments": [{"id": 3}]},
+            ],
+        )
+
+        _, data = self.graphql('{ loans(dueDateFrom: "2025-03-02") { id } }')
+        self.assertEqual(data["data"]["loans"], [])
+
+    def test_graphql_filter_indexes_follow_added_payments(self):
+        """Test status and date indexes are updated when payments land"""
+        self.app.post(
+            "/api/v1/payments",
+            data=json.dumps(
+                {
+                    "loan_id": 4,
+                    "payment_amount": 100.0,
+                    "payment_date": "2025-03-20",
+                }
+            ),
+            content_type="application/json",
+        )
+        _, data = self.graphql('{ loans(status: "Late") { id } }')
+        self.assertEqual(data["data"]["loans"], [{"id": 2}, {"id": 4}])
+
+        _, data = self.graphql('{ loans(status: "Unpaid") { id } }')
+        self.assertEqual(data["data"]["loans"], [])
+
+        payments = state.store.find_payments(
+            payment_date_from=datetime.date(2025, 3, 15),
+            payment_date_to=datetime.date(2025, 3, 20),
+        )
+        self.assertEqual([p["id"] for p in payments], [2, 4])
+
+    def test_graphql_filter_rejects_unknown_status(self):
+        """Test an unknown status filter returns an error"""
+        _, data = self.graphql('{ loans(status: "Paid") { id } }')
+        self.assertIn("status must be one of", data["errors"][0]["message"])
+
+    def test_graphql_reuses_parsed_documents(self):
+        """Test repeated queries skip parsing and validation"""
+        query = "{ loans { id name } }"
+        self.graphql(query)
+        with patch("graphql_api.backend.parse") as parse, patch(
+            "graphql_api.backend.validate"
+        ) as validate:
+            response, data = self.graphql(query)
+
+        parse.assert_not_called()
+        validate.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data["data"]["loans"]), 4)
+
+    def test_graphql_persisted_query(self):
+        """Test a query can be sent as its sha256 once it is known"""
+        query = "{ loans { id dueDate } }"
+        extensions = {
+            "persistedQuery": {
+                "version": 1,
+                "sha256Hash": document_hash(query),
+            }
+        }
+
+        def post(body):
+            response = self.app.post(
+                "/graphql/v1",
+                data=json.dumps(body),
+                content_type="application/json",
+            )
+            return response, json.loads(response.data)
+
+        graphql_backend.clear()
+        _, data = post({"extensions": extensions})
+        self.assertEqual(
+            data["errors"][0]["message"], "PersistedQueryNotFound"
+        )
+
+        response, _ = post(
+            {"query": "{ loans { id } }", "extensions": extensions}
+        )
+        self.assertEqual(response.status_code, 400)
+
+        _, data = post({"query": query, "extensions": extensions})
+        self.assertEqual(len(data["data"]["loans"]), 4)
+
+        response = self.app.get(
+            "/graphql/v1",
+            query_string={"extensions": json.dumps(extensions)},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            json.loads(response.data)["data"]["loans"][0],
+            {"id": 1, "dueDate": "2025-03-01"},
+        )
+
+    def test_document_cache_evicts_least_recently_used(self):
+        """Test the document cache stays bounded"""
+        backend = CachedDocumentBackend(maxsize=2)
+        first, second, third = (
+            "{ loans { id } }",
+            "{ loans { name } }",
+            "{ loans { principal } }",
+        )
+        for query in (first, second, first, third):
+            backend.document_from_string(schema, query)
+
+        self.assertIsNotNone(backend.get_document(document_hash(first)))
+        self.assertIsNone(backend.get_document(document_hash(second)))
+        self.assertIsNotNone(backend.get_document(document_hash(third)))
+
+    def test_graphql_loan_balances_follow_payments(self):
+        """Test balance fields are updated by every new payment"""
+        query = """{ loans(dueDateFrom: "2025-03-01") {
+            id outstandingBalance nextPaymentDue progressPercentage
+        } }"""
+        with patch(
+            "amortization.amortization_schedule",
+            wraps=amortization.amortization_schedule,
+        ) as build_schedule:
+            _, data = self.graphql(query)
+            self.assertEqual(
+                data["data"]["loans"][3],
+                {
+                    "id": 4,
+                    "outstandingBalance": 40325.75,
+                    "nextPaymentDue": "2024-04-01",
+                    "progressPercentage": 0.0,
+                },
+            )
+            # loan 1 has paid 1000, its first installment is 856.07
+            self.assertEqual(
+                data["data"]["loans"][0],
+                {
+                    "id": 1,
+                    "outstandingBalance": 9272.89,
+                    "nextPaymentDue": "2024-05-01",
+                    "progressPercentage": 9.73,
+                },
+            )
+
+            for _ in range(2):
+                response = self.app.post(
+                    "/api/v1/payments",
+                    data=json.dumps(
+                        {
+                            "loan_id": 4,
+                            "payment_amount": 40325.75 / 2,
+                            "payment_date": "2025-03-01",
+                        }
+                    ),
+                    content_type="application/json",
+                )
+                self.assertEqual(response.status_code, 201)
+                _, data = self.graphql(query)
+
+        # schedules are built once per loan, not on every query
+        self.assertEqual(build_schedule.call_count, 4)
+        self.assertEqual(
+            data["data"]["loans"][3],
+            {
+                "id": 4,
+                "outstandingBalance": 0.0,
+                "nextPaymentDue": None,
+                "progressPercentage": 100.0,
+            },
+        )
+
+    def test_graphql_reports_query_cost(self):
+        """Test the query cost is returned in the response extensions"""
+        _, data = self.graphql(
+            "query GetLoans { loans { id loanPayments { id status } } }"
+        )
+        self.assertEqual(len(data["data"]["loans"]), 4)
+        # 4 loans each with 3 payments over 4 loans rounded up
+        self.assertEqual(
+            data["extensions"]["cost"],
+            {
+                "requestedQueryCost": 4 * (1 + 1),
+                "maximumAvailable": graphql_backend.max_cost,
+            },
+        )
+
+    def test_graphql_costs_plain_lists_by_portfolio_size(self):
+        """Test unpaginated lists are costed from the store's counts"""
+        query = "{ loans { id loanPayments { id } } }"
+        rows = [
+            {
+                "loan_id": 1,
+                "payment_amount": 10.0,
+                "payment_date": datetime.date(2025, 3, 2),
+            }
+        ] * 9
+        state.store.add_payments(rows)
+        _, data = self.graphql(query)
+        # 12 payments are 3 per loan
+        self.assertEqual(
+            data["extensions"]["cost"]["requestedQueryCost"], 4 * (1 + 3)
+        )
+
+        # listing a large portfolio once, as the web client does, is
+        # never over the limit, listing it twice is
+        loans = generate_loans(2000)
+        store = self.store_class(loans, generate_payments(loans, 10_000))
+        self.addCleanup(getattr(store, "close", lambda: None))
+        with patch("state.store", new=store):
+            response, data = self.graphql(query)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                data["extensions"]["cost"],
+                {"requestedQueryCost": 12000, "maximumAvailable": 12000},
+            )
+
+            response, data = self.graphql(
+                "{ a: loans { id loanPayments { id } } "
+                "b: loans { id loanPayments { id } } }"
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(
+                data["errors"][0]["message"],
+                "Query cost of 24000 exceeds the maximum cost of 12000",
+            )
+
+            # filtered lists are costed at LIST_SIZE_ESTIMATE items at
+            # most, here 50 loans of 5 payments
+            response, data = self.graphql(
+                'query ($status: String) { loans(status: "Late") '
+                "{ id loanPayments(status: $status) { id } } }",
+                {"status": "Late"},
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                data["extensions"]["cost"]["requestedQueryCost"],
+                LIST_SIZE_ESTIMATE * (1 + 5),
+            )
+
+    def test_graphql_costs_connections_by_page_size(self):
+        """Test connections are weighted by their first and last arguments"""
+        query = """
+            query Pages($first: Int) {
+                loansConnection(first: 10) {
+                    pageInfo { hasNextPage }
+                    edges {
+                        node {
+                            loanPaymentsConnection(first: $first) {
+                                edges { node { ...PaymentFields } }
+                            }
+                        }
+                    }
+                }
+            }
+            fragment PaymentFields on LoanPayment { id status }
+        """
+
+        def cost(first):
+            _, data = self.graphql(query, {"first": first})
+            return data["extensions"]["cost"]["requestedQueryCost"]
+
+        # connection, pageInfo and 10 edges holding a node and a payment
+        # connection with first edges each
+        self.assertEqual(cost(2), 1 + 1 + 10 * (1 + 1 + 1 + 2 * 2))
+        self.assertEqual(cost(100), 1 + 1 + 10 * (1 + 1 + 1 + 100 * 2))
+        # no page size counts the default page of 50
+        self.assertEqual(cost(None), 1 + 1 + 10 * (1 + 1 + 1 + 50 * 2))
+
+    def test_graphql_rejects_queries_over_the_cost_limit(self):
+        """Test costly queries fail before any resolver runs"""
+        query = """{
+            loansConnection(first: 100) {
+                edges { node { loanPaymentsConnection(first: 100) {
+                    edges { node { id } }
+                } } }
+            }
+        }"""
+        with patch.object(
+            state.store, "page_loans", wraps=state.store.page_loans
+        ) as page_loans:
+            response, data = self.graphql(query)
+
+        page_loans.assert_not_called()
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn("data", data)
+        self.assertEqual(
+            data["errors"][0]["message"],
+            "Query cost of 20301 exceeds the maximum cost of 10000",
+        )
+        self.assertEqual(
+            data["extensions"]["cost"]["requestedQueryCost"], 20301
+        )
+
+        with patch.object(graphql_backend, "max_cost", None):
+            response, data = self.graphql(query)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data["data"]["loansConnection"]["edges"]), 4)
+
+    def test_graphql_rejects_queries_over_the_depth_limit(self):
+        """Test deeply nested queries fail validation"""
+        nested = "{ loansConnection { edges { node { id } } } }"
+        backend = CachedDocumentBackend(max_depth=2)
+
+        document = backend.document_from_string(schema, nested)
+        result = document.execute()
+        self.assertTrue(result.invalid)
+        self.assertEqual(
+            result.errors[0].message,
+            "Query depth of 4 exceeds the maximum depth of 2",
+        )
+
+        # fragments count towards the depth, introspection does not
+        fragment = """
+            { loans { ...Loan } }
+            fragment Loan on ExistingLoans { loanPayments { id } }
+        """
+        result = backend.document_from_string(schema, fragment).execute()
+        self.assertIn("Query depth of 3", result.errors[0].message)
+        result = backend.document_from_string(
+            schema, "{ __schema { types { fields { type { name } } } } }"
+        ).execute()
+        self.assertFalse(result.errors)
+
+    def test_graphql_serves_cached_responses_until_a_write(self):
+        """Test read queries are cached until a payment is added"""
+        query = "{ loans { id loanPayments { id } } }"
+        _, first = self.graphql(query)
+
+        with patch.object(
+            state.store, "get_loans", wraps=state.store.get_loans
+        ) as get_loans:
+            _, second = self.graphql(query)
+        get_loans.assert_not_called()
+        self.assertEqual(first, second)
+
+        self.app.post(
+            "/api/v1/payments",
+            data=json.dumps(
+                {
+                    "loan_id": 4,
+                    "payment_amount": 100.0,
+                    "payment_date": "2025-03-20",
+                }
+            ),
+            content_type="application/json",
+        )
+        _, third = self.graphql(query)
+        self.assertEqual(
+            third["data"]["loans"][3]["loanPayments"], [{"id": 4}]
+        )
+
+    def test_graphql_etag_not_modified(self):
+        """Test a GET with a matching If-None-Match gets a 304"""
+        query_string = {"query": "{ loans { id } }"}
+        response = self.app.get("/graphql/v1", query_string=query_string)
+        etag = response.headers["ETag"]
+        self.assertEqual(response.status_code, 200)
+
+        response = self.app.get(
+            "/graphql/v1",
+            query_string=query_string,
+            headers={"If-None-Match": etag},
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+
+    def test_graphql_does_not_cache_errors(self):
+        """Test responses with errors are not cached"""
+        query = '{ loans(status: "Paid") { id } }'
+        self.graphql(query)
+        response, data = self.graphql(query)
+        self.assertIn("errors", data)
+        self.assertNotIn("ETag", response.headers)
+
+        # partial results are not cached either, whatever the encoder
+        # puts first
+        query = """{
+            loans { id }
+            loansConnection(after: "bad") { pageInfo { hasNextPage } }
+        }"""
+        with patch(
+            "graphql_api.view.dumps",
+            lambda data, pretty=False: json.dumps(data, sort_keys=True),
+        ):
+            self.graphql(query)
+            response, data = self.graphql(query)
+        self.assertEqual(list(data), ["data", "errors", "extensions"])
+        self.assertEqual(len(data["data"]["loans"]), 4)
+        self.assertNotIn("ETag", response.headers)
+
+    def test_graphql_portfolio_summary_follows_payments(self):
+        """Test portfolio counters are updated as payments are added"""
+        query = """
+            {
+              portfolioSummary {
+                loanCount
+                paymentCount
+                loanStatusCounts { status count }
+                principalAtRisk
+                totalPaymentsReceived
+              }
+            }
+        """
+        _, data = self.graphql(query)
+        summary = data["data"]["portfolioSummary"]
+        self.assertEqual(summary["loanCount"], 4)
+        self.assertEqual(summary["paymentCount"], 3)
+        self.assertEqual(
+            summary["loanStatusCounts"],
+            [
+                {"status": "On Time", "count": 1},
+                {"status": "Late", "count": 1},
+                {"status": "Defaulted", "count": 1},
+                {"status": "Unpaid", "count": 1},
+            ],
+        )
+        self.assertEqual(summary["principalAtRisk"], 570000)
+        self.assertEqual(summary["totalPaymentsReceived"], 8000)
+
+        for loan_id, payment_date in ((4, "2025-03-02"), (2, "2025-03-01")):
+            self.app.post(
+                "/api/v1/payments",
+                data=json.dumps(
+                    {
+                        "loan_id": loan_id,
+                        "payment_amount": 500.0,
+                        "payment_date": payment_date,
+                    }
+                ),
+                content_type="application/json",
+            )
+
+        # loan 4 is now On Time, the backdated loan 2 payment keeps it Late
+        _, data = self.graphql(query)
+        summary = data["data"]["portfolioSummary"]
+        self.assertEqual(summary["paymentCount"], 5)
+        self.assertEqual(
+            {c["status"]: c["count"] for c in summary["loanStatusCounts"]},
+            {"On Time": 2, "Late": 1, "Defaulted": 1, "Unpaid": 0},
+        )
+        self.assertEqual(summary["principalAtRisk"], 530000)
+        self.assertEqual(summary["totalPaymentsReceived"], 9000)
+
+    def test_graphql_delinquency_aging_as_of(self):
+        """Test unpaid loans are bucketed by days past due as of a date"""
+        query = """
+            query Aging($asOf: Date) {
+              delinquencyAging(asOf: $asOf) {
+                bucket
+                minDaysPastDue
+                maxDaysPastDue
+                loanCount
+                principal
+              }
+            }
+        """
+        _, data = self.graphql(query, {"asOf": "2025-03-10"})
+        self.assertEqual(
+            data["data"]["delinquencyAging"],
+            [
+                {
+                    "bucket": "Not Due",
+                    "minDaysPastDue": None,
+                    "maxDaysPastDue": -1,
+                    "loanCount": 0,
+                    "principal": 0,
+                },
+                {
+                    "bucket": "0-5",
+                    "minDaysPastDue": 0,
+                    "maxDaysPastDue": 5,
+                    "loanCount": 0,
+                    "principal": 0,
+                },
+                {
+                    "bucket": "6-30",
+                    "minDaysPastDue": 6,
+                    "maxDaysPastDue": 30,
+                    "loanCount": 1,
+                    "principal": 40000,
+                },
+                {
+                    "bucket": "30+",
+                    "minDaysPastDue": 31,
+                    "maxDaysPastDue": None,
+                    "loanCount": 0,
+                    "principal": 0,
+                },
+            ],
+        )
+
+        # loan 4 is due on 2025-03-01 and has no payment
+        for as_of, bucket in (
+            ("2025-02-28", "Not Due"),
+            ("2025-03-01", "0-5"),
+            ("2025-03-06", "0-5"),
+            ("2025-03-07", "6-30"),
+            ("2025-03-31", "6-30"),
+            ("2025-04-01", "30+"),
+        ):
+            _, data = self.graphql(query, {"asOf": as_of})
+            counts = {
+                row["bucket"]: row["loanCount"]
+                for row in data["data"]["delinquencyAging"]
+            }
+            self.assertEqual(counts[bucket], 1, as_of)
+            self.assertEqual(sum(counts.values()), 1, as_of)
+
+            _, data = self.graphql(
+                "query Loans($bucket: String, $asOf: Date) {"
+                " loans(agingBucket: $bucket, asOf: $asOf) { id } }",
+                {"bucket": bucket, "asOf": as_of},
+            )
+            self.assertEqual(data["data"]["loans"], [{"id": 4}], as_of)
+
+        # a payment takes the loan out of the buckets
+        self.post_payment(
+            {
+                "loan_id": 4,
+                "payment_amount": 10.0,
+                "payment_date": "2025-04-02",
+            }
+        )
+        _, data = self.graphql(query, {"asOf": "2025-04-01"})
+        self.assertEqual(
+            [row["loanCount"] for row in data["data"]["delinquencyAging"]],
+            [0, 0, 0, 0],
+        )
+
+        _, data = self.graphql('{ loans(agingBucket: "31+") { id } }')
+        self.assertIn(
+            "agingBucket must be one of", data["errors"][0]["message"]
+        )
+        _, data = self.graphql('{ loans(asOf: "2025-04-01") { id } }')
+        self.assertIn(
+            "only used with agingBucket", data["errors"][0]["message"]
+        )
+
+    def test_graphql_aging_cache_follows_today(self):
+        """Test cached aging results without asOf expire with the day"""
+        queries = (
+            "{ delinquencyAging { bucket loanCount } }",
+            '{ loans(agingBucket: "30+") { id } }',
+        )
+
+        def today_is(day):
+            with patch("graphql_api.filters.datetime") as mocked:
+                mocked.date.today.return_value = datetime.date(2025, *day)
+                return [self.graphql(query)[1]["data"] for query in queries]
+
+        aging, loans = today_is((2, 1))
+        self.assertEqual(
+            aging["delinquencyAging"][0], {"bucket": "Not Due", "loanCount": 1}
+        )
+        self.assertEqual(loans["loans"], [])
+
+        # the same queries on a later day are worked out again
+        aging, loans = today_is((4, 1))
+        self.assertEqual(
+            aging["delinquencyAging"][3], {"bucket": "30+", "loanCount": 1}
+        )
+        self.assertEqual(loans["loans"], [{"id": 4}])
+
+    def test_delinquency_aging_matches_a_scan(self):
+        """Test aging buckets match classifying every unpaid loan"""
+        loans = generate_loans(300, seed=3)
+        store = self.store_class(loans, generate_payments(loans, 200, seed=3))
+
+        def check():
+            paid = {
+                p["loan_id"]
+                for p in store.find_payments()
+                if p["payment_date"]
+            }
+            for as_of in (
+                datetime.date(2024, 12, 1),
+                datetime.date(2025, 3, 15),
+                datetime.date(2025, 7, 2),
+                datetime.date(2026, 1, 1),
+            ):
+                expected = {bucket: [] for bucket in AGING_BUCKETS}
+                for loan in loans:
+                    if loan["id"] in paid:
+                        continue
+                    days = (as_of - loan["due_date"]).days
+                    bucket = (
+                        "Not Due"
+                        if days < 0
+                        else (
+                            "0-5"
+                            if days <= 5
+                            else "6-30" if days <= 30 else "30+"
+                        )
+                    )
+                    expected[bucket].append(loan)
+
+                aging = store.get_delinquency_aging(as_of)
+                for bucket, bucket_loans in expected.items():
+                    self.assertEqual(
+                        aging[bucket],
+                        {
+                            "loan_count": len(bucket_loans),
+                            "principal": sum(
+                                loan["principal"] for loan in bucket_loans
+                            ),
+                        },
+                    )
+                    self.assertEqual(
+                        [
+                            loan["id"]
+                            for loan in store.find_loans(
+                                aging_bucket=bucket, as_of=as_of
+                            )
+                        ],
+                        [loan["id"] for loan in bucket_loans],
+                    )
+
+        check()
+        # the buckets follow payments, undated ones leave a loan unpaid
+        store.add_payments(
+            [
+                {
+                    "loan_id": loan_id,
+                    "payment_amount": 100.0,
+                    "payment_date": (
+                        None if loan_id % 3 else datetime.date(2025, 6, 1)
+                    ),
+                }
+                for loan_id in range(1, 301, 7)
+            ]
+        )
+        check()
+
+    def test_profiling_token_profiles_one_request(self):
+        """Test a request with the profiling token gets its profile"""
+        query = {"query": "{ loans { id loanPayments { status } } }"}
+        headers = {"X-Profile-Token": "secret"}
+
+        def post_graphql(**options):
+            response = self.app.post(
+                "/graphql/v1",
+                data=json.dumps(query),
+                content_type="application/json",
+                **options,
+            )
+            return response, json.loads(response.data)
+
+        # profiling is off until PROFILING_TOKEN is configured
+        _, data = post_graphql(headers=headers)
+        self.assertNotIn("profile", data["extensions"])
+
+        with patch.dict(
+            app.config, {"PROFILING_TOKEN": "secret", "PROFILE_TOP": 1000}
+        ):
+            _, plain = post_graphql()
+            response, data = post_graphql(headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("profile", plain["extensions"])
+            self.assertEqual(data["data"], plain["data"])
+            self.assertIn("cost", data["extensions"])
+
+            profile = data["extensions"]["profile"]
+            self.assertGreater(profile["durationMs"], 0)
+            self.assertEqual(
+                profile["functions"],
+                sorted(
+                    profile["functions"],
+                    key=lambda function: -function["totalTimeMs"],
+                ),
+            )
+            self.assertTrue(
+                any(
+                    "resolve_loans" in function["function"]
+                    for function in profile["functions"]
+                )
+            )
+            self.assertTrue(
+                all(site["size"] > 0 for site in profile["allocations"])
+            )
+
+            # the rest api too, the view still runs once
+            response = self.app.post(
+                "/api/v1/payments",
+                data=json.dumps(
+                    {
+                        "loan_id": 4,
+                        "payment_amount": 10.0,
+                        "payment_date": "2025-03-10",
+                    }
+                ),
+                content_type="application/json",
+                headers=headers,
+            )
+            data = json.loads(response.data)
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(data["payment"]["loan_id"], 4)
+            self.assertIn("functions", data["extensions"]["profile"])
+            self.assertEqual(len(state.store.get_loan_payments(4)), 1)
+
+            response, _ = post_graphql(headers={"X-Profile-Token": "guess"})
+            self.assertEqual(response.status_code, 403)
+
+            with _profile_lock:
+                response, _ = post_graphql(headers=headers)
+            self.assertEqual(response.status_code, 409)
+
+    def test_profiling_dumps_streamed_responses(self):
+        """Test profiles of streamed responses are written to a file"""
+        with tempfile.TemporaryDirectory() as directory, patch.dict(
+            app.config,
+            {
+                "PROFILING_TOKEN": "secret",
+                "PROFILE_DIR": directory,
+                "PROFILE_TOP": 1000,
+            },
+        ):
+            response = self.app.get(
+                "/api/v1/export", headers={"X-Profile-Token": "secret"}
+            )
+            self.assertEqual(len(response.data.splitlines()), 4)
+            response.close()
+
+            path = os.path.join(directory, response.headers[DUMP_HEADER])
+            with open(path) as dump:
+                profile = json.load(dump)
+            self.assertTrue(
+                any(
+                    "export_rows" in function["function"]
+                    for function in profile["functions"]
+                )
+            )
+            # the lock was released when the stream closed
+            self.assertFalse(_profile_lock.locked())
+
+    def test_profiling_skips_the_payment_event_stream(self):
+        """Test a profiled event stream does not hold the profiler"""
+        with patch.dict(app.config, {"PROFILING_TOKEN": "secret"}):
+            response = self.app.get(
+                "/api/v1/payments/events",
+                headers={"X-Profile-Token": "secret"},
+            )
+            self.assertEqual(next(iter(response.response)), RETRY_FRAME)
+            self.assertNotIn(DUMP_HEADER, response.headers)
+            self.assertFalse(_profile_lock.locked())
+            self.assertFalse(tracemalloc.is_tracing())
+
+            # other requests can be profiled while the stream is open
+            profiled = self.app.post(
+                "/graphql/v1",
+                json={"query": "{ loans { id } }"},
+                headers={"X-Profile-Token": "secret"},
+            )
+            self.assertIn("profile", profiled.get_json()["extensions"])
+            response.close()
+
+    def test_persistent_store_restores_payments_after_restart(self):
+        """Test payments logged to disk are replayed on restart"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = self.open_persistent_store(directory)
+            with patch("state.store", new=store):
+                response = self.app.post(
+                    "/api/v1/payments",
+                    data=json.dumps(
+                        {
+                            "loan_id": 4,
+                            "payment_amount": 700.5,
+                            "payment_date": "2025-03-02",
+                        }
+                    ),
+                    content_type="application/json",
+                )
+                self.assertEqual(response.status_code, 201)
+                response = self.app.post(
+                    "/api/v1/payments/batch",
+                    data=json.dumps(
+                        [
+                            {
+                                "loan_id": 1,
+                                "payment_amount": 10.0,
+                                "payment_date": "2025-03-04",
+                            },
+                            {
+                                "loan_id": 2,
+                                "payment_amount": 20.0,
+                                "payment_date": "2025-03-03",
+                            },
+                        ]
+                    ),
+                    content_type="application/json",
+                )
+                self.assertEqual(response.status_code, 201)
+            store.add_payment(3, 5.0, None)
+            store.payment_log.close()
+
+            restored = self.open_persistent_store(directory)
+            self.assertEqual(
+                restored.get_portfolio_summary(), store.get_portfolio_summary()
+            )
+            self.assertEqual(
+                [p["id"] for p in restored.get_loan_payments(1)], [1, 5]
+            )
+            payments = restored.get_loan_payments(3)
+            self.assertEqual([p["id"] for p in payments], [3, 7])
+            self.assertIsNone(payments[1]["payment_date"])
+            self.assertEqual(restored.get_loan_payments(4)[0]["id"], 4)
+            self.assertEqual(
+                restored.get_loan_payments(4)[0]["payment_amount"], 700.5
+            )
+            self.assertEqual(restored.add_payment(3, 1.0, None)["id"], 8)
+
+    def test_persistent_store_snapshot_compacts_log(self):
+        """Test a snapshot replaces the log segments it covers"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = self.open_persistent_store(directory)
+            store.add_payments(
+                [
+                    {
+                        "loan_id": loan_id,
+                        "payment_amount": 100.0,
+                        "payment_date": datetime.date(2025, 3, loan_id),
+                    }
+                    for loan_id in (1, 2, 3, 4)
+                ]
+            )
+            store.payment_log.snapshot()
+            store.add_payment(4, 50.0, datetime.date(2025, 3, 20))
+            self.assertEqual(len(list_segments(directory)), 1)
+            store.payment_log.close()
+
+            restored = self.open_persistent_store(directory)
+            self.assertEqual(
+                [p["id"] for p in restored.find_payments()],
+                list(range(1, 9)),
+            )
+            self.assertEqual(
+                restored.get_portfolio_summary(), store.get_portfolio_summary()
+            )
+
+    def test_persistent_store_restores_indexes_from_snapshot(self):
+        """Test a restore adopts the snapshot's indexes, not reindexing"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = self.open_persistent_store(directory)
+            store.add_payments(
+                [
+                    {
+                        "loan_id": 1 + i % 4,
+                        "payment_amount": 10.0 + i,
+                        "payment_date": (
+                            None
+                            if i % 7 == 0
+                            else datetime.date(2025, 2, 20)
+                            + datetime.timedelta(days=i)
+                        ),
+                    }
+                    for i in range(40)
+                ]
+            )
+            store.payment_log.snapshot()
+            for day in (1, 2, 3):
+                store.add_payment(day, 5.0, datetime.date(2025, 5, day))
+            store.payment_log.close()
+
+            def check(restored):
+                for status in PAYMENT_STATUSES:
+                    self.assertEqual(
+                        [
+                            p["id"]
+                            for p in restored.find_payments(status=status)
+                        ],
+                        [p["id"] for p in store.find_payments(status=status)],
+                    )
+                dates = {
+                    "payment_date_from": datetime.date(2025, 3, 1),
+                    "payment_date_to": datetime.date(2025, 3, 15),
+                }
+                self.assertEqual(
+                    [p["id"] for p in restored.find_payments(**dates)],
+                    [p["id"] for p in store.find_payments(**dates)],
+                )
+                for loan_id in (1, 2, 3, 4):
+                    self.assertEqual(
+                        [p["id"] for p in restored.get_loan_payments(loan_id)],
+                        [p["id"] for p in store.get_loan_payments(loan_id)],
+                    )
+                self.assertEqual(
+                    restored.get_portfolio_summary(),
+                    store.get_portfolio_summary(),
+                )
+                as_of = datetime.date(2025, 6, 1)
+                self.assertEqual(
+                    restored.get_delinquency_aging(as_of),
+                    store.get_delinquency_aging(as_of),
+                )
+
+            # only the payments logged after the snapshot are indexed
+            with patch.object(
+                self.store_class, "payment_indexes"
+            ) as payment_indexes, patch.object(
+                self.store_class,
+                "_index_payment",
+                autospec=True,
+                side_effect=self.store_class._index_payment,
+            ) as index_payment:
+                restored = self.open_persistent_store(directory)
+            payment_indexes.assert_not_called()
+            self.assertEqual(index_payment.call_count, 3)
+            check(restored)
+            restored.payment_log.close()
+
+            # version 1 snapshots have no indexes, they are built again
+            path = os.path.join(directory, storage.wal.SNAPSHOT_FILE)
+            with open(path, "r+b") as snapshot_file:
+                _, count, _ = storage.wal.SNAPSHOT_HEADER.unpack(
+                    snapshot_file.read(storage.wal.SNAPSHOT_HEADER.size)
+                )
+                snapshot_file.seek(0)
+                snapshot_file.write(storage.wal.SNAPSHOT_MAGIC_V1)
+                snapshot_file.truncate(
+                    storage.wal.SNAPSHOT_HEADER.size + count * (8 + 8 + 8 + 4)
+                )
+            check(self.open_persistent_store(directory))
+
+    def test_persistent_store_snapshots_in_background(self):
+        """Test a snapshot is taken after snapshot_every payments"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = self.open_persistent_store(directory, snapshot_every=2)
+            store.add_payments(
+                [
+                    {"loan_id": 1, "payment_amount": 1.0, "payment_date": None}
+                    for _ in range(2)
+                ]
+            )
+            store.payment_log.snapshot_thread.join()
+            self.assertTrue(
+                os.path.exists(os.path.join(directory, "snapshot.bin"))
+            )
+
+    def test_persistent_store_adds_payments_during_snapshots(self):
+        """Test payments added while a snapshot is written all land"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = self.open_persistent_store(directory)
+            write_snapshot = storage.wal.write_snapshot
+
+            def write_while_adding(directory, columns, *args):
+                # the snapshot buffers are exported while a payment is
+                # added, like a writer racing the background snapshot
+                buffers = [memoryview(column) for column in columns._columns()]
+                try:
+                    store.add_payment(4, 5.0, datetime.date(2025, 3, 9))
+                finally:
+                    for buffer in buffers:
+                        buffer.release()
+                write_snapshot(directory, columns, *args)
+
+            with patch("storage.wal.write_snapshot", write_while_adding):
+                store.payment_log.snapshot()
+            store.add_payment(4, 6.0, datetime.date(2025, 3, 10))
+            store.payment_log.close()
+
+            self.assertEqual(
+                [p["id"] for p in store.find_payments()], [1, 2, 3, 4, 5]
+            )
+            restored = self.open_persistent_store(directory)
+            self.assertEqual(
+                restored.get_portfolio_summary(), store.get_portfolio_summary()
+            )
+
+    def test_payment_columns_append_is_all_or_nothing(self):
+        """Test a rejected value leaves every column the same length"""
+        columns = PaymentColumns()
+        columns.append(1, 4, 10.0, datetime.date(2025, 3, 1))
+        with self.assertRaises(OverflowError):
+            columns.append(2, 2**70, 10.0, None)
+        with self.assertRaises(TypeError):
+            columns.append(2, 4, "10", None)
+        self.assertEqual(
+            [len(column) for column in columns._columns()], [1, 1, 1, 1]
+        )
+        self.assertEqual(columns.append(2, 4, None, None).id, 2)
+
+    def test_persistent_store_ignores_torn_log_tail(self):
+        """Test a partially written record at the log tail is dropped"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = self.open_persistent_store(directory)
+            store.add_payment(4, 300.0, datetime.date(2025, 3, 2))
+            store.payment_log.close()
+            segment = list_segments(directory)[-1]
+            with open(segment_path(directory, segment), "ab") as log_file:
+                log_file.write(b"\x05\x00\x00")
+
+            restored = self.open_persistent_store(directory)
+            self.assertEqual(len(restored.loan_payments), 4)
+            restored.add_payment(4, 400.0, datetime.date(2025, 3, 3))
+            restored.payment_log.close()
+
+            restored = self.open_persistent_store(directory)
+            self.assertEqual(
+                [p["payment_amount"] for p in restored.get_loan_payments(4)],
+                [300.0, 400.0],
+            )
+
+    def test_persistent_store_commits_concurrent_writers(self):
+        """Test every concurrently added payment is durable"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = self.open_persistent_store(directory)
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                list(
+                    executor.map(
+                        lambda i: store.add_payment(
+                            i % 4 + 1, float(i), datetime.date(2025, 3, 5)
+                        ),
+                        range(200),
+                    )
+                )
+            store.payment_log.close()
+
+            restored = self.open_persistent_store(directory)
+            self.assertEqual(len(restored.loan_payments), 203)
+            self.assertEqual(
+                restored.get_portfolio_summary(), store.get_portfolio_summary()
+            )
+
+    def test_generated_data_is_reproducible(self):
+        """Test the benchmark data generator is deterministic per seed"""
+        loans = generate_loans(50, seed=7)
+        payments = generate_payments(loans, 500, seed=7)
+        self.assertEqual(loans, generate_loans(50, seed=7))
+        self.assertEqual(payments, generate_payments(loans, 500, seed=7))
+        self.assertNotEqual(payments, generate_payments(loans, 500, seed=8))
+        self.assertEqual([p["id"] for p in payments], list(range(1, 501)))
+
+        # every payment status shows up
+        store = self.store_class(loans, payments)
+        for status in PAYMENT_STATUSES:
+            self.assertTrue(store.find_payments(status=status), status)
+
+    def test_benchmarks_report_every_benchmark(self):
+        """Test a tiny benchmark run reports and compares all results"""
+        with patch.object(state, "loans"), patch.object(
+            state, "loan_payments"
+        ), patch.object(state, "store"):
+            report = run_benchmarks(
+                20, 200, iterations=2, store_class=self.store_class
+            )
+
+        self.assertEqual(report["meta"]["payments"], 200)
+        self.assertEqual(set(report["results"]), set(BENCHMARKS))
+        for result in report["results"].values():
+            self.assertEqual(result["iterations"], 2)
+            self.assertLessEqual(result["min_ms"], result["max_ms"])
+
+        slower = json.loads(json.dumps(report))
+        slower["results"]["rest_add_payment"]["median_ms"] *= 2
+        regressed = [
+            row[0] for row in compare_results(report, slower) if row[-1]
+        ]
+        self.assertEqual(regressed, ["rest_add_payment"])
+
+    def test_benchmarks_run_above_the_cost_limit(self):
+        """Test the nested query is timed over the default cost limit"""
+        with patch.object(state, "loans"), patch.object(
+            state, "loan_payments"
+        ), patch.object(state, "store"):
+            report = run_benchmarks(
+                100,
+                10_100,
+                iterations=1,
+                store_class=self.store_class,
+                names=["graphql_nested_loans"],
+            )
+            # 100 loans of 101 payments each
+            _, data = self.graphql(NESTED_LOANS_QUERY)
+
+        self.assertGreater(
+            data["extensions"]["cost"]["requestedQueryCost"],
+            DEFAULT_MAX_QUERY_COST,
+        )
+        self.assertEqual(report["meta"]["max_cost"], None)
+        self.assertEqual(
+            report["results"]["graphql_nested_loans"]["iterations"], 1
+        )
+        self.assertEqual(graphql_backend.max_cost, DEFAULT_MAX_QUERY_COST)
+
+    def test_metrics_report_graphql_and_rest_timings(self):
+        """Test /metrics exposes resolver, phase and REST histograms"""
+        with patch.dict(app.config, {"METRICS_SAMPLE_RATE": 1.0}):
+            self.graphql(
+                "query Portfolio { loans { id loanPayments { id status } } }"
+            )
+        self.app.post(
+            "/api/v1/payments",
+            data=json.dumps(
+                {
+                    "loan_id": 4,
+                    "payment_amount": 10.0,
+                    "payment_date": "2025-03-10",
+                }
+            ),
+            content_type="application/json",
+        )
+
+        response = self.app.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        text = response.get_data(as_text=True)
+        for series in (
+            'graphql_resolver_seconds_count{field="Query.loans"}',
+            'graphql_resolver_seconds_count{field="ExistingLoans.loanPayments"}',
+            'graphql_resolver_seconds_count{field="LoanPayment.status"}',
+            'graphql_phase_seconds_count{phase="parse"}',
+            'graphql_phase_seconds_count{phase="execute"}',
+            'graphql_phase_seconds_count{phase="encode"}',
+            'graphql_operation_seconds_count{operation="Portfolio"}',
+            'graphql_loader_batch_seconds_count{loader="payment_status"}',
+            'http_request_seconds_count{method="POST",'
+            'endpoint="/api/v1/payments",status="201"}',
+        ):
+            self.assertIn(series, text)
+
+    def test_metrics_sample_rate_skips_resolver_timing(self):
+        """Test unsampled requests do not time their resolvers"""
+        GRAPHQL_RESOLVER_SECONDS.clear()
+        with patch.dict(app.config, {"METRICS_SAMPLE_RATE": 0.0}):
+            response, data = self.graphql("{ loans { id } }")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data["data"]["loans"]), 4)
+        self.assertNotIn(
+            "graphql_resolver_seconds_count",
+            self.app.get("/metrics").get_data(as_text=True),
+        )
+
+    def test_json_encoders_write_the_same_bytes(self):
+        """Test every encoder matches the json module byte for byte"""
+        payload = {
+            "loans": [
+                {
+                    "id": 1,
+                    "name": "Tom's Loan",
+                    "principal": 10000,
+                    "interestRate": 5.0,
+                    "dueDate": datetime.date(2025, 3, 1),
+                    "loanPayments": [],
+                }
+            ],
+            "b": {"nested": [None, True, 0.1, -3]},
+            "a": "Caf\u00e9 \U0001f4b0",
+            "big": 2**70,
+            7: "non string key",
+        }
+        for name, encoder in ENCODERS.items():
+            for pretty in (False, True):
+                for sort_keys in (False, True):
+                    # the json module can't sort mixed key types
+                    data = {
+                        key: value
+                        for key, value in payload.items()
+                        if not sort_keys or isinstance(key, str)
+                    }
+                    options = {"pretty": pretty, "sort_keys": sort_keys}
+                    with self.subTest(encoder=name, **options):
+                        self.assertEqual(
+                            encoder(data, **options),
+                            json.dumps(
+                                data,
+                                default=str,
+                                sort_keys=sort_keys,
+                                indent=2 if pretty else None,
+                                separators=(
+                                    (",", ": ") if pretty else (",", ":")
+                                ),
+                            ).encode(),
+                        )
+
+    def test_responses_match_the_default_encoders(self):
+        """Test fast encoding leaves graphql and REST responses unchanged"""
+        response, data = self.graphql(
+            "{ loans { id name dueDate loanPayments { paymentDate } } }"
+        )
+        self.assertEqual(response.data, json_encode(data).encode())
+
+        response = self.app.post(
+            "/api/v1/payments",
+            data=json.dumps(
+                {
+                    "loan_id": 1,
+                    "payment_amount": 250.5,
+                    "payment_date": "2025-03-10",
+                }
+            ),
+            content_type="application/json",
+        )
+        data = json.loads(response.data)
+        self.assertEqual(data["payment"]["payment_date"], "2025-03-10")
+        self.assertEqual(
+            response.data,
+            DefaultJSONProvider(app).response(data).get_data(),
+        )
+
+    def test_histogram_renders_cumulative_buckets(self):
+        """Test histogram text output and the label set limit"""
+        histogram = Histogram(
+            "latency_seconds",
+            "test latency",
+            ["path"],
+            buckets=(0.1, 1.0),
+            max_series=2,
+        )
+        histogram.observe(0.05, 'a"b')
+        histogram.observe(0.5, 'a"b')
+        histogram.observe(5.0, 'a"b')
+        histogram.observe(0.5, "c")
+        histogram.observe(0.5, "d")
+
+        lines = histogram.render().splitlines()
+        self.assertEqual(lines[1], "# TYPE latency_seconds histogram")
+        self.assertEqual(
+            lines[2:7],
+            [
+                'latency_seconds_bucket{path="a\\"b",le="0.1"} 1',
+                'latency_seconds_bucket{path="a\\"b",le="1.0"} 2',
+                'latency_seconds_bucket{path="a\\"b",le="+Inf"} 3',
+                'latency_seconds_sum{path="a\\"b"} 5.55',
+                'latency_seconds_count{path="a\\"b"} 3',
+            ],
+        )
+        # the third label set is folded into the overflow series
+        self.assertIn('latency_seconds_count{path="other"} 1', lines)
+
     # utils func tests 
     def test_get_payment_status_on_time(self):
         """Test payment status calculation for on-time payment"""
@@ -344,6 +2531,66 @@ class FlaskAppTestCase(unittest.TestCase):
         # (days_late = -2, which is <= 5)
         self.assertEqual(status, "On Time")
 
+    def test_get_payment_statuses_matches_scalar(self):
+        """Test batch status codes match the scalar function boundaries"""
+        due_date = datetime.date(2025, 3, 1)
+        payment_dates = [
+            due_date + datetime.timedelta(days=offset)
+            for offset in range(-3, 40)
+        ] + [None]
+
+        codes = get_payment_statuses(
+            [due_date.toordinal()] * len(payment_dates),
+            [d.toordinal() if d else NO_DATE for d in payment_dates],
+        )
+
+        expected = (
+            ["On Time"] * 9 + ["Late"] * 25 + ["Defaulted"] * 9 + ["Unpaid"]
+        )
+        self.assertEqual([PAYMENT_STATUSES[code] for code in codes], expected)
+        self.assertEqual(
+            [
+                PAYMENT_STATUSES[
+                    get_payment_status_code(
+                        due_date.toordinal(),
+                        d.toordinal() if d else NO_DATE,
+                    )
+                ]
+                for d in payment_dates
+            ],
+            expected,
+        )
+        self.assertEqual(
+            [
+                get_payment_status(
+                    {"due_date": due_date}, {"payment_date": payment_date}
+                )
+                for payment_date in payment_dates
+            ],
+            expected,
+        )
+
+    @unittest.skipIf(utils.np is None, "numpy is not installed")
+    def test_get_payment_statuses_vectorized_matches_pure(self):
+        """Test numpy status codes match the pure Python ones"""
+        np = utils.np
+        due_date = datetime.date(2025, 3, 1).toordinal()
+        payment_dates = [due_date + offset for offset in range(-3, 40)]
+        payment_dates.append(NO_DATE)
+        due_dates = [due_date] * len(payment_dates)
+
+        expected = list(get_payment_statuses(due_dates, payment_dates))
+        for args in (
+            (np.array(due_dates), np.array(payment_dates)),
+            # either array picks the numpy path
+            (due_dates, np.array(payment_dates, dtype=np.int32)),
+            (np.array(due_dates), payment_dates),
+        ):
+            codes = get_payment_statuses(*args)
+            self.assertIsInstance(codes, np.ndarray)
+            self.assertEqual(codes.dtype, np.int8)
+            self.assertEqual(codes.tolist(), expected)
+
     def test_get_payment_status_on_due_date(self):
         """Test payment status for payment on due date"""
         loan = {
@@ -354,6 +2601,258 @@ class FlaskAppTestCase(unittest.TestCase):
         status = get_payment_status(loan, payment)
         self.assertEqual(status, "On Time")
 
+    def test_amortization_schedule_pays_off_the_principal(self):
+        """Test schedules end on the due date with a zero balance"""
+        schedule = amortization.amortization_schedule(
+            10000, 5.0, 12, datetime.date(2025, 3, 31)
+        )
+        self.assertEqual(len(schedule), 12)
+        self.assertEqual(schedule[0].due_date, datetime.date(2024, 4, 30))
+        self.assertEqual(schedule[10].due_date, datetime.date(2025, 2, 28))
+        self.assertEqual(schedule[-1].due_date, datetime.date(2025, 3, 31))
+        self.assertEqual(schedule[-1].balance, 0)
+        self.assertAlmostEqual(
+            sum(installment.principal for installment in schedule), 10000
+        )
+        self.assertEqual(schedule[0].interest, 41.67)
+
+        # no interest, equal installments of the principal
+        schedule = amortization.amortization_schedule(
+            1200, 0, 4, datetime.date(2025, 1, 15)
+        )
+        self.assertEqual({i.amount for i in schedule}, {300})
+
+    def test_loan_balances_use_the_loan_term(self):
+        """Test loans with term_months get that many installments"""
+        loans = deepcopy(self.loans_fixture[:2])
+        loans[0]["term_months"] = 2
+        store = self.store_class(loans, [])
+        if hasattr(store, "close"):
+            self.addCleanup(store.close)
+
+        short, default, missing = store.get_loan_balances([1, 2, 99])
+        self.assertIsNone(missing)
+        self.assertEqual(short.next_payment_due, datetime.date(2025, 2, 1))
+        self.assertEqual(default.next_payment_due, datetime.date(2024, 4, 1))
+        self.assertEqual(store.get_loan(1)["term_months"], 2)
+        self.assertNotIn("term_months", store.get_loan(2))
+
+
+class ColumnarFlaskAppTestCase(FlaskAppTestCase):
+    """run the app tests against the columnar payment store"""
+
+    store_class = ColumnarStore
+
+    def test_columnar_store_is_smaller_than_dict_store(self):
+        """Test columnar payments use less memory than payment dicts"""
+        columnar = measure_footprint(ColumnarStore, 5000, loan_count=100)
+        dicts = measure_footprint(MemoryStore, 5000, loan_count=100)
+        self.assertLess(columnar * 3, dicts)
+
+
+class SQLiteFlaskAppTestCase(FlaskAppTestCase):
+    """run the app tests against the SQLite store"""
+
+    store_class = SQLiteStore
+    in_memory = False
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(state.store.close)
+
+    def test_sqlite_store_uses_wal_journal(self):
+        """Test the database runs in WAL mode with the payment indexes"""
+        conn = state.store._connection()
+        self.assertEqual(
+            conn.execute("PRAGMA journal_mode").fetchone()[0], "wal"
+        )
+        indexes = {
+            row[1] for row in conn.execute("PRAGMA index_list(loan_payments)")
+        }
+        self.assertEqual(
+            indexes,
+            {
+                "idx_loan_payments_loan_id",
+                "idx_loan_payments_payment_date",
+                "idx_loan_payments_status",
+            },
+        )
+
+    def test_sqlite_store_releases_connections_after_requests(self):
+        """Test request threads hand their connections back to the pool"""
+
+        statuses = []
+
+        def request():
+            response = self.app.post(
+                "/graphql/v1", json={"query": "{ loans { id } }"}
+            )
+            statuses.append(response.status_code)
+            # the streamed export reads the store after the teardown
+            response = self.app.get("/api/v1/export")
+            response.get_data()
+            response.close()
+            statuses.append(response.status_code)
+
+        state.store.release_connection()
+        for _ in range(20):
+            thread = threading.Thread(target=request)
+            thread.start()
+            thread.join()
+        self.assertEqual(statuses, [200] * 40)
+        self.assertEqual(len(state.store._connections), 1)
+
+        # connections over the pool size are closed when released
+        store = SQLiteStore(self.mocked_loans, pool_size=1)
+        self.addCleanup(store.close)
+        barrier = threading.Barrier(3)
+
+        def query():
+            store.get_loan(1)
+            barrier.wait()
+            store.release_connection()
+
+        threads = [threading.Thread(target=query) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        store.release_connection()
+        self.assertEqual(len(store._connections), 1)
+        self.assertEqual(store.get_loan(1)["id"], 1)
+
+    def test_sqlite_store_rejects_persistence_dir(self):
+        """Test the sqlite backend with PERSISTENCE_DIR fails to start"""
+        with tempfile.TemporaryDirectory() as directory:
+            env = {
+                **os.environ,
+                "STORE_BACKEND": "sqlite",
+                "SQLITE_PATH": os.path.join(directory, "numida.db"),
+                "PERSISTENCE_DIR": directory,
+            }
+            result = subprocess.run(
+                [sys.executable, "-c", "import state"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                env=env,
+                capture_output=True,
+                text=True,
+            )
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn(
+            "ValueError: PERSISTENCE_DIR only applies", result.stderr
+        )
+
+    def test_sqlite_benchmarks_use_a_fresh_database(self):
+        """Test benchmark data never lands in the configured database"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "numida.db")
+            configured = SQLiteStore(self.mocked_loans, path=path)
+            self.addCleanup(configured.close)
+            with patch.object(state, "loans"), patch.object(
+                state, "loan_payments"
+            ), patch.object(state, "store"), patch.object(
+                state, "STORE_BACKEND", "sqlite"
+            ), patch.dict(
+                state.STORE_BACKENDS,
+                {"sqlite": partial(SQLiteStore, path=path)},
+            ):
+                store = populate_state(20, 200)
+                self.addCleanup(store.close)
+
+            self.assertNotEqual(store.path, path)
+            self.assertEqual(store.get_loan(1)["name"], "Loan 1")
+            self.assertEqual(len(store.find_payments()), 200)
+            self.assertEqual(configured.get_loans(), self.mocked_loans)
+
+    def test_sqlite_store_shares_data_between_stores(self):
+        """Test a write through one store is seen by another on the file"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "numida.db")
+            worker = SQLiteStore(
+                self.mocked_loans, self.mocked_loan_payments, path=path
+            )
+            other = SQLiteStore(
+                self.mocked_loans, self.mocked_loan_payments, path=path
+            )
+            self.addCleanup(worker.close)
+            self.addCleanup(other.close)
+
+            # seeding twice does not duplicate rows
+            self.assertEqual(len(other.find_payments()), 3)
+            version = other.version
+            payment = worker.add_payment(4, 250.0, datetime.date(2025, 3, 2))
+            self.assertEqual(payment["id"], 4)
+            self.assertEqual(other.get_loan_payments(4), [payment])
+            self.assertEqual(other.version, version + 1)
+
+    def test_sqlite_store_backfills_amounts_paid(self):
+        """Test database files from before balances and counters migrate"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "numida.db")
+            old = SQLiteStore(
+                self.mocked_loans, self.mocked_loan_payments, path=path
+            )
+            expected = old.get_loan_balances([1, 2, 3, 4])
+            summary = old.get_portfolio_summary()
+            late = old.find_payments(status="Late")
+            conn = old._connection()
+            conn.execute("DROP TRIGGER loan_payments_amount_paid")
+            conn.execute("DROP TABLE loan_amount_paid")
+            conn.execute("ALTER TABLE loans DROP COLUMN term_months")
+            for trigger in (
+                "loans_status_counts",
+                "loans_status_change",
+                "loan_payments_totals",
+            ):
+                conn.execute(f"DROP TRIGGER {trigger}")
+            conn.execute("DROP TABLE loan_status_counts")
+            conn.execute("DROP TABLE payment_totals")
+            conn.execute("DROP INDEX idx_loan_payments_status")
+            conn.execute("ALTER TABLE loan_payments DROP COLUMN status")
+            for column in ("status", "last_payment_date", "last_payment_id"):
+                conn.execute(f"ALTER TABLE loans DROP COLUMN {column}")
+            old.close()
+
+            store = SQLiteStore(path=path)
+            self.addCleanup(store.close)
+            self.assertEqual(store.get_loan_balances([1, 2, 3, 4]), expected)
+            self.assertEqual(store.get_portfolio_summary(), summary)
+            self.assertEqual(store.find_payments(status="Late"), late)
+            store.add_payment(2, 100.0, datetime.date(2025, 3, 2))
+            self.assertEqual(
+                store.get_loan_balances([2])[0].amount_paid, 5100.0
+            )
+            # the migrated counters keep following the payments
+            store.add_payment(4, 100.0, datetime.date(2025, 3, 2))
+            summary = store.get_portfolio_summary()
+            self.assertEqual(summary["loan_status_counts"]["Unpaid"], 0)
+            self.assertEqual(summary["payment_count"], 5)
+
+    def test_sqlite_store_pages_like_keyset_page(self):
+        """Test SQL pages match keyset_page for every argument mix"""
+        store = state.store
+        loans = store.get_loans()
+        for args in (
+            {"first": 2},
+            {"first": 0},
+            {"first": 2, "after": 1},
+            {"first": 3, "last": 1},
+            {"first": 2, "last": 0},
+            {"last": 2},
+            {"last": 0},
+            {"last": 0, "before": 3},
+            {"last": 2, "before": 4},
+            {"after": 2, "before": 3},
+            {"after": 4},
+            {"after": 3, "before": 2, "last": 1},
+            {},
+        ):
+            with self.subTest(**args):
+                self.assertEqual(
+                    store.page_loans(**args),
+                    keyset_page(loans, lambda loan: loan["id"], **args),
+                )
+
 
 if __name__ == "__main__":
     unittest.main()
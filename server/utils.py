@@ -1,3 +1,89 @@
+import datetime
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, plain sequences are classified
+    np = None
+
+# status codes returned by get_payment_statuses index this tuple
+PAYMENT_STATUSES = ("On Time", "Late", "Defaulted", "Unpaid")
+ON_TIME, LATE, DEFAULTED, UNPAID = range(len(PAYMENT_STATUSES))
+
+# payment date ordinal for payments without a date
+NO_DATE = 0
+
+# most days after the due date a payment is still On Time, or Late
+ON_TIME_DAYS = 5
+LATE_DAYS = 30
+
+# aging buckets of unpaid loans, name -> (min, max) days past the due
+# date, None is unbounded, the thresholds are the payment status ones
+AGING_BUCKETS = {
+    "Not Due": (None, -1),
+    "0-5": (0, ON_TIME_DAYS),
+    "6-30": (ON_TIME_DAYS + 1, LATE_DAYS),
+    "30+": (LATE_DAYS + 1, None),
+}
+
+
+def get_payment_status_code(due_date, payment_date):
+    """status code of one payment, dates are day ordinals
+
+    payment_date is NO_DATE if unpaid, the scalar version of
+    get_payment_statuses for per row callers
+    """
+    if payment_date == NO_DATE:
+        return UNPAID
+    days_late = payment_date - due_date
+    if days_late <= ON_TIME_DAYS:
+        return ON_TIME
+    if days_late <= LATE_DAYS:
+        return LATE
+    return DEFAULTED
+
+
+def get_payment_statuses(due_dates, payment_dates):
+    """get status codes for many loan/payment pairs in one pass
+
+    Args:
+        due_dates: loan due dates as day ordinals
+        payment_dates: payment dates as day ordinals, NO_DATE if unpaid,
+            aligned with due_dates
+
+    Returns:
+        status codes indexing PAYMENT_STATUSES, a numpy int8 array when
+        either input is a numpy array otherwise an array('b')
+    """
+    if np is not None and (
+        isinstance(due_dates, np.ndarray)
+        or isinstance(payment_dates, np.ndarray)
+    ):
+        due_dates = np.asarray(due_dates, dtype=np.int64)
+        payment_dates = np.asarray(payment_dates, dtype=np.int64)
+        days_late = payment_dates - due_dates
+        codes = np.full(days_late.shape, DEFAULTED, dtype=np.int8)
+        codes[days_late <= LATE_DAYS] = LATE
+        codes[days_late <= ON_TIME_DAYS] = ON_TIME
+        codes[payment_dates == NO_DATE] = UNPAID
+        return codes
+
+    codes = array("b")
+    for due_date, payment_date in zip(due_dates, payment_dates):
+        if payment_date == NO_DATE:
+            codes.append(UNPAID)
+            continue
+
+        days_late = payment_date - due_date
+        if days_late <= ON_TIME_DAYS:
+            codes.append(ON_TIME)
+        elif days_late <= LATE_DAYS:
+            codes.append(LATE)
+        else:
+            codes.append(DEFAULTED)
+    return codes
+
+
 def get_payment_status(loan, payment):
     """get payment status by comparing the payment date to the due date
 
@@ -9,16 +95,29 @@ def get_payment_status(loan, payment):
         status of On Time, Late, Defaulted or Unpaid
     """
     payment_date = payment["payment_date"] if payment else None
-    due_date = loan["due_date"]
-
     if not payment_date:
-        return "Unpaid"
+        return PAYMENT_STATUSES[UNPAID]
 
-    days_late = (payment_date - due_date).days
+    days_late = (payment_date - loan["due_date"]).days
+    if days_late <= ON_TIME_DAYS:
+        return PAYMENT_STATUSES[ON_TIME]
+    if days_late <= LATE_DAYS:
+        return PAYMENT_STATUSES[LATE]
+    return PAYMENT_STATUSES[DEFAULTED]
 
-    if days_late <= 5:
-        return "On Time"
-    elif 6 <= days_late <= 30:
-        return "Late"
-    else:
-        return "Defaulted"
+
+def get_aging_due_range(bucket, as_of):
+    """due dates of the loans in an aging bucket as of a date
+
+    Args:
+        bucket: name of one of the AGING_BUCKETS
+        as_of: date the days past due are counted up to
+
+    Returns:
+        inclusive (due_date_from, due_date_to), None when unbounded
+    """
+    min_days, max_days = AGING_BUCKETS[bucket]
+    return (
+        None if max_days is None else as_of - datetime.timedelta(max_days),
+        None if min_days is None else as_of - datetime.timedelta(min_days),
+    )